@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""benchmarks
+
+    Performance benchmarks for the Streamflow Prediction Tool
+    using synthetic RAPID/ECMWF datasets.
+
+    License: BSD 3-Clause
+"""
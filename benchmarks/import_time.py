@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""import_time.py
+
+    This module measures the time to import the modules of the
+    Streamflow Prediction Tool in a fresh interpreter and checks
+    that the heavy dependencies are not imported with them.
+
+    Run inside of the Tethys environment:
+
+        python -m benchmarks.import_time --budget-ms 500
+
+    License: BSD 3-Clause
+"""
+from argparse import ArgumentParser
+from json import dump as json_dump, loads as json_loads
+import subprocess
+import sys
+
+import numpy as np
+
+APP_PACKAGE = 'tethys_apps.tethysapp.streamflow_prediction_tool'
+# modules imported by the portal or the management commands on startup
+APP_MODULES = (
+    'controllers',
+    'controllers_ajax',
+    'controllers_api',
+    'spt_download_forecasts',
+    'spt_generate_historical_aggregates',
+    'spt_refresh_geoserver_layers',
+    'spt_run_jobs',
+)
+# dependencies that are only imported by the code paths that use them
+HEAVY_MODULES = (
+    'netCDF4',
+    'pandas',
+    'plotly.graph_objs',
+    'pyproj',
+    'scipy.stats',
+    'shapefile',
+    'spt_dataset_manager',
+    'tethys_dataset_services',
+    'xarray',
+)
+
+# runs in the subprocess: time the import after Django is set up
+_IMPORT_SCRIPT = """
+import json, os, sys
+from timeit import default_timer
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+import django
+django.setup()
+start_time = default_timer()
+__import__(sys.argv[1])
+import_ms = (default_timer() - start_time) * 1000
+print(json.dumps({{
+    'import_ms': import_ms,
+    'heavy_modules': [module for module in {heavy_modules!r}
+                      if module in sys.modules],
+}}))
+"""
+
+
+def time_module_import(module_name):
+    """
+    Imports the app module in a new Python process
+
+    Returns
+    -------
+    dict with the import time in milliseconds
+    and the heavy modules that were imported
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         _IMPORT_SCRIPT.format(heavy_modules=HEAVY_MODULES),
+         '{0}.{1}'.format(APP_PACKAGE, module_name)])
+    return json_loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def run_import_benchmarks(module_names=APP_MODULES, repeat=5):
+    """
+    Times the import of each app module
+
+    Returns
+    -------
+    list of (name, result) for each module
+    """
+    results = []
+    for module_name in module_names:
+        module_runs = [time_module_import(module_name)
+                       for _ in range(repeat)]
+        results.append((module_name, {
+            'runs': repeat,
+            'p50_ms': float(np.percentile(
+                [module_run['import_ms'] for module_run in module_runs], 50)),
+            'heavy_modules': module_runs[-1]['heavy_modules'],
+        }))
+    return results
+
+
+def print_results(results):
+    """
+    Prints the import times as a table
+    """
+    row_format = '{0:<38}{1:>6}{2:>12}  {3}'
+    print(row_format.format('module', 'runs', 'p50 (ms)', 'heavy modules'))
+    for name, result in results:
+        print(row_format.format(name,
+                                result['runs'],
+                                '{0:.1f}'.format(result['p50_ms']),
+                                ', '.join(result['heavy_modules'])))
+
+
+def main():
+    """
+    Runs the import benchmarks from the command line
+    """
+    parser = ArgumentParser(description='Measures the import time of the '
+                                        'Streamflow Prediction Tool '
+                                        'modules.')
+    parser.add_argument('--modules', nargs='*', default=list(APP_MODULES),
+                        help='Names of the app modules to import.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float,
+                        help='Exit with an error if a module takes longer '
+                             'to import or imports a heavy module.')
+    parser.add_argument('--json',
+                        help='Path to write the results as JSON.')
+    args = parser.parse_args()
+
+    results = run_import_benchmarks(args.modules, repeat=args.repeat)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json_dump({'results': dict(results)}, outfile,
+                      indent=2, sort_keys=True)
+
+    if args.budget_ms is not None:
+        over_budget = [name for name, result in results
+                       if result['p50_ms'] > args.budget_ms
+                       or result['heavy_modules']]
+        if over_budget:
+            print('Over the import budget of {0:.0f} ms: {1}'
+                  .format(args.budget_ms, ', '.join(over_budget)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
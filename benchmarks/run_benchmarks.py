@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""run_benchmarks.py
+
+    This module times the main request paths of the Streamflow
+    Prediction Tool against a synthetic watershed and reports
+    the p50/p95 latency and peak memory of each.
+
+    Run inside of the Tethys environment:
+
+        python -m benchmarks.run_benchmarks --num-rivids 1000
+
+    License: BSD 3-Clause
+"""
+from argparse import ArgumentParser
+from contextlib import contextmanager
+import gc
+from json import dump as json_dump
+import os
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp
+import threading
+from timeit import default_timer
+
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+from .synthetic_data import (generate_synthetic_watershed,
+                             load_synthetic_watershed)
+
+
+def _setup_django():
+    """
+    Configures Django with the Tethys portal settings
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def synthetic_settings(app, custom_settings):
+    """
+    Points the app custom settings to the synthetic watershed
+    """
+    # the setting lookup is usually inherited from TethysAppBase
+    original_get_custom_setting = app.__dict__.get('get_custom_setting')
+
+    def get_custom_setting(name):
+        """Return the synthetic setting (None if not set)"""
+        return custom_settings.get(name)
+
+    app.get_custom_setting = staticmethod(get_custom_setting)
+    try:
+        yield
+    finally:
+        if original_get_custom_setting is None:
+            del app.get_custom_setting
+        else:
+            app.get_custom_setting = original_get_custom_setting
+
+
+def get_benchmark_cases(watershed_info):
+    """
+    Returns the (name, function, parameters, is_api) benchmark cases
+    for the main request paths of the app
+    """
+    from tethys_apps.tethysapp.streamflow_prediction_tool import (
+        controllers_ajax,
+        controllers_api,
+        controllers_functions,
+    )
+
+    rivids = watershed_info['rivids']
+    watershed_params = {
+        'watershed_name': watershed_info['watershed_name'],
+        'subbasin_name': watershed_info['subbasin_name'],
+    }
+    reach_params = dict(watershed_params,
+                        reach_id=str(rivids[rivids.size // 2]))
+
+    return [
+        ('forecast_statistics',
+         controllers_functions.get_ecmwf_forecast_statistics,
+         reach_params, False),
+        ('forecast_hydrograph',
+         controllers_ajax.get_ecmwf_hydrograph_plot,
+         reach_params, False),
+        ('forecast_csv',
+         controllers_api.get_ecmwf_forecast,
+         dict(reach_params, return_format='csv'), True),
+        ('forecast_waterml',
+         controllers_api.get_ecmwf_forecast,
+         dict(reach_params, stat_type='mean'), True),
+        ('historical_series',
+         controllers_functions.get_historic_streamflow_series,
+         reach_params, False),
+        ('historical_daily_series',
+         controllers_functions.get_historic_streamflow_series,
+         dict(reach_params, resolution='daily'), False),
+        ('historical_hydrograph',
+         controllers_ajax.get_historical_hydrograph,
+         reach_params, False),
+        ('historical_csv',
+         controllers_api.get_historic_data,
+         dict(reach_params, return_format='csv'), True),
+        ('historical_waterml',
+         controllers_api.get_historic_data,
+         reach_params, True),
+        ('seasonal_daily_chart',
+         controllers_ajax.get_daily_seasonal_streamflow_chart,
+         reach_params, False),
+        ('seasonal_monthly_chart',
+         controllers_ajax.get_monthly_seasonal_streamflow_chart,
+         reach_params, False),
+        ('flow_duration_curve',
+         controllers_ajax.get_flow_duration_curve,
+         reach_params, False),
+        ('warning_points',
+         controllers_ajax.generate_warning_points,
+         dict(watershed_params, return_period='2',
+              forecast_folder=watershed_info['forecast_folder']), False),
+        ('warning_points_bbox',
+         controllers_ajax.get_warning_points_bbox,
+         dict(watershed_params, return_period='2',
+              forecast_folder=watershed_info['forecast_folder'],
+              bbox='-97,33,-93,37', zoom='6'), False),
+        ('warning_points_group',
+         controllers_ajax.get_warning_points_group,
+         dict(watershed_params, return_period='2,10,20',
+              forecast_folder=watershed_info['forecast_folder']), False),
+    ]
+
+
+def _consume_response(result):
+    """
+    Reads the full content of a response so that streamed and
+    lazily rendered content is included in the timing
+    """
+    status_code = getattr(result, 'status_code', None)
+    if status_code is None:
+        return result
+    if status_code != 200:
+        content = b''.join(result.streaming_content) \
+            if getattr(result, 'streaming', False) else result.content
+        raise RuntimeError('Request failed with status {0}: {1}'
+                           .format(status_code, content[:200]))
+    if getattr(result, 'streaming', False):
+        return b''.join(result.streaming_content)
+    return result.content
+
+
+def _peak_memory_start():
+    """
+    Starts tracking the peak memory of a benchmark run
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _peak_memory_stop(start_memory):
+    """
+    Returns the peak memory of a benchmark run in MiB
+
+    Without tracemalloc (Python 2), this is the growth of the
+    maximum resident set size, which only increases on new peaks.
+    """
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak_memory / 1024.0 ** 2
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return (max_rss - start_memory) / 1024.0 ** 2
+    return (max_rss - start_memory) / 1024.0
+
+
+def _run_concurrent_requests(benchmark_function, make_request,
+                             concurrency):
+    """
+    Runs the requests from concurrent threads and raises the first error
+    """
+    errors = []
+
+    def run_request():
+        """Run one request and keep its error"""
+        try:
+            _consume_response(benchmark_function(make_request()))
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(error)
+
+    threads = [threading.Thread(target=run_request)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def run_benchmark_case(benchmark_function, params, is_api, repeat, warmup,
+                       user, concurrency=1):
+    """
+    Times a benchmark case
+
+    Returns
+    -------
+    dict with the latency percentiles in milliseconds
+    and the peak memory in MiB of concurrency simultaneous requests
+    """
+    from django.test import RequestFactory
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    def make_request():
+        """Build an authenticated GET request"""
+        if is_api:
+            request = APIRequestFactory().get('/', params)
+            force_authenticate(request, user=user)
+        else:
+            request = RequestFactory().get('/', params)
+            request.user = user
+        return request
+
+    for _ in range(warmup):
+        _consume_response(benchmark_function(make_request()))
+
+    latencies = []
+    for _ in range(repeat):
+        request = make_request()
+        gc.collect()
+        start_time = default_timer()
+        _consume_response(benchmark_function(request))
+        latencies.append((default_timer() - start_time) * 1000)
+
+    # measure memory in a separate run to keep the
+    # tracing overhead out of the latencies
+    gc.collect()
+    start_memory = _peak_memory_start()
+    try:
+        _run_concurrent_requests(benchmark_function, make_request,
+                                 concurrency)
+    finally:
+        peak_memory = _peak_memory_stop(start_memory)
+
+    return {
+        'runs': repeat,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'peak_memory_mib': float(peak_memory),
+        'concurrency': concurrency,
+    }
+
+
+def run_benchmarks(watershed_info, repeat=10, warmup=1, case_names=None,
+                   concurrency=1):
+    """
+    Runs the benchmark cases against the synthetic watershed
+
+    Returns
+    -------
+    list of (name, result) for each benchmark case
+    """
+    from django.contrib.auth.models import User
+    from tethys_apps.tethysapp.streamflow_prediction_tool.app \
+        import StreamflowPredictionTool as app
+
+    user = User(username='spt_benchmark', is_staff=True)
+    custom_settings = {
+        'ecmwf_forecast_folder': watershed_info['ecmwf_forecast_folder'],
+        'historical_folder': watershed_info['historical_folder'],
+        # request instrumentation off so only the views are timed
+        'enable_server_timing': False,
+        'enable_access_log': False,
+        'profile_threshold_seconds': None,
+        'profile_sample_rate': None,
+    }
+
+    results = []
+    with synthetic_settings(app, custom_settings):
+        for name, benchmark_function, params, is_api in \
+                get_benchmark_cases(watershed_info):
+            if case_names and name not in case_names:
+                continue
+            results.append((name,
+                            run_benchmark_case(benchmark_function, params,
+                                               is_api, repeat, warmup,
+                                               user, concurrency)))
+    return results
+
+
+def print_results(results):
+    """
+    Prints the benchmark results as a table
+    """
+    row_format = '{0:<26}{1:>6}{2:>12}{3:>12}{4:>14}'
+    print(row_format.format('benchmark', 'runs', 'p50 (ms)', 'p95 (ms)',
+                            'peak (MiB)'))
+    for name, result in results:
+        print(row_format.format(name,
+                                result['runs'],
+                                '{0:.1f}'.format(result['p50_ms']),
+                                '{0:.1f}'.format(result['p95_ms']),
+                                '{0:.1f}'.format(result['peak_memory_mib'])))
+
+
+def main():
+    """
+    Runs the benchmark suite from the command line
+    """
+    parser = ArgumentParser(description='Benchmarks the Streamflow '
+                                        'Prediction Tool with a synthetic '
+                                        'watershed.')
+    parser.add_argument('--num-rivids', type=int, default=1000)
+    parser.add_argument('--num-years', type=int, default=35)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of simultaneous requests when '
+                             'measuring the peak memory.')
+    parser.add_argument('--cases', nargs='*',
+                        help='Names of the benchmark cases to run.')
+    parser.add_argument('--data-directory',
+                        help='Directory for the synthetic watershed, '
+                             'which is reused if it already exists. '
+                             'A temporary directory is used by default.')
+    parser.add_argument('--no-aggregates', action='store_true',
+                        help='Do not generate the daily & monthly '
+                             'historical files.')
+    parser.add_argument('--read-threads', type=int,
+                        help='Number of threads reading the forecast '
+                             'ensemble members (1 reads them one after '
+                             'another).')
+    parser.add_argument('--no-mmap', action='store_true',
+                        help='Read the classic NetCDF Qout files with '
+                             'xarray instead of memory-mapping them.')
+    parser.add_argument('--json',
+                        help='Path to write the results as JSON.')
+    args = parser.parse_args()
+
+    _setup_django()
+    from tethys_apps.tethysapp.streamflow_prediction_tool\
+        .data_access import set_mmap_reads, set_read_threads
+    from tethys_apps.tethysapp.streamflow_prediction_tool\
+        .historical_aggregates import generate_historical_aggregates
+
+    if args.read_threads is not None:
+        set_read_threads(args.read_threads)
+    set_mmap_reads(not args.no_mmap)
+
+    data_directory = args.data_directory or mkdtemp(prefix='spt_benchmark_')
+    try:
+        watershed_info = None
+        if args.data_directory:
+            watershed_info = load_synthetic_watershed(data_directory)
+        if watershed_info is None:
+            print('Generating synthetic watershed in {0} ...'
+                  .format(data_directory))
+            watershed_info = generate_synthetic_watershed(
+                data_directory,
+                num_rivids=args.num_rivids,
+                num_years=args.num_years)
+        if not args.no_aggregates:
+            generate_historical_aggregates(watershed_info['historical_file'])
+
+        results = run_benchmarks(watershed_info,
+                                 repeat=args.repeat,
+                                 warmup=args.warmup,
+                                 case_names=args.cases,
+                                 concurrency=args.concurrency)
+    finally:
+        if not args.data_directory:
+            rmtree(data_directory)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json_dump({
+                'num_rivids': args.num_rivids,
+                'num_years': args.num_years,
+                'read_threads': args.read_threads,
+                'mmap_reads': not args.no_mmap,
+                'results': dict(results),
+            }, outfile, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
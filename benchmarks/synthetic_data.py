@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""synthetic_data.py
+
+    This module generates synthetic RAPID/ECMWF watersheds on local disk
+    with the same layout as the forecast and historical folders
+    of the Streamflow Prediction Tool.
+
+    License: BSD 3-Clause
+"""
+from argparse import ArgumentParser
+import datetime
+from glob import glob
+from json import dump as json_dump
+import os
+
+from netCDF4 import Dataset
+import numpy as np
+
+WATERSHED_NAME = 'benchmark'
+SUBBASIN_NAME = 'synthetic'
+NUM_ENSEMBLES = 52
+HIGH_RES_ENSEMBLE = 52
+RETURN_PERIODS = (2, 10, 20)
+FIRST_RIVID = 1000
+HISTORICAL_START_YEAR = 1980
+DEFAULT_FORECAST_DATETIME = datetime.datetime(2017, 8, 1, 12)
+
+QOUT_TIME_UNITS = 'seconds since 1970-01-01 00:00:00+00:00'
+
+
+def _to_epoch_seconds(datetimes):
+    """
+    Converts an array of datetime64 values to seconds since 1970
+    """
+    return datetimes.astype('datetime64[s]').astype(np.int64)
+
+
+def _forecast_time_steps(ensemble_number):
+    """
+    Returns the hours since the forecast start of an ECMWF ensemble member
+    """
+    if ensemble_number == HIGH_RES_ENSEMBLE:
+        return np.concatenate([np.arange(0, 90, 1),
+                               np.arange(90, 144, 3),
+                               np.arange(144, 241, 6)])
+    return np.concatenate([np.arange(0, 144, 3),
+                           np.arange(144, 361, 6)])
+
+
+def _seasonal_factor(datetimes):
+    """
+    Returns a seasonal multiplier for the streamflow at each time
+    """
+    day_of_year = (datetimes - datetimes.astype('datetime64[Y]')) \
+        .astype('timedelta64[D]').astype(np.float32)
+    return 1 + 0.5 * np.sin(2 * np.pi * day_of_year / 365.25)
+
+
+def _create_qout_file(file_path, rivids, lat, lon, datetimes,
+                      file_format='NETCDF3_64BIT'):
+    """
+    Creates a RAPID Qout file with dimensions (time, rivid)
+    and returns it open for writing the Qout values
+    """
+    qout_nc = Dataset(file_path, 'w', format=file_format)
+    qout_nc.createDimension('time', datetimes.size)
+    qout_nc.createDimension('rivid', rivids.size)
+
+    time_var = qout_nc.createVariable('time', 'i4', ('time',))
+    time_var.long_name = 'time'
+    time_var.standard_name = 'time'
+    time_var.units = QOUT_TIME_UNITS
+    time_var[:] = _to_epoch_seconds(datetimes)
+
+    rivid_var = qout_nc.createVariable('rivid', 'i4', ('rivid',))
+    rivid_var.long_name = 'unique identifier for each river reach'
+    rivid_var[:] = rivids
+
+    lat_var = qout_nc.createVariable('lat', 'f8', ('rivid',))
+    lat_var.long_name = 'latitude'
+    lat_var.units = 'degrees_north'
+    lat_var[:] = lat
+
+    lon_var = qout_nc.createVariable('lon', 'f8', ('rivid',))
+    lon_var.long_name = 'longitude'
+    lon_var.units = 'degrees_east'
+    lon_var[:] = lon
+
+    qout_var = qout_nc.createVariable('Qout', 'f4', ('time', 'rivid'))
+    qout_var.long_name = 'instantaneous river water discharge ' \
+                         'downstream of each river reach'
+    qout_var.units = 'm3 s-1'
+    return qout_nc
+
+
+def generate_historical_files(watershed_directory, rivids, lat, lon,
+                              base_flow, num_years, random_state):
+    """
+    Generates the 3-hourly historical Qout file along with the
+    return period and seasonal average files computed from it
+    """
+    start_datetime = np.datetime64('{0}-01-01'.format(HISTORICAL_START_YEAR),
+                                   'h')
+    end_datetime = np.datetime64('{0}-01-01'.format(HISTORICAL_START_YEAR +
+                                                    num_years), 'h')
+    datetimes = np.arange(start_datetime, end_datetime,
+                          np.timedelta64(3, 'h'))
+
+    qout_file = os.path.join(
+        watershed_directory,
+        'Qout_erai_t511_3hr_{0}0101to{1}1231.nc'.format(
+            HISTORICAL_START_YEAR, HISTORICAL_START_YEAR + num_years - 1))
+    max_flow = np.zeros(rivids.size, dtype=np.float32)
+    seasonal_sum = np.zeros((365, rivids.size))
+    seasonal_sum_squares = np.zeros((365, rivids.size))
+    seasonal_count = np.zeros(365)
+
+    qout_nc = _create_qout_file(qout_file, rivids, lat, lon, datetimes)
+    try:
+        # write one year at a time to bound memory
+        year_starts = np.searchsorted(
+            datetimes,
+            np.arange(datetimes[0].astype('datetime64[Y]'),
+                      datetimes[-1].astype('datetime64[Y]') + 1)
+            .astype('datetime64[h]'))
+        for year_start, year_end in zip(year_starts,
+                                        np.append(year_starts[1:],
+                                                  datetimes.size)):
+            year_datetimes = datetimes[year_start:year_end]
+            qout_values = \
+                (base_flow[np.newaxis] *
+                 _seasonal_factor(year_datetimes)[:, np.newaxis] *
+                 random_state.lognormal(0, 0.25, (year_datetimes.size,
+                                                  rivids.size)))\
+                .astype(np.float32)
+            qout_nc.variables['Qout'][year_start:year_end] = qout_values
+
+            max_flow = np.maximum(max_flow, qout_values.max(axis=0))
+            day_of_year = np.minimum(
+                (year_datetimes - year_datetimes.astype('datetime64[Y]'))
+                .astype('timedelta64[D]').astype(np.int64), 364)
+            np.add.at(seasonal_sum, day_of_year, qout_values)
+            np.add.at(seasonal_sum_squares, day_of_year, qout_values ** 2)
+            np.add.at(seasonal_count, day_of_year, 1)
+    finally:
+        qout_nc.close()
+
+    return_period_file = os.path.join(watershed_directory,
+                                      'return_periods_erai_t511_3hr.nc')
+    with Dataset(return_period_file, 'w') as return_period_nc:
+        return_period_nc.createDimension('rivid', rivids.size)
+        rivid_var = return_period_nc.createVariable('rivid', 'i4',
+                                                    ('rivid',))
+        rivid_var[:] = rivids
+        return_period_values = {
+            'max_flow': max_flow,
+            'return_period_20': 0.9 * max_flow,
+            'return_period_10': 0.75 * max_flow,
+            'return_period_2': 0.5 * max_flow,
+        }
+        for var_name, var_values in return_period_values.items():
+            return_period_var = \
+                return_period_nc.createVariable(var_name, 'f8', ('rivid',))
+            return_period_var.units = 'm3/s'
+            return_period_var[:] = var_values
+
+    seasonal_average = seasonal_sum / seasonal_count[:, np.newaxis]
+    seasonal_std_dev = np.sqrt(np.maximum(
+        seasonal_sum_squares / seasonal_count[:, np.newaxis] -
+        seasonal_average ** 2, 0))
+    seasonal_file = os.path.join(watershed_directory,
+                                 'seasonal_averages_erai_t511_3hr.nc')
+    with Dataset(seasonal_file, 'w') as seasonal_nc:
+        seasonal_nc.createDimension('rivid', rivids.size)
+        seasonal_nc.createDimension('day_of_year', 365)
+        rivid_var = seasonal_nc.createVariable('rivid', 'i4', ('rivid',))
+        rivid_var[:] = rivids
+        average_var = seasonal_nc.createVariable('average_flow', 'f8',
+                                                 ('rivid', 'day_of_year'))
+        average_var.units = 'm3/s'
+        average_var[:] = seasonal_average.T
+        std_dev_var = seasonal_nc.createVariable('std_dev_flow', 'f8',
+                                                 ('rivid', 'day_of_year'))
+        std_dev_var.units = 'm3/s'
+        std_dev_var[:] = seasonal_std_dev.T
+
+    return qout_file, return_period_values
+
+
+def generate_forecast_files(forecast_directory, rivids, lat, lon, base_flow,
+                            forecast_datetime, random_state):
+    """
+    Generates the 52 ECMWF ensemble member Qout files of a forecast
+    """
+    forecast_start = np.datetime64(forecast_datetime, 'h')
+    seasonal_flow = \
+        base_flow * _seasonal_factor(np.array([forecast_start]))[0]
+    forecast_files = []
+    for ensemble_number in range(1, NUM_ENSEMBLES + 1):
+        forecast_hours = _forecast_time_steps(ensemble_number)
+        datetimes = forecast_start + forecast_hours.astype('timedelta64[h]')
+        # log-normal random walk so the members diverge over time
+        member_trend = np.exp(np.cumsum(
+            random_state.normal(0, 0.04, (datetimes.size, rivids.size)),
+            axis=0))
+        qout_values = \
+            (seasonal_flow[np.newaxis] * member_trend).astype(np.float32)
+
+        forecast_file = os.path.join(
+            forecast_directory,
+            'Qout_{0}_{1}_{2}.nc'.format(WATERSHED_NAME, SUBBASIN_NAME,
+                                         ensemble_number))
+        qout_nc = _create_qout_file(forecast_file, rivids, lat, lon,
+                                    datetimes)
+        try:
+            qout_nc.variables['Qout'][:] = qout_values
+        finally:
+            qout_nc.close()
+        forecast_files.append(forecast_file)
+    return forecast_files
+
+
+def generate_warning_points(forecast_directory, rivids, lat, lon,
+                            base_flow, return_period_values,
+                            forecast_datetime, warning_point_fraction,
+                            random_state):
+    """
+    Generates the return period warning point GeoJSON files of a forecast
+    """
+    warning_point_files = []
+    num_points = max(1, int(rivids.size * warning_point_fraction))
+    for return_period in RETURN_PERIODS:
+        point_indices = np.sort(random_state.choice(rivids.size, num_points,
+                                                    replace=False))
+        peak_days = random_state.randint(0, 15, num_points)
+        features = []
+        for point_index, peak_day in zip(point_indices, peak_days):
+            peak_date = forecast_datetime.date() + \
+                datetime.timedelta(days=int(peak_day))
+            mean_peak = max(
+                float(base_flow[point_index]),
+                float(return_period_values['return_period_{0}'
+                                           .format(return_period)]
+                      [point_index]))
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [float(lon[point_index]),
+                                    float(lat[point_index])],
+                },
+                'properties': {
+                    'rivid': int(rivids[point_index]),
+                    'peak_date': peak_date.strftime('%Y-%m-%d'),
+                    'mean_peak': mean_peak,
+                    'size': 1,
+                },
+            })
+
+        warning_point_file = os.path.join(
+            forecast_directory,
+            'return_{0}_points.geojson'.format(return_period))
+        with open(warning_point_file, 'w') as outfile:
+            json_dump({'type': 'FeatureCollection', 'features': features},
+                      outfile)
+        warning_point_files.append(warning_point_file)
+    return warning_point_files
+
+
+def generate_synthetic_watershed(output_directory, num_rivids=1000,
+                                 num_years=35,
+                                 forecast_datetime=DEFAULT_FORECAST_DATETIME,
+                                 warning_point_fraction=0.05, seed=0):
+    """
+    Generates a synthetic watershed with a 52 member ECMWF forecast,
+    a 3-hourly historical record, return period and seasonal average
+    files, and warning points.
+
+    Parameters
+    ----------
+    output_directory: str
+        Directory where the ecmwf and historical folders are created.
+    num_rivids: int, optional
+        Number of river reaches in the watershed.
+    num_years: int, optional
+        Number of years in the historical record.
+    forecast_datetime: datetime.datetime, optional
+        Start of the forecast.
+    warning_point_fraction: float, optional
+        Fraction of the river reaches with warning points
+        for each return period.
+    seed: int, optional
+        Seed for the random values.
+
+    Returns
+    -------
+    dict with the settings and names of the generated watershed
+    """
+    random_state = np.random.RandomState(seed)
+    rivids = np.arange(FIRST_RIVID, FIRST_RIVID + num_rivids, dtype=np.int32)
+    lat = random_state.uniform(30, 40, num_rivids)
+    lon = random_state.uniform(-100, -90, num_rivids)
+    base_flow = random_state.lognormal(3, 1.5, num_rivids)
+
+    watershed_folder = '{0}-{1}'.format(WATERSHED_NAME, SUBBASIN_NAME)
+    forecast_folder = forecast_datetime.strftime('%Y%m%d.%H%M')
+    ecmwf_forecast_folder = os.path.join(output_directory, 'ecmwf')
+    historical_folder = os.path.join(output_directory, 'historical')
+    forecast_directory = os.path.join(ecmwf_forecast_folder,
+                                      watershed_folder, forecast_folder)
+    historical_directory = os.path.join(historical_folder, watershed_folder)
+    for directory in (forecast_directory, historical_directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    historical_file, return_period_values = \
+        generate_historical_files(historical_directory, rivids, lat, lon,
+                                  base_flow, num_years, random_state)
+    generate_forecast_files(forecast_directory, rivids, lat, lon, base_flow,
+                            forecast_datetime, random_state)
+    generate_warning_points(forecast_directory, rivids, lat, lon, base_flow,
+                            return_period_values, forecast_datetime,
+                            warning_point_fraction, random_state)
+
+    return {
+        'ecmwf_forecast_folder': ecmwf_forecast_folder,
+        'historical_folder': historical_folder,
+        'historical_file': historical_file,
+        'watershed_name': WATERSHED_NAME,
+        'subbasin_name': SUBBASIN_NAME,
+        'forecast_folder': forecast_folder,
+        'rivids': rivids,
+    }
+
+
+def load_synthetic_watershed(output_directory):
+    """
+    Returns the information of a synthetic watershed previously
+    generated in the output directory or None if there is not one
+    """
+    watershed_folder = '{0}-{1}'.format(WATERSHED_NAME, SUBBASIN_NAME)
+    ecmwf_forecast_folder = os.path.join(output_directory, 'ecmwf')
+    historical_folder = os.path.join(output_directory, 'historical')
+    historical_files = glob(os.path.join(historical_folder, watershed_folder,
+                                         'Qout*.nc'))
+    forecast_folders = sorted(glob(os.path.join(ecmwf_forecast_folder,
+                                                watershed_folder, '*.*')))
+    if not historical_files or not forecast_folders:
+        return None
+
+    with Dataset(historical_files[0]) as qout_nc:
+        rivids = qout_nc.variables['rivid'][:]
+
+    return {
+        'ecmwf_forecast_folder': ecmwf_forecast_folder,
+        'historical_folder': historical_folder,
+        'historical_file': historical_files[0],
+        'watershed_name': WATERSHED_NAME,
+        'subbasin_name': SUBBASIN_NAME,
+        'forecast_folder': os.path.basename(forecast_folders[-1]),
+        'rivids': np.asarray(rivids),
+    }
+
+
+def main():
+    """
+    Generates a synthetic watershed from the command line
+    """
+    parser = ArgumentParser(description='Generates a synthetic RAPID/ECMWF '
+                                        'watershed for benchmarking.')
+    parser.add_argument('output_directory')
+    parser.add_argument('--num-rivids', type=int, default=1000)
+    parser.add_argument('--num-years', type=int, default=35)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    watershed_info = generate_synthetic_watershed(args.output_directory,
+                                                  num_rivids=args.num_rivids,
+                                                  num_years=args.num_years,
+                                                  seed=args.seed)
+    print('ecmwf_forecast_folder: {0}'
+          .format(watershed_info['ecmwf_forecast_folder']))
+    print('historical_folder: {0}'
+          .format(watershed_info['historical_folder']))
+
+
+if __name__ == '__main__':
+    main()
@@ -35,12 +35,21 @@ DEPENDENCIES = [
 ]
 
 
-def _path_to_download_script():
-    """Returns path to SPT download script"""
+# SPT management command scripts
+COMMAND_SCRIPTS = [
+    'spt_download_forecasts.py',
+    'spt_generate_historical_aggregates.py',
+    'spt_refresh_geoserver_layers.py',
+    'spt_run_jobs.py',
+]
+
+
+def _path_to_command_script(script_name):
+    """Returns path to SPT management command script"""
     return os.path.join(os.path.dirname(os.path.abspath(__file__)),
                         'tethysapp',
                         'streamflow_prediction_tool',
-                        'spt_download_forecasts.py')
+                        script_name)
 
 
 def install_spt_crontab(tethys_home_dir):
@@ -65,28 +74,40 @@ def install_spt_crontab(tethys_home_dir):
                                 comment="spt-dataset-download")
     cron_job.every(1).hours()
 
+    # create job to update the daily/monthly historical files every day
+    aggregate_cron_command = '%s %s %s' % (
+        sys.executable,
+        manage_scrip_path,
+        'spt_generate_historical_aggregates'
+    )
+    cron_manager.remove_all(comment="spt-historical-aggregates")
+    aggregate_cron_job = cron_manager.new(command=aggregate_cron_command,
+                                          comment="spt-historical-aggregates")
+    aggregate_cron_job.every(1).days()
+
     # writes content to crontab
     cron_manager.write_to_user(user=True)
 
 
 def setup_download_command(tethys_home_dir):
     """
-    Create symbolic link to command file
+    Create symbolic links to command files
     to tethys command directory
     """
     if not tethys_home_dir:
         tethys_home_dir = os.environ['TETHYS_HOME']
 
-    spt_download_script = _path_to_download_script()
-    path_to_tethys_command = \
-        os.path.join(tethys_home_dir,
-                     'src',
-                     'tethys_apps',
-                     'management',
-                     'commands',
-                     os.path.basename(spt_download_script))
+    for script_name in COMMAND_SCRIPTS:
+        path_to_tethys_command = \
+            os.path.join(tethys_home_dir,
+                         'src',
+                         'tethys_apps',
+                         'management',
+                         'commands',
+                         script_name)
 
-    os.symlink(spt_download_script, path_to_tethys_command)
+        os.symlink(_path_to_command_script(script_name),
+                   path_to_tethys_command)
 
 
 class SetupCrontabCommand(Command):
@@ -126,7 +147,8 @@ setup(
     author_email='alan.d.snow@usace.army.mil',
     url='https://github.com/erdc/tethysapp-streamflow_prediction_tool',
     license='BSD 3-Clause',
-    packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+    packages=find_packages(exclude=['ez_setup', 'examples', 'tests',
+                                    'benchmarks', 'benchmarks.*']),
     namespace_packages=['tethysapp', 'tethysapp.' + APP_PACKAGE],
     include_package_data=True,
     extras_require={
@@ -138,6 +160,10 @@ setup(
             'sphinx',
             'sphinx_rtd_theme',
             'sphinxcontrib-napoleon',
+        ],
+        'tiles': [
+            'pyshp',
+            'pyproj',
         ]
     },
     zip_safe=False,
@@ -77,6 +77,25 @@ class StreamflowPredictionTool(TethysAppBase):
                     url='streamflow-prediction-tool/map/get-warning-points',
                     controller='streamflow_prediction_tool.controllers_ajax'
                                '.generate_warning_points'),
+            url_map(name='get_warning_points_bbox_ajax',
+                    url='streamflow-prediction-tool/map/'
+                        'get-warning-points-bbox',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.get_warning_points_bbox'),
+            url_map(name='get_warning_points_group_ajax',
+                    url='streamflow-prediction-tool/map/'
+                        'get-warning-points-group',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.get_warning_points_group'),
+            url_map(name='get_drainage_line_tile_ajax',
+                    url='streamflow-prediction-tool/map/'
+                        'get-drainage-line-tile',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.get_drainage_line_tile'),
+            url_map(name='get_reach_info_ajax',
+                    url='streamflow-prediction-tool/map/get-reach-info',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.get_reach_info'),
             url_map(name='ecmf_get_avaialable_dates_ajax',
                     url='streamflow-prediction-tool/map/'
                         'ecmwf-get-avaialable-dates',
@@ -105,6 +124,11 @@ class StreamflowPredictionTool(TethysAppBase):
                         'upload_ecmwf_rapid',
                     controller='streamflow_prediction_tool.controllers_ajax'
                                '.watershed_ecmwf_rapid_file_upload'),
+            url_map(name='add-watershed-job-status-ajax',
+                    url='streamflow-prediction-tool/add-watershed/'
+                        'job_status',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.job_status'),
             url_map(name='add-watershed-update-ajax',
                     url='streamflow-prediction-tool/add-watershed/update',
                     controller='streamflow_prediction_tool.controllers_ajax'
@@ -130,6 +154,11 @@ class StreamflowPredictionTool(TethysAppBase):
                         'upload_ecmwf_rapid',
                     controller='streamflow_prediction_tool.controllers_ajax'
                                '.watershed_ecmwf_rapid_file_upload'),
+            url_map(name='manage-watersheds-job-status-ajax',
+                    url='streamflow-prediction-tool/manage-watersheds/'
+                        'job_status',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.job_status'),
             url_map(name='delete-watershed',
                     url='streamflow-prediction-tool/manage-watersheds/delete',
                     controller='streamflow_prediction_tool.controllers_ajax'
@@ -158,6 +187,11 @@ class StreamflowPredictionTool(TethysAppBase):
                     url='streamflow-prediction-tool/manage-geoservers/submit',
                     controller='streamflow_prediction_tool.controllers_ajax'
                                '.geoserver_update'),
+            url_map(name='manage-geoservers-job-status-ajax',
+                    url='streamflow-prediction-tool/manage-geoservers/'
+                        'job_status',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.job_status'),
             url_map(name='delete-geoserver-ajax',
                     url='streamflow-prediction-tool/manage-geoservers/delete',
                     controller='streamflow_prediction_tool.controllers_ajax'
@@ -226,6 +260,15 @@ class StreamflowPredictionTool(TethysAppBase):
                     url='streamflow-prediction-tool/api/GetForecast',
                     controller='streamflow_prediction_tool.controllers_api'
                                '.get_ecmwf_forecast'),
+            url_map(name='ensemble',
+                    url='streamflow-prediction-tool/api/GetEnsemble',
+                    controller='streamflow_prediction_tool.controllers_api'
+                               '.get_ecmwf_ensemble_forecast'),
+            url_map(name='forecast_probabilities',
+                    url='streamflow-prediction-tool/api/'
+                        'GetForecastProbabilities',
+                    controller='streamflow_prediction_tool.controllers_api'
+                               '.get_ecmwf_forecast_probabilities_api'),
             url_map(name='era_interim',
                     url='streamflow-prediction-tool/api/GetHistoricData',
                     controller='streamflow_prediction_tool.controllers_api'
@@ -246,6 +289,14 @@ class StreamflowPredictionTool(TethysAppBase):
                     url='streamflow-prediction-tool/api/GetWarningPoints',
                     controller='streamflow_prediction_tool.controllers_api'
                                '.get_warning_points'),
+            url_map(name='jobs',
+                    url='streamflow-prediction-tool/jobs',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.job_list'),
+            url_map(name='performance_metrics',
+                    url='streamflow-prediction-tool/performance-metrics',
+                    controller='streamflow_prediction_tool.controllers_ajax'
+                               '.performance_metrics'),
         )
 
     def persistent_store_settings(self):
@@ -287,4 +338,58 @@ class StreamflowPredictionTool(TethysAppBase):
                              'return period, and seasonal files.'),
                 required=True
             ),
+            CustomSetting(
+                name='enable_server_timing',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description=('Add Server-Timing headers with the time spent '
+                             'in each phase of a request.'),
+                required=False
+            ),
+            CustomSetting(
+                name='enable_access_log',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description=('Log every request with its timings to '
+                             'spt_access.log in the app workspace.'),
+                required=False
+            ),
+            CustomSetting(
+                name='profile_threshold_seconds',
+                type=CustomSetting.TYPE_FLOAT,
+                description=('Save a profile of requests that take longer '
+                             'than this number of seconds.'),
+                required=False
+            ),
+            CustomSetting(
+                name='profile_sample_rate',
+                type=CustomSetting.TYPE_FLOAT,
+                description=('Fraction of requests to profile (0-1). '
+                             'All requests when only the threshold is set.'),
+                required=False
+            ),
+            CustomSetting(
+                name='enable_job_worker',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description=('Leave background jobs to the spt_run_jobs '
+                             'worker processes instead of running them '
+                             'in the web processes.'),
+                required=False
+            ),
+            CustomSetting(
+                name='enable_drainage_line_tiles',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description=('Build simplified tiles of the uploaded '
+                             'drainage line shapefiles, which the map '
+                             'loads from the app instead of GeoServer '
+                             '(requires pyshp).'),
+                required=False
+            ),
+            CustomSetting(
+                name='enable_reach_index',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description=('Build an index of the reaches of the '
+                             'uploaded drainage line shapefiles, which '
+                             'the map uses to find a reach by ID instead '
+                             'of querying GeoServer (requires pyshp).'),
+                required=False
+            ),
         )
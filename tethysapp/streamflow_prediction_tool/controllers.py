@@ -20,8 +20,11 @@ from .app import StreamflowPredictionTool as app
 from .controllers_functions import (render_manage_data_store_pages,
                                     render_manage_geoserver_pages,
                                     render_manage_watershed_groups_pages)
+from .drainage_line_tiles import (TILE_MAX_ZOOM,
+                                  get_drainage_line_tiles_version)
 from .model import (DataStore, DataStoreType, GeoServer,
                     Watershed, WatershedGroup)
+from .reach_index import has_reach_index
 from .functions import (get_ecmwf_valid_forecast_folder_list,
                         format_watershed_title,
                         redirect_with_message,
@@ -197,6 +200,17 @@ def app_map(request):
                 a_geoserver_info['drainage_line']['geoserver_method'] \
                     = "simple"
 
+            # load the drainage line from the app if it has tiles
+            tiles_version = get_drainage_line_tiles_version(a_watershed.id)
+            if tiles_version is not None:
+                a_geoserver_info['drainage_line'].update({
+                    'tiles_version': tiles_version,
+                    'tiles_max_zoom': TILE_MAX_ZOOM,
+                })
+            # look up reaches in the reach index instead of GeoServer
+            a_geoserver_info['drainage_line']['reach_index'] = \
+                has_reach_index(a_watershed.id)
+
             if a_watershed.geoserver_boundary_layer:
                 # LOAD BOUNDARY
                 a_geoserver_info['boundary'] = {
@@ -6,55 +6,68 @@
 """
 from csv import writer as csv_writer
 import datetime
-from json import load as json_load
 import os
 
 import numpy as np
-import pandas as pd
-import plotly.graph_objs as go
-import scipy.stats as sp
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import ObjectDeletedError
-import xarray
 
 # django imports
 from django.contrib.auth.decorators import user_passes_test, login_required
-from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
 from django.views.decorators.http import require_GET, require_POST
 
 # tethys imports
 from tethys_sdk.gizmos import PlotlyView
-from tethys_dataset_services.engines import CkanDatasetEngine
 
 # local imports
-from spt_dataset_manager.dataset_manager import (GeoServerDatasetManager,
-                                                 RAPIDInputDatasetManager)
-
 from .exception_handling import (DatabaseError, GeoServerError, InvalidData,
-                                 NotFoundError, SettingsError, UploadError,
+                                 NotFoundError, SettingsError,
                                  exceptions_to_http_status,
                                  rivid_exception_handler)
 
 from .app import StreamflowPredictionTool as app
-from .controllers_functions import (get_ecmwf_avaialable_dates,
+from .data_access import (read_historical_series,
+                          read_seasonal_averages,
+                          read_warning_points)
+from .dataset_managers import (invalidate_data_store_managers,
+                               invalidate_geoserver_managers)
+from .drainage_line_tiles import TILE_MAX_AGE, read_drainage_line_tile
+from .controllers_functions import (compute_forecast_probabilities,
+                                    compute_forecast_statistics,
+                                    get_ecmwf_avaialable_dates,
+                                    get_ecmwf_forecast_reach_ensemble,
                                     get_ecmwf_forecast_statistics,
                                     get_historic_streamflow_series,
                                     get_return_period_dict,
                                     get_return_period_ploty_info)
-from .controllers_validators import (validate_historical_data,
-                                     validate_watershed_info)
+from .controllers_validators import (validate_bbox_info,
+                                     validate_historical_data,
+                                     validate_percentiles_info,
+                                     validate_reach_info,
+                                     validate_return_periods_info,
+                                     validate_tile_info,
+                                     validate_warning_points_info,
+                                     validate_watershed_info,
+                                     validate_watershed_list_info)
 from .functions import (delete_from_database,
                         format_name,
                         get_units_title,
                         handle_uploaded_file,
-                        update_geoserver_layer,
-                        user_permission_test,
-                        M3_TO_FT3)
+                        user_permission_test)
 
+from .jobs import (JOB_ERROR, JOB_PENDING, JOB_RUNNING, JOB_SUCCESS,
+                   create_job, get_job_info, get_job_list,
+                   get_upload_directory, recover_jobs, stage_uploaded_files,
+                   start_job, start_queued_jobs)
 from .model import DataStore, GeoServer, Watershed, WatershedGroup
+from .performance import get_performance_metrics, timed_phase
+from .reach_index import query_reach
+from .warning_points import (query_warning_points,
+                             query_watersheds_warning_points)
 
 
 @require_POST
@@ -64,6 +77,8 @@ def data_store_add(request):
     """
     Controller for adding a data store.
     """
+    from tethys_dataset_services.engines import CkanDatasetEngine
+
     # get/check information from AJAX request
     data_store_name = request.POST.get('data_store_name')
     data_store_owner_org = request.POST.get('data_store_owner_org')
@@ -145,6 +160,7 @@ def data_store_delete(request):
         data_store = session.query(DataStore).get(data_store_id)
         session.delete(data_store)
         session.commit()
+        invalidate_data_store_managers(data_store_id)
     except IntegrityError:
         session.close()
         raise DatabaseError(
@@ -163,6 +179,8 @@ def data_store_update(request):
     """
     Controller for updating a data store.
     """
+    from tethys_dataset_services.engines import CkanDatasetEngine
+
     # get/check information from AJAX request
     data_store_id = request.POST.get('data_store_id')
     data_store_name = request.POST.get('data_store_name')
@@ -211,6 +229,7 @@ def data_store_update(request):
     data_store.api_endpoint = data_store_api_endpoint
     data_store.api_key = data_store_api_key
     session.commit()
+    invalidate_data_store_managers(data_store_id)
     session.close()
     return JsonResponse({'success': "Data store sucessfully updated!"})
 
@@ -222,6 +241,9 @@ def geoserver_add(request):
     """
     Controller for adding a geoserver.
     """
+    from spt_dataset_manager.dataset_manager import \
+        GeoServerDatasetManager
+
     # get/check information from AJAX request
     geoserver_name = request.POST.get('geoserver_name')
     geoserver_url = request.POST.get('geoserver_url')
@@ -301,6 +323,7 @@ def geoserver_delete(request):
 
         session.delete(geoserver)
         session.commit()
+        invalidate_geoserver_managers(geoserver_id)
     except IntegrityError:
         session.close()
         raise DatabaseError("This geoserver is connected with a watershed! "
@@ -315,8 +338,13 @@ def geoserver_delete(request):
 @exceptions_to_http_status
 def geoserver_update(request):
     """
-    Controller for updating a geoserver.
+    Controller for updating a geoserver. The credentials are validated
+    and the geoserver is updated before its layers are refreshed by a
+    background job.
     """
+    from spt_dataset_manager.dataset_manager import \
+        GeoServerDatasetManager
+
     # get/check information from AJAX request
     geoserver_id = request.POST.get('geoserver_id')
     geoserver_name = request.POST.get('geoserver_name')
@@ -345,39 +373,42 @@ def geoserver_update(request):
                                     password=geoserver_password.strip(),
                                     app_instance_id=app_instance_id)
     except Exception as ex:
-        return GeoServerError(str(ex))
+        raise GeoServerError(str(ex))
 
     # initialize session
     session_maker = app.get_persistent_store_database('main_db',
                                                       as_sessionmaker=True)
     session = session_maker()
-    # check to see if duplicate exists
-    num_similar_geoservers = session.query(GeoServer) \
-        .filter(
-        or_(GeoServer.name == geoserver_name,
-            GeoServer.url == geoserver_manager.engine_url)
-    ) \
-        .filter(GeoServer.id != geoserver_id) \
-        .count()
-
-    if num_similar_geoservers > 0:
-        session.close()
-        raise DatabaseError("A geoserver with the same name or url exists.")
-
-    # update geoserver
     try:
+        # check to see if duplicate exists
+        num_similar_geoservers = session.query(GeoServer) \
+            .filter(or_(GeoServer.name == geoserver_name.strip(),
+                        GeoServer.url == geoserver_manager.engine_url)) \
+            .filter(GeoServer.id != geoserver_id) \
+            .count()
+        if num_similar_geoservers > 0:
+            raise DatabaseError("A geoserver with the same name "
+                                "or url exists.")
+
         geoserver = session.query(GeoServer).get(geoserver_id)
-    except ObjectDeletedError:
+        if geoserver is None:
+            raise NotFoundError('GeoServer with ID {0}.'
+                                .format(geoserver_id))
+        geoserver.name = geoserver_name.strip()
+        geoserver.url = geoserver_manager.engine_url
+        geoserver.username = geoserver_username.strip()
+        geoserver.password = geoserver_password.strip()
+        # refresh the layers of the geoserver in the background
+        # (saved with the geoserver)
+        job = create_job(session, 'geoserver_update',
+                         {'geoserver_id': int(geoserver_id)})
+        job_id = job.id
+    finally:
         session.close()
-        raise DatabaseError("The geoserver to update does not exist.")
+    invalidate_geoserver_managers(geoserver_id)
+    start_job(job_id)
 
-    geoserver.name = geoserver_name.strip()
-    geoserver.url = geoserver_manager.engine_url
-    geoserver.username = geoserver_username.strip()
-    geoserver.password = geoserver_password.strip()
-    session.commit()
-    session.close()
-    return JsonResponse({'success': "GeoServer sucessfully updated!"})
+    return JsonResponse({'job_id': job_id})
 
 
 @require_GET
@@ -401,18 +432,28 @@ def ecmwf_get_avaialable_dates(request):
 @exceptions_to_http_status
 def get_ecmwf_hydrograph_plot(request):
     """
-    Retrieves 52 ECMWF ensembles analysis with min., max., avg., std. dev.
+    Retrieves 52 ECMWF ensembles analysis with min., max., avg., std. dev.,
+    percentiles and return period exceedance probabilities
     as a plotly hydrograph plot.
     """
-    # retrieve statistics
-    forecast_statistics, watershed_name, subbasin_name, river_id, units = \
-        get_ecmwf_forecast_statistics(request)
-
-    # ensure lower std dev values limited by the min
-    std_dev_lower_df = \
-        forecast_statistics['std_dev_range_lower']
-    std_dev_lower_df[std_dev_lower_df < forecast_statistics['min']] =\
-        forecast_statistics['min']
+    import plotly.graph_objs as go
+
+    # retrieve ensemble once for all statistics
+    merged_ds, watershed_name, subbasin_name, river_id, units = \
+        get_ecmwf_forecast_reach_ensemble(request)
+    forecast_statistics = \
+        compute_forecast_statistics(merged_ds,
+                                    request.GET.get('stat_type'),
+                                    units)
+    try:
+        return_period_data = get_return_period_dict(request)
+    except NotFoundError:
+        return_period_data = None
+    forecast_probabilities = \
+        compute_forecast_probabilities(merged_ds,
+                                       units,
+                                       return_period_data,
+                                       validate_percentiles_info(request.GET))
 
     # ----------------------------------------------
     # Chart Section
@@ -454,8 +495,8 @@ def get_ecmwf_hydrograph_plot(request):
 
     std_dev_lower_series = go.Scatter(
         name='Std. Dev. Lower',
-        x=std_dev_lower_df.index,
-        y=std_dev_lower_df.values,
+        x=forecast_statistics['std_dev_range_lower'].index,
+        y=forecast_statistics['std_dev_range_lower'].values,
         fill='tonexty',
         mode='lines',
         line=dict(
@@ -492,12 +533,47 @@ def get_ecmwf_hydrograph_plot(request):
             )
         ))
 
-    try:
+    # add percentiles and exceedance probabilities (hidden by default)
+    exceedance_colors = {
+        '2': 'rgb(255, 200, 0)',
+        '10': 'rgb(255, 0, 0)',
+        '20': 'rgb(128, 0, 128)',
+    }
+    for stat_name, stat_series in forecast_probabilities.items():
+        stat_label = stat_name.split("_")[-1]
+        if stat_name.startswith('percentile_'):
+            plot_series.append(go.Scatter(
+                name='Percentile {}'.format(stat_label),
+                x=stat_series.index,
+                y=stat_series.values,
+                mode='lines',
+                visible='legendonly',
+                line=dict(
+                    color='rgb(105, 105, 105)',
+                    dash='dot',
+                )
+            ))
+        else:
+            plot_series.append(go.Scatter(
+                name='Prob. > {}-yr'.format(stat_label),
+                x=stat_series.index,
+                y=stat_series.values * 100,
+                mode='lines',
+                yaxis='y2',
+                visible='legendonly',
+                line=dict(
+                    color=exceedance_colors[stat_label],
+                    dash='dash',
+                )
+            ))
+
+    if return_period_data:
         return_shapes, return_annotations = \
             get_return_period_ploty_info(
                 request, datetime_start, datetime_end,
-                forecast_statistics['max'].max())
-    except NotFoundError:
+                forecast_statistics['max'].max(),
+                return_period_data)
+    else:
         return_annotations = []
         return_shapes = []
 
@@ -511,6 +587,13 @@ def get_ecmwf_hydrograph_plot(request):
             title='Streamflow ({}<sup>3</sup>/s)'
                   .format(get_units_title(units))
         ),
+        yaxis2=dict(
+            title='Exceedance Probability (%)',
+            overlaying='y',
+            side='right',
+            range=[0, 100],
+            showgrid=False,
+        ),
         shapes=return_shapes,
         annotations=return_annotations
     )
@@ -524,9 +607,10 @@ def get_ecmwf_hydrograph_plot(request):
         'gizmo_object': chart_obj,
     }
 
-    return render(request,
-                  'streamflow_prediction_tool/gizmo_ajax.html',
-                  context)
+    with timed_phase('serialization'):
+        return render(request,
+                      'streamflow_prediction_tool/gizmo_ajax.html',
+                      context)
 
 
 @require_GET
@@ -536,6 +620,8 @@ def get_forecast_streamflow_csv(request):
     """
     Retrieve the forecasted streamflow as CSV
     """
+    import pandas as pd
+
     # retrieve statistics
     forecast_statistics, watershed_name, subbasin_name, river_id, units = \
         get_ecmwf_forecast_statistics(request)
@@ -548,16 +634,17 @@ def get_forecast_streamflow_csv(request):
                 subbasin_name,
                 river_id)
 
-    writer = csv_writer(response)
-    forecast_df = pd.DataFrame(forecast_statistics)
-    column_names = (forecast_df.columns.values +
-                    [' ({}3/s)'.format(get_units_title(units))]
-                    ).tolist()
+    with timed_phase('serialization'):
+        writer = csv_writer(response)
+        forecast_df = pd.DataFrame(forecast_statistics)
+        column_names = (forecast_df.columns.values +
+                        [' ({}3/s)'.format(get_units_title(units))]
+                        ).tolist()
 
-    writer.writerow(['datetime'] + column_names)
+        writer.writerow(['datetime'] + column_names)
 
-    for row_data in forecast_df.itertuples():
-        writer.writerow(row_data)
+        for row_data in forecast_df.itertuples():
+            writer.writerow(row_data)
 
     return response
 
@@ -569,70 +656,121 @@ def generate_warning_points(request):
     """
     Controller for getting warning points for user on map
     """
+    warning_points_file = validate_warning_points_info(request.GET)
+
+    warning_points = read_warning_points(warning_points_file)
+
+    return JsonResponse(warning_points)
+
+
+@require_GET
+@login_required
+@exceptions_to_http_status
+def get_warning_points_bbox(request):
+    """
+    Controller for getting the warning points in the bounding box
+    of the map, clustered at low zoom levels
+    """
+    warning_points_file = validate_warning_points_info(request.GET)
+    bbox, zoom = validate_bbox_info(request.GET)
+
+    warning_points = query_warning_points(warning_points_file, bbox, zoom)
+
+    with timed_phase('serialization'):
+        return JsonResponse(warning_points)
+
+
+@require_GET
+@login_required
+@exceptions_to_http_status
+def get_warning_points_group(request):
+    """
+    Controller for getting the warning points of all watersheds of a
+    watershed group (watershed_group_id) or of the watershed_name and
+    subbasin_name pairs for the return periods in one request
+    """
     path_to_ecmwf_rapid_output = \
         app.get_custom_setting('ecmwf_forecast_folder')
-    path_to_era_interim_data = app.get_custom_setting('historical_folder')
-    if not os.path.exists(path_to_ecmwf_rapid_output) \
-            or not os.path.exists(path_to_era_interim_data):
-        raise SettingsError('Location of ECMWF forecast and historical files '
-                            'faulty. Please check settings.')
+    if not os.path.exists(path_to_ecmwf_rapid_output):
+        raise SettingsError('Location of ECMWF forecast files faulty. '
+                            'Please check settings.')
 
     # get/check information from AJAX request
     get_info = request.GET
-    watershed_name, subbasin_name = validate_watershed_info(get_info)
-    return_period = get_info.get('return_period')
-    forecast_folder = get_info.get('forecast_folder')
-    if not return_period:
-        return InvalidData('Missing return_period parameter ...')
+    watershed_group_id = get_info.get('watershed_group_id')
+    if watershed_group_id:
+        try:
+            int(watershed_group_id)
+        except (TypeError, ValueError):
+            raise InvalidData('Watershed group ID is faulty ...')
 
-    try:
-        return_period = int(return_period)
-    except (TypeError, ValueError):
-        return InvalidData('Invalid return period.')
-
-    path_to_output_files = \
-        os.path.join(path_to_ecmwf_rapid_output,
-                     "{0}-{1}".format(watershed_name, subbasin_name))
-
-    # attempt to find forecast folder for watershed
-    if not forecast_folder:
-        if not os.path.exists(path_to_output_files):
-            raise NotFoundError('No forecasts found ...')
-
-        directory_list = \
-            sorted([d for d in os.listdir(path_to_output_files)
-                    if os.path.isdir(os.path.join(path_to_output_files, d))],
-                   reverse=True)
-        if directory_list:
-            forecast_folder = directory_list[0]
-
-    if not forecast_folder:
-        raise NotFoundError('No forecasts found with {0} return period '
-                            'warning points.'.format(return_period))
-
-    # get warning points to load in
-    if return_period == 20:
-        warning_points_file = os.path.join(path_to_output_files,
-                                           forecast_folder,
-                                           "return_20_points.geojson")
-    elif return_period == 10:
-        warning_points_file = os.path.join(path_to_output_files,
-                                           forecast_folder,
-                                           "return_10_points.geojson")
-    elif return_period == 2:
-        warning_points_file = os.path.join(path_to_output_files,
-                                           forecast_folder,
-                                           "return_2_points.geojson")
+        session_maker = app.get_persistent_store_database(
+            'main_db', as_sessionmaker=True)
+        session = session_maker()
+        try:
+            watershed_group = \
+                session.query(WatershedGroup).get(watershed_group_id)
+            if watershed_group is None:
+                raise NotFoundError('Watershed group with ID {0}.'
+                                    .format(watershed_group_id))
+            watersheds = [(watershed.ecmwf_data_store_watershed_name,
+                           watershed.ecmwf_data_store_subbasin_name)
+                          for watershed in watershed_group.watersheds
+                          if watershed.ecmwf_data_store_watershed_name and
+                          watershed.ecmwf_data_store_subbasin_name]
+        finally:
+            session.close()
     else:
-        raise InvalidData('Invalid return period.')
+        watersheds = validate_watershed_list_info(get_info)
+    return_periods = validate_return_periods_info(get_info)
+    bbox, zoom = validate_bbox_info(get_info) \
+        if get_info.get('bbox') else (None, None)
 
-    if not os.path.exists(warning_points_file):
-        raise NotFoundError('Warning points file.')
+    warning_points = query_watersheds_warning_points(
+        path_to_ecmwf_rapid_output, watersheds, return_periods,
+        get_info.get('forecast_folder'), bbox, zoom)
 
-    with open(warning_points_file, 'rb') as infile:
-        warning_points = json_load(infile)
+    with timed_phase('serialization'):
+        return JsonResponse({'warning_points': warning_points})
 
-    return JsonResponse(warning_points)
+
+@require_GET
+@login_required
+@exceptions_to_http_status
+def get_drainage_line_tile(request):
+    """
+    Controller for getting a drainage line tile (GeoJSON) of a watershed.
+    The browser keeps the tiles and checks them with their ETag.
+    """
+    watershed_id, zoom, tile_x, tile_y = validate_tile_info(request.GET)
+
+    tile_geojson, tile_etag = \
+        read_drainage_line_tile(watershed_id, zoom, tile_x, tile_y)
+
+    if request.META.get('HTTP_IF_NONE_MATCH') == tile_etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(tile_geojson,
+                                content_type='application/json')
+    response['ETag'] = tile_etag
+    patch_cache_control(response, private=True, max_age=TILE_MAX_AGE)
+    return response
+
+
+@require_GET
+@login_required
+@exceptions_to_http_status
+def get_reach_info(request):
+    """
+    Controller for looking up a reach (reach_id) of a watershed
+    (watershed_id) in the reach index of the watershed
+    """
+    watershed_id, reach_id = validate_reach_info(request.GET)
+
+    reach_info = query_reach(watershed_id, reach_id)
+
+    with timed_phase('serialization'):
+        return JsonResponse(reach_info)
 
 
 @require_GET
@@ -645,10 +783,12 @@ def get_historic_data_csv(request):
     # get information from GET request
     units = request.GET.get('units')
 
-    river_id, watershed_name, subbasin_name =\
-        validate_historical_data(request.GET)[1:]
+    historical_data_file, river_id, watershed_name, subbasin_name =\
+        validate_historical_data(request.GET)
 
-    qout_data = get_historic_streamflow_series(request)
+    qout_data = get_historic_streamflow_series(request,
+                                               historical_data_file,
+                                               river_id)
 
     # prepare to write response
     response = HttpResponse(content_type='text/csv')
@@ -658,13 +798,14 @@ def get_historic_data_csv(request):
                 subbasin_name,
                 river_id)
 
-    writer = csv_writer(response)
+    with timed_phase('serialization'):
+        writer = csv_writer(response)
 
-    writer.writerow(['datetime', 'streamflow ({}3/s)'
-                                 .format(get_units_title(units))])
+        writer.writerow(['datetime', 'streamflow ({}3/s)'
+                                     .format(get_units_title(units))])
 
-    for row_data in qout_data.iteritems():
-        writer.writerow(row_data)
+        for row_data in qout_data.iteritems():
+            writer.writerow(row_data)
 
     return response
 
@@ -691,25 +832,22 @@ def get_historical_hydrograph(request):
     """""
     Returns ERA Interim hydrograph
     """""
+    import plotly.graph_objs as go
+
     units = request.GET.get('units')
     historical_data_file, river_id, watershed_name, subbasin_name =\
         validate_historical_data(request.GET)
 
-    with rivid_exception_handler('ERA Interim', river_id):
-        with xarray.open_dataset(historical_data_file) as qout_nc:
-            # get information from dataset
-            qout_data = qout_nc.sel(rivid=river_id).Qout
-            qout_values = qout_data.values
-            qout_time = qout_data.time.values
-
-    if units == 'english':
-        # convert m3/s to ft3/s
-        qout_values *= M3_TO_FT3
+    # read only the requested time window & resolution
+    qout_data = get_historic_streamflow_series(request,
+                                               historical_data_file,
+                                               river_id)
+    qout_values = qout_data.values
+    qout_time = qout_data.index
 
     # ----------------------------------------------
     # Chart Section
     # ----------------------------------------------
-    qout_time = pd.to_datetime(qout_time)
     era_series = go.Scatter(
         name='ERA Interim',
         x=qout_time,
@@ -742,9 +880,10 @@ def get_historical_hydrograph(request):
         'gizmo_object': chart_obj,
     }
 
-    return render(request,
-                  'streamflow_prediction_tool/gizmo_ajax.html',
-                  context)
+    with timed_phase('serialization'):
+        return render(request,
+                      'streamflow_prediction_tool/gizmo_ajax.html',
+                      context)
 
 
 @require_GET
@@ -754,6 +893,8 @@ def get_daily_seasonal_streamflow_chart(request):
     """
     Returns daily seasonal streamflow chart for unique river ID
     """
+    import plotly.graph_objs as go
+
     units = request.GET.get('units')
     seasonal_data_file, river_id, watershed_name, subbasin_name =\
         validate_historical_data(request.GET,
@@ -761,28 +902,24 @@ def get_daily_seasonal_streamflow_chart(request):
                                  "Seasonal Average")
 
     with rivid_exception_handler('Seasonal Average', river_id):
-        with xarray.open_dataset(seasonal_data_file) as seasonal_nc:
-            seasonal_data = seasonal_nc.sel(rivid=river_id)
-            base_date = datetime.datetime(2017, 1, 1)
-            day_of_year = \
-                [base_date + datetime.timedelta(days=ii)
-                 for ii in range(seasonal_data.dims['day_of_year'])]
-            season_avg = seasonal_data.average_flow.values
-            season_std = seasonal_data.std_dev_flow.values
+        seasonal_data = read_seasonal_averages(seasonal_data_file,
+                                               river_id,
+                                               units)
 
-            season_avg[season_avg < 0] = 0
+    base_date = datetime.datetime(2017, 1, 1)
+    day_of_year = \
+        [base_date + datetime.timedelta(days=ii)
+         for ii in range(seasonal_data.dims['day_of_year'])]
+    season_avg = seasonal_data.average_flow.values
+    season_std = seasonal_data.std_dev_flow.values
 
-            avg_plus_std = season_avg + season_std
-            avg_min_std = season_avg - season_std
+    season_avg[season_avg < 0] = 0
 
-            avg_plus_std[avg_plus_std < 0] = 0
-            avg_min_std[avg_min_std < 0] = 0
+    avg_plus_std = season_avg + season_std
+    avg_min_std = season_avg - season_std
 
-    if units == 'english':
-        # convert from m3/s to ft3/s
-        season_avg *= M3_TO_FT3
-        avg_plus_std *= M3_TO_FT3
-        avg_min_std *= M3_TO_FT3
+    avg_plus_std[avg_plus_std < 0] = 0
+    avg_min_std[avg_min_std < 0] = 0
 
     # generate chart
     avg_scatter = go.Scatter(
@@ -839,9 +976,10 @@ def get_daily_seasonal_streamflow_chart(request):
         'gizmo_object': chart_obj,
     }
 
-    return render(request,
-                  'streamflow_prediction_tool/gizmo_ajax.html',
-                  context)
+    with timed_phase('serialization'):
+        return render(request,
+                      'streamflow_prediction_tool/gizmo_ajax.html',
+                      context)
 
 
 @require_GET
@@ -851,27 +989,25 @@ def get_monthly_seasonal_streamflow_chart(request):
     """""
     Returns monthly seasonal streamflow chart for unique river ID
     """""
+    import plotly.graph_objs as go
+
     historical_data_file, river_id, watershed_name, subbasin_name =\
         validate_historical_data(request.GET)
     units = request.GET.get('units')
 
     with rivid_exception_handler('ERA Interim', river_id):
-        with xarray.open_dataset(historical_data_file) as qout_nc:
-            # get information from dataset
-            qout_data = qout_nc.sel(rivid=river_id).Qout.to_dataframe().Qout
-            monthly_qout_data = qout_data.groupby(qout_data.index.month)
-
-            min_series = monthly_qout_data.min().values
-            max_series = monthly_qout_data.max().values
-            avg_series = monthly_qout_data.mean().values
-            std_series = monthly_qout_data.std().values
-            std_plus_series = avg_series + std_series
-
-    if units == 'english':
-        min_series *= M3_TO_FT3
-        max_series *= M3_TO_FT3
-        avg_series *= M3_TO_FT3
-        std_plus_series *= M3_TO_FT3
+        qout_data = read_historical_series(historical_data_file,
+                                           river_id,
+                                           units=units)
+
+    with timed_phase('statistics'):
+        monthly_qout_data = qout_data.groupby(qout_data.index.month)
+
+        min_series = monthly_qout_data.min().values
+        max_series = monthly_qout_data.max().values
+        avg_series = monthly_qout_data.mean().values
+        std_series = monthly_qout_data.std().values
+        std_plus_series = avg_series + std_series
 
     months_arr = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
                   'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
@@ -942,9 +1078,10 @@ def get_monthly_seasonal_streamflow_chart(request):
         'gizmo_object': chart_obj,
     }
 
-    return render(request,
-                  'streamflow_prediction_tool/gizmo_ajax.html',
-                  context)
+    with timed_phase('serialization'):
+        return render(request,
+                      'streamflow_prediction_tool/gizmo_ajax.html',
+                      context)
 
 
 @require_GET
@@ -956,28 +1093,28 @@ def get_flow_duration_curve(request):
 
     Based on: http://earthpy.org/flow.html
     """
+    import plotly.graph_objs as go
+    import scipy.stats as sp
+
     historical_data_file, river_id, watershed_name, subbasin_name = \
         validate_historical_data(request.GET)
     units = request.GET.get('units')
 
     with rivid_exception_handler('ERA Interim', river_id):
-        with xarray.open_dataset(historical_data_file) as qout_nc:
-            # get information from dataset
-            qout_data = qout_nc.sel(rivid=river_id).Qout.to_dataframe().Qout
+        qout_data = read_historical_series(historical_data_file,
+                                           river_id,
+                                           units=units)
 
-    sorted_daily_avg = np.sort(qout_data.values)[::-1]
+    with timed_phase('statistics'):
+        sorted_daily_avg = np.sort(qout_data.values)[::-1]
 
-    # ranks data from smallest to largest
-    ranks = len(sorted_daily_avg) - sp.rankdata(sorted_daily_avg,
-                                                method='average')
+        # ranks data from smallest to largest
+        ranks = len(sorted_daily_avg) - sp.rankdata(sorted_daily_avg,
+                                                    method='average')
 
-    # calculate probability of each rank
-    prob = [100*(ranks[i] / (len(sorted_daily_avg) + 1))
-            for i in range(len(sorted_daily_avg))]
-
-    if units == 'english':
-        # convert from m3/s to ft3/s
-        sorted_daily_avg *= M3_TO_FT3
+        # calculate probability of each rank
+        prob = [100*(ranks[i] / (len(sorted_daily_avg) + 1))
+                for i in range(len(sorted_daily_avg))]
 
     flow_duration_sc = go.Scatter(
         x=prob,
@@ -1004,9 +1141,10 @@ def get_flow_duration_curve(request):
         'gizmo_object': chart_obj,
     }
 
-    return render(request,
-                  'streamflow_prediction_tool/gizmo_ajax.html',
-                  context)
+    with timed_phase('serialization'):
+        return render(request,
+                      'streamflow_prediction_tool/gizmo_ajax.html',
+                      context)
 
 
 @require_POST
@@ -1014,7 +1152,9 @@ def get_flow_duration_curve(request):
 @exceptions_to_http_status
 def watershed_add(request):
     """
-    Controller for adding a watershed.
+    Controller for adding a watershed. The GeoServer layers are
+    uploaded or connected and the watershed is added by a background
+    job, which can be polled with job_status.
     """
     post_info = request.POST
     # get/check information from AJAX request
@@ -1027,14 +1167,14 @@ def watershed_add(request):
 
     # REQUIRED TO HAVE drainage_line from one of these
     # layer names
-    geoserver_drainage_line_layer_name = \
-        post_info.get('geoserver_drainage_line_layer')
-    geoserver_boundary_layer_name = post_info.get('geoserver_boundary_layer')
-    geoserver_gage_layer_name = post_info.get('geoserver_gage_layer')
-    geoserver_historical_flood_map_layer_name = \
-        post_info.get('geoserver_historical_flood_map_layer')
-    geoserver_ahps_station_layer_name = \
-        post_info.get('geoserver_ahps_station_layer')
+    layer_names = {
+        layer_attribute: post_info.get(layer_attribute)
+        for layer_attribute in ('geoserver_drainage_line_layer',
+                                'geoserver_boundary_layer',
+                                'geoserver_gage_layer',
+                                'geoserver_historical_flood_map_layer',
+                                'geoserver_ahps_station_layer')
+    }
     # shape files
     drainage_line_shp_file = request.FILES.getlist('drainage_line_shp_file')
 
@@ -1052,8 +1192,6 @@ def watershed_add(request):
         raise InvalidData('One or more ids are faulty.')
 
     # check ECMWF inputs
-    ecmwf_rapid_input_resource_id = ""
-
     data_store_watershed_name = \
         format_name(post_info.get('ecmwf_data_store_watershed_name'))
     data_store_subbasin_name = \
@@ -1064,6 +1202,11 @@ def watershed_add(request):
         raise InvalidData("Must have an ECMWF watershed and subbasin name "
                           "to continue.")
 
+    # validate geoserver inputs
+    if not drainage_line_shp_file \
+            and not layer_names['geoserver_drainage_line_layer']:
+        raise InvalidData('Missing geoserver drainage line.')
+
     # initialize session
     session_maker = app.get_persistent_store_database('main_db',
                                                       as_sessionmaker=True)
@@ -1078,143 +1221,37 @@ def watershed_add(request):
         session.close()
         raise DatabaseError("A watershed with the same name exists.")
 
-    # validate geoserver inputs
-    if not drainage_line_shp_file and not geoserver_drainage_line_layer_name:
-        session.close()
-        raise InvalidData('Missing geoserver drainage line.')
-
-    # get desired geoserver
-    try:
-        geoserver = session.query(GeoServer).get(geoserver_id)
-    except ObjectDeletedError:
-        session.close()
-        raise DatabaseError("The geoserver does not exist.")
-    try:
-        app_instance_id = app.get_custom_setting('app_instance_id')
-        geoserver_manager = \
-            GeoServerDatasetManager(engine_url=geoserver.url,
-                                    username=geoserver.username,
-                                    password=geoserver.password,
-                                    app_instance_id=app_instance_id)
-    except Exception as ex:
-        session.close()
-        return GeoServerError(str(ex))
-
-    # GEOSERVER UPLOAD
-    # check geoserver input before upload
+    # stage the shapefiles on the Tethys Platform server
+    upload_directory = None
+    shapefile_paths = {}
     if drainage_line_shp_file:
-        geoserver_drainage_line_layer_name = \
-            "%s-%s-%s" % (watershed_clean_name, subbasin_clean_name,
-                          'drainage_line')
-        # check shapefles
-        try:
-            geoserver_manager \
-                .check_shapefile_input_files(drainage_line_shp_file)
-        except Exception as ex:
-            session.close()
-            raise UploadError('Drainage Line layer - %s.' % ex)
-
-    # UPLOAD DRAINAGE LINE
-    try:
-        geoserver_drainage_line_layer = \
-            update_geoserver_layer(None,
-                                   geoserver_drainage_line_layer_name,
-                                   drainage_line_shp_file,
-                                   geoserver_manager,
-                                   session,
-                                   layer_required=True)
-    except Exception as ex:
-        session.close()
-        raise UploadError("Drainage Line layer error updating -  %s" % ex)
-
-    # UPDATE BOUNDARY
-    try:
-        geoserver_boundary_layer = \
-            update_geoserver_layer(None,
-                                   geoserver_boundary_layer_name,
-                                   None,
-                                   geoserver_manager,
-                                   session,
-                                   layer_required=False)
-    except Exception as ex:
-        session.close()
-        raise UploadError("Boundary layer error updating - %s" % ex)
-
-    # UPDATE GAGE
-    try:
-        geoserver_gage_layer = \
-            update_geoserver_layer(None,
-                                   geoserver_gage_layer_name,
-                                   None,
-                                   geoserver_manager,
-                                   session,
-                                   layer_required=False)
-    except Exception as ex:
-        session.close()
-        raise UploadError("Gage layer error updating - %s" % ex)
-
-    # UPDATE HISTORICAL FLOOD MAP LAYER GROUP
-    try:
-        geoserver_hist_flood_map_layer = \
-            update_geoserver_layer(None,
-                                   geoserver_historical_flood_map_layer_name,
-                                   None,
-                                   geoserver_manager,
-                                   session,
-                                   layer_required=False,
-                                   is_layer_group=True)
-    except Exception as ex:
-        session.close()
-        raise UploadError("Historical Flood Map layer error updating - %s"
-                          % ex)
-
-    # UPDATE AHPS STATION
-    try:
-        geoserver_ahps_station_layer = \
-            update_geoserver_layer(
-                None,
-                geoserver_ahps_station_layer_name,
-                None,
-                geoserver_manager,
-                session,
-                layer_required=False
-            )
-    except Exception as ex:
-        session.close()
-        raise UploadError("AHPS Station layer error updating - %s" % ex)
-
-    # add watershed
-    watershed = Watershed(
-        watershed_name=watershed_name.strip(),
-        subbasin_name=subbasin_name.strip(),
-        watershed_clean_name=watershed_clean_name,
-        subbasin_clean_name=subbasin_clean_name,
-        data_store_id=data_store_id,
-        ecmwf_rapid_input_resource_id=ecmwf_rapid_input_resource_id,
-        ecmwf_data_store_watershed_name=data_store_watershed_name.strip(),
-        ecmwf_data_store_subbasin_name=data_store_subbasin_name.strip(),
-        geoserver_id=geoserver_id,
-        geoserver_drainage_line_layer=geoserver_drainage_line_layer,
-        geoserver_boundary_layer=geoserver_boundary_layer,
-        geoserver_gage_layer=geoserver_gage_layer,
-        geoserver_historical_flood_map_layer=geoserver_hist_flood_map_layer,
-        geoserver_ahps_station_layer=geoserver_ahps_station_layer,
-    )
-
-    session.add(watershed)
-    session.commit()
-
-    # get watershed_id
-    response = {
-        'success': "Watershed Sucessfully Added!",
-        'watershed_id': watershed.id,
-        'geoserver_drainage_line_layer': geoserver_drainage_line_layer.name
-        if geoserver_drainage_line_layer
-        else geoserver_drainage_line_layer_name,
-    }
+        upload_directory = get_upload_directory()
+        shapefile_paths['drainage_line'] = \
+            stage_uploaded_files(drainage_line_shp_file, upload_directory)
+
+    # upload to GeoServer & add watershed in the background
+    job = create_job(session, 'watershed_add', {
+        'watershed_info': {
+            'watershed_name': watershed_name.strip(),
+            'subbasin_name': subbasin_name.strip(),
+            'watershed_clean_name': watershed_clean_name,
+            'subbasin_clean_name': subbasin_clean_name,
+            'data_store_id': int(data_store_id),
+            'ecmwf_data_store_watershed_name':
+                data_store_watershed_name.strip(),
+            'ecmwf_data_store_subbasin_name':
+                data_store_subbasin_name.strip(),
+            'geoserver_id': int(geoserver_id),
+        },
+        'layer_names': layer_names,
+        'shapefile_paths': shapefile_paths,
+        'upload_directory': upload_directory,
+    })
+    job_id = job.id
     session.close()
+    start_job(job_id)
 
-    return JsonResponse(response)
+    return JsonResponse({'job_id': job_id})
 
 
 @require_POST
@@ -1223,6 +1260,8 @@ def watershed_add(request):
 def watershed_ecmwf_rapid_file_upload(request):
     """
     Controller AJAX for uploading RAPID input files for a watershed.
+    The file is staged in the app workspace and uploaded to the data
+    store by a background job, which can be polled with job_status.
     """
     watershed_id = request.POST.get('watershed_id')
     ecmwf_rapid_input_file = request.FILES.get('ecmwf_rapid_input_file')
@@ -1246,72 +1285,32 @@ def watershed_ecmwf_rapid_file_upload(request):
         session.close()
         raise InvalidData("Not allowed to upload to the local data store ...")
 
-    # Upload file to Data Store Server
-
-    # temporarily upload to Tethys Plarform server
-    tmp_file_location = \
-        os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                     'workspaces', 'app_workspace')
-
+    # stage the upload on the Tethys Platform server
+    # in a folder unique to this upload
     ecmwf_rapid_input_zip = \
         "%s-%s-rapid.zip" % (watershed.ecmwf_data_store_watershed_name,
                              watershed.ecmwf_data_store_subbasin_name)
-    local_file_path = os.path.join(tmp_file_location,
-                                   ecmwf_rapid_input_zip)
-
-    # delete local file
-    try:
-        os.remove(local_file_path)
-    except OSError:
-        pass
-
-    handle_uploaded_file(ecmwf_rapid_input_file,
-                         tmp_file_location,
-                         ecmwf_rapid_input_zip)
-
-    # upload file to CKAN server
-    app_instance_id = app.get_custom_setting('app_instance_id')
-    data_manager = \
-        RAPIDInputDatasetManager(watershed.data_store.api_endpoint,
-                                 watershed.data_store.api_key,
-                                 "ecmwf",
-                                 app_instance_id,
-                                 watershed.data_store.owner_org)
-
-    # remove RAPID input files on CKAN if exists
-    if watershed.ecmwf_rapid_input_resource_id.strip():
-        data_manager.dataset_engine.delete_resource(
-            watershed.ecmwf_rapid_input_resource_id
-        )
-
-    # upload file to CKAN
-    try:
-        resource_info = \
-            data_manager.upload_model_resource(
-                local_file_path,
-                watershed.ecmwf_data_store_watershed_name,
-                watershed.ecmwf_data_store_subbasin_name
-            )
-    except Exception:
-        # delete local file
-        try:
-            os.remove(local_file_path)
-        except OSError:
-            pass
-        session.close()
-        raise UploadError('Problem uploading ECMWF-RAPID dataset to CKAN ...')
-
-    # delete local file
-    try:
-        os.remove(local_file_path)
-    except OSError:
-        pass
-
-    # update watershed
-    watershed.ecmwf_rapid_input_resource_id = resource_info['result']['id']
-    session.commit()
+    upload_directory = get_upload_directory()
+    checksum = handle_uploaded_file(ecmwf_rapid_input_file,
+                                    upload_directory,
+                                    ecmwf_rapid_input_zip)
+
+    # upload file to CKAN server in the background
+    job = create_job(session, 'ecmwf_rapid_input_upload', {
+        'watershed_id': int(watershed_id),
+        'local_file_path': os.path.join(upload_directory,
+                                        ecmwf_rapid_input_zip),
+        'checksum': checksum,
+    })
+    job_id = job.id
     session.close()
-    return JsonResponse({'success': 'ECMWF-RAPID input upload success!'})
+    start_job(job_id)
+
+    return JsonResponse({
+        'success': 'ECMWF-RAPID input upload started ...',
+        'job_id': job_id,
+        'checksum': checksum,
+    })
 
 
 @require_POST
@@ -1345,8 +1344,10 @@ def watershed_delete(request):
     delete_from_database(session, watershed)
     # NOTE: CASCADE removes associated geoserver layers
 
-    # delete watershed from database
+    # delete watershed from database and remove its files
+    # from GeoServer, CKAN and the forecast folder in the background
     session.commit()
+    start_queued_jobs(session)
     session.close()
 
     return JsonResponse({'success': "Watershed sucessfully deleted!"})
@@ -1357,7 +1358,9 @@ def watershed_delete(request):
 @exceptions_to_http_status
 def watershed_update(request):
     """
-    Controller for updating a watershed.
+    Controller for updating a watershed. The GeoServer layers are
+    uploaded or connected and the watershed is updated by a background
+    job, which can be polled with job_status.
     """
     post_info = request.POST
     # get/check information from AJAX request
@@ -1371,19 +1374,21 @@ def watershed_update(request):
 
     # REQUIRED TO HAVE drainage_line from one of these
     # layer names
-    geoserver_drainage_line_layer_name = post_info.get(
-        'geoserver_drainage_line_layer')
-    geoserver_boundary_layer_name = post_info.get('geoserver_boundary_layer')
-    geoserver_gage_layer_name = post_info.get('geoserver_gage_layer')
-    geoserver_historical_flood_map_layer_name = post_info.get(
-        'geoserver_historical_flood_map_layer')
-    geoserver_ahps_station_layer_name = post_info.get(
-        'geoserver_ahps_station_layer')
+    layer_names = {
+        layer_attribute: post_info.get(layer_attribute)
+        for layer_attribute in ('geoserver_drainage_line_layer',
+                                'geoserver_boundary_layer',
+                                'geoserver_gage_layer',
+                                'geoserver_historical_flood_map_layer',
+                                'geoserver_ahps_station_layer')
+    }
     # shape files
-    drainage_line_shp_file = request.FILES.getlist('drainage_line_shp_file')
-    boundary_shp_file = request.FILES.getlist('boundary_shp_file')
-    gage_shp_file = request.FILES.getlist('gage_shp_file')
-    ahps_station_shp_file = request.FILES.getlist('ahps_station_shp_file')
+    shp_files = {
+        shapefile_name: request.FILES.getlist(
+            '{0}_shp_file'.format(shapefile_name))
+        for shapefile_name in ('drainage_line', 'boundary',
+                               'gage', 'ahps_station')
+    }
     # CHECK INPUT
     # check if variables exist
     if not (watershed_id or data_store_id or geoserver_id
@@ -1398,33 +1403,6 @@ def watershed_update(request):
     except (TypeError, ValueError):
         raise InvalidData('One or more ids are faulty.')
 
-    # initialize session
-    session_maker = app.get_persistent_store_database('main_db',
-                                                      as_sessionmaker=True)
-    session = session_maker()
-    # check to see if duplicate exists
-    num_similar_watersheds = session.query(Watershed) \
-        .filter(Watershed.watershed_clean_name == watershed_clean_name) \
-        .filter(Watershed.subbasin_clean_name == subbasin_clean_name) \
-        .filter(Watershed.id != watershed_id) \
-        .count()
-    if num_similar_watersheds > 0:
-        session.close()
-        raise DatabaseError("A watershed with the same name exists ...")
-
-    # get desired watershed
-    try:
-        watershed = session.query(Watershed).get(watershed_id)
-    except ObjectDeletedError:
-        session.close()
-        raise DatabaseError("The watershed to update does not exist ...")
-    # get desired geoserver
-    try:
-        geoserver = session.query(GeoServer).get(geoserver_id)
-    except ObjectDeletedError:
-        session.close()
-        raise DatabaseError("The geoserver does not exist ...")
-
     # check ecmwf inputs
     ecmwf_data_store_watershed_name = format_name(
         post_info.get('ecmwf_data_store_watershed_name'))
@@ -1433,247 +1411,61 @@ def watershed_update(request):
 
     if not ecmwf_data_store_watershed_name \
             or not ecmwf_data_store_subbasin_name:
-        session.close()
         raise InvalidData("Must have an ECMWF watershed/subbasin name "
                           "to continue")
 
-    # GEOSERVER SECTION
-    # remove old geoserver files if geoserver changed
-    if int(geoserver_id) != watershed.geoserver_id:
-        # remove old geoserver files
-        watershed.delete_geoserver_files()
-
     # validate geoserver inputs
-    if not drainage_line_shp_file and not geoserver_drainage_line_layer_name:
-        session.close()
+    if not shp_files['drainage_line'] \
+            and not layer_names['geoserver_drainage_line_layer']:
         raise InvalidData('Missing geoserver drainage line.')
 
-    try:
-        app_instance_id = app.get_custom_setting('app_instance_id')
-        geoserver_manager = \
-            GeoServerDatasetManager(engine_url=geoserver.url,
-                                    username=geoserver.username,
-                                    password=geoserver.password,
-                                    app_instance_id=app_instance_id)
-    except Exception as ex:
-        session.close()
-        raise GeoServerError(str(ex))
-
-    # check geoserver input before upload
-    if drainage_line_shp_file:
-        geoserver_drainage_line_layer_name = "%s-%s-%s" % (
-            watershed_clean_name, subbasin_clean_name, 'drainage_line')
-        # check permissions to upload file
-        if watershed.geoserver_drainage_line_layer:
-            if not watershed.geoserver_drainage_line_layer.uploaded and \
-                    watershed.geoserver_drainage_line_layer.name \
-                    == geoserver_manager.get_layer_name(
-                    geoserver_drainage_line_layer_name):
-                session.close()
-                raise PermissionDenied('You do not have permissions to '
-                                       'overwrite the drainage line layer ...')
-
-        # check shapefles
-        try:
-            geoserver_manager.check_shapefile_input_files(
-                drainage_line_shp_file)
-        except Exception as ex:
-            session.close()
-            raise UploadError('Drainage Line - %s.' % ex)
-
-    if boundary_shp_file:
-        geoserver_boundary_layer_name = "%s-%s-%s" % (
-            watershed_clean_name, subbasin_clean_name, 'boundary')
-        # check permissions to upload file
-        if watershed.geoserver_boundary_layer:
-            if not watershed.geoserver_boundary_layer.uploaded and \
-                    watershed.geoserver_boundary_layer.name == \
-                    geoserver_manager.get_layer_name(
-                        geoserver_boundary_layer_name):
-                session.close()
-                raise PermissionDenied('You do not have permissions to '
-                                       'overwrite the boundary layer ...')
-
-        # check shapefiles
-        try:
-            geoserver_manager.check_shapefile_input_files(boundary_shp_file)
-        except Exception as ex:
-            session.close()
-            raise UploadError('Boundary - %s.' % ex)
-
-    if gage_shp_file:
-        geoserver_gage_layer_name = "%s-%s-%s" % (
-            watershed_clean_name, subbasin_clean_name, 'gage')
-        # check permissions to upload file
-        if watershed.geoserver_gage_layer:
-            if not watershed.geoserver_gage_layer.uploaded and \
-                    watershed.geoserver_gage_layer.name == \
-                    geoserver_manager.get_layer_name(
-                        geoserver_gage_layer_name):
-                session.close()
-                raise PermissionDenied('You do not have permissions to '
-                                       'overwrite the gage layer ...')
-
-        # check shapefiles
-        try:
-            geoserver_manager.check_shapefile_input_files(gage_shp_file)
-        except Exception as ex:
-            session.close()
-            raise UploadError('Gage - %s.' % ex)
-
-    if ahps_station_shp_file:
-        geoserver_ahps_station_layer_name = "%s-%s-%s" % (
-            watershed_clean_name, subbasin_clean_name, 'ahps_station')
-        # check permissions to upload file
-        if watershed.geoserver_ahps_station_layer:
-            if not watershed.geoserver_ahps_station_layer.uploaded and \
-                    watershed.geoserver_ahps_station_layer.name == \
-                    geoserver_manager.get_layer_name(
-                        geoserver_ahps_station_layer_name):
-                session.close()
-                raise PermissionDenied('You do not have permissions to '
-                                       'overwrite the AHPS station layer ...')
-
-        # check shapefiles
-        try:
-            geoserver_manager\
-                .check_shapefile_input_files(ahps_station_shp_file)
-        except Exception as ex:
-            session.close()
-            raise UploadError('AHPS Station - %s.' % ex)
-
-    # UPDATE DRAINAGE LINE
-    try:
-        watershed.geoserver_drainage_line_layer = \
-            update_geoserver_layer(
-                watershed.geoserver_drainage_line_layer,
-                geoserver_drainage_line_layer_name,
-                drainage_line_shp_file,
-                geoserver_manager,
-                session,
-                layer_required=True
-            )
-    except Exception as ex:
-        session.close()
-        raise UploadError("Drainage Line layer update - %s" % ex)
-
-    # UPDATE Boundary
-    try:
-        watershed.geoserver_boundary_layer = \
-            update_geoserver_layer(
-                watershed.geoserver_boundary_layer,
-                geoserver_boundary_layer_name,
-                boundary_shp_file,
-                geoserver_manager,
-                session,
-                layer_required=False
-            )
-    except Exception as ex:
-        session.close()
-        raise UploadError("Boundary layer update - %s" % ex)
-
-    # UPDATE GAGE
-    try:
-        watershed.geoserver_gage_layer = \
-            update_geoserver_layer(
-                watershed.geoserver_gage_layer,
-                geoserver_gage_layer_name,
-                gage_shp_file,
-                geoserver_manager,
-                session,
-                layer_required=False
-            )
-    except Exception as ex:
-        session.close()
-        raise UploadError("Gage layer update - %s" % ex)
-
-    # UPDATE HISTORICAL FLOOD MAP LAYER GROUP
-    try:
-        watershed.geoserver_historical_flood_map_layer = \
-            update_geoserver_layer(
-                watershed.geoserver_historical_flood_map_layer,
-                geoserver_historical_flood_map_layer_name,
-                None,
-                geoserver_manager,
-                session,
-                layer_required=False,
-                is_layer_group=True
-            )
-    except Exception as ex:
-        session.close()
-        raise UploadError("Historical Flood Map layer update - %s" % ex)
-
-    # UPDATE AHPS STATION
-    try:
-        watershed.geoserver_ahps_station_layer = update_geoserver_layer(
-            watershed.geoserver_ahps_station_layer,
-            geoserver_ahps_station_layer_name,
-            ahps_station_shp_file,
-            geoserver_manager,
-            session,
-            layer_required=False)
-    except Exception as ex:
+    # initialize session
+    session_maker = app.get_persistent_store_database('main_db',
+                                                      as_sessionmaker=True)
+    session = session_maker()
+    # check to see if duplicate exists
+    num_similar_watersheds = session.query(Watershed) \
+        .filter(Watershed.watershed_clean_name == watershed_clean_name) \
+        .filter(Watershed.subbasin_clean_name == subbasin_clean_name) \
+        .filter(Watershed.id != watershed_id) \
+        .count()
+    if num_similar_watersheds > 0:
         session.close()
-        raise UploadError("AHPS Station layer update - %s" % ex)
-
-    # remove old prediction files if watershed/subbasin name changed
-    if (ecmwf_data_store_watershed_name !=
-            watershed.ecmwf_data_store_watershed_name or
-            ecmwf_data_store_subbasin_name !=
-            watershed.ecmwf_data_store_subbasin_name):
-        watershed.delete_prediction_files()
-        # remove RAPID input files on CKAN if exists
-        try:
-            watershed.delete_rapid_input_ckan()
-        except Exception as ex:
-            session.close()
-            raise InvalidData("Invalid CKAN instance %s. "
-                              "Cannot delete RAPID input files on CKAN: %s"
-                              % (watershed.data_store.api_endpoint, ex))
-
-    # remove CKAN files on old CKAN instance
-    if watershed.data_store_id != data_store_id:
-        # remove RAPID input files on CKAN if exists
-        try:
-            watershed.delete_rapid_input_ckan()
-        except Exception as ex:
-            session.close()
-            raise InvalidData("Invalid CKAN instance %s. "
-                              "Cannot delete RAPID input files on CKAN: %s"
-                              % (watershed.data_store.api_endpoint, ex))
-
-    # change watershed attributes
-    watershed.watershed_name = watershed_name.strip()
-    watershed.subbasin_name = subbasin_name.strip()
-    watershed.watershed_clean_name = watershed_clean_name
-    watershed.subbasin_clean_name = subbasin_clean_name
-    watershed.data_store_id = data_store_id
-    watershed.ecmwf_data_store_watershed_name = ecmwf_data_store_watershed_name
-    watershed.ecmwf_data_store_subbasin_name = ecmwf_data_store_subbasin_name
-    watershed.geoserver_id = geoserver_id
-
-    response = {
-        'success': "Watershed sucessfully updated!",
-        'geoserver_drainage_line_layer':
-        watershed.geoserver_drainage_line_layer.name
-            if watershed.geoserver_drainage_line_layer else "",
-        'geoserver_boundary_layer': watershed.geoserver_boundary_layer.name
-            if watershed.geoserver_boundary_layer else "",
-        'geoserver_gage_layer': watershed.geoserver_gage_layer.name
-            if watershed.geoserver_gage_layer else "",
-        'geoserver_historical_flood_map_layer':
-        watershed.geoserver_historical_flood_map_layer.name
-            if watershed.geoserver_historical_flood_map_layer else "",
-        'geoserver_ahps_station_layer':
-        watershed.geoserver_ahps_station_layer.name
-            if watershed.geoserver_ahps_station_layer else "",
-    }
+        raise DatabaseError("A watershed with the same name exists ...")
 
-    # update database
-    session.commit()
+    # stage the shapefiles on the Tethys Platform server
+    upload_directory = None
+    shapefile_paths = {}
+    if any(shp_files.values()):
+        upload_directory = get_upload_directory()
+        for shapefile_name, shp_file in shp_files.items():
+            if shp_file:
+                shapefile_paths[shapefile_name] = stage_uploaded_files(
+                    shp_file, os.path.join(upload_directory, shapefile_name))
+
+    # upload to GeoServer & update watershed in the background
+    job = create_job(session, 'watershed_update', {
+        'watershed_id': int(watershed_id),
+        'watershed_info': {
+            'watershed_name': watershed_name.strip(),
+            'subbasin_name': subbasin_name.strip(),
+            'watershed_clean_name': watershed_clean_name,
+            'subbasin_clean_name': subbasin_clean_name,
+            'data_store_id': int(data_store_id),
+            'ecmwf_data_store_watershed_name':
+                ecmwf_data_store_watershed_name,
+            'ecmwf_data_store_subbasin_name': ecmwf_data_store_subbasin_name,
+            'geoserver_id': int(geoserver_id),
+        },
+        'layer_names': layer_names,
+        'shapefile_paths': shapefile_paths,
+        'upload_directory': upload_directory,
+    })
+    job_id = job.id
     session.close()
+    start_job(job_id)
 
-    return JsonResponse(response)
+    return JsonResponse({'job_id': job_id})
 
 
 @require_POST
@@ -1800,3 +1592,62 @@ def watershed_group_update(request):
     return JsonResponse({
         'success': "Watershed group successfully updated."
     })
+
+
+@require_GET
+@user_passes_test(user_permission_test)
+@exceptions_to_http_status
+def job_status(request):
+    """
+    Controller AJAX for the status and progress of a background job.
+    """
+    job_id = request.GET.get('job_id')
+    # make sure id is int
+    try:
+        int(job_id)
+    except (TypeError, ValueError):
+        raise InvalidData('Job ID is invalid ...')
+
+    session_maker = app.get_persistent_store_database('main_db',
+                                                      as_sessionmaker=True)
+    session = session_maker()
+    try:
+        recover_jobs(session)
+        job_info = get_job_info(session, job_id)
+    finally:
+        session.close()
+    return JsonResponse(job_info)
+
+
+@require_GET
+@user_passes_test(user_permission_test)
+@exceptions_to_http_status
+def job_list(request):
+    """
+    Controller AJAX for the status and progress of the most recent
+    background jobs, optionally with the given status.
+    """
+    status = request.GET.get('status')
+    if status and status not in (JOB_PENDING, JOB_RUNNING,
+                                 JOB_SUCCESS, JOB_ERROR):
+        raise InvalidData('Job status is invalid ...')
+
+    session_maker = app.get_persistent_store_database('main_db',
+                                                      as_sessionmaker=True)
+    session = session_maker()
+    try:
+        recover_jobs(session)
+        jobs = get_job_list(session, status=status)
+    finally:
+        session.close()
+    return JsonResponse({'jobs': jobs})
+
+
+@require_GET
+@user_passes_test(user_permission_test)
+def performance_metrics(request):  # pylint: disable=unused-argument
+    """
+    Returns the latency of the app endpoints broken down into phases
+    recorded by this process since it started.
+    """
+    return JsonResponse(get_performance_metrics())
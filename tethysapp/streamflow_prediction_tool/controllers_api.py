@@ -14,6 +14,8 @@ from .controllers_ajax import (get_forecast_streamflow_csv,
                                get_historic_data_csv,
                                generate_warning_points)
 from .controllers_functions import (get_ecmwf_avaialable_dates,
+                                    get_ecmwf_ensemble,
+                                    get_ecmwf_forecast_probabilities,
                                     get_ecmwf_forecast_statistics,
                                     get_historic_streamflow_series,
                                     get_return_period_dict)
@@ -21,6 +23,11 @@ from .controllers_validators import validate_historical_data
 from .exception_handling import InvalidData, exceptions_to_http_status
 from .functions import get_units_title
 from .model import Watershed
+from .output_formats import (BINARY_RETURN_FORMATS,
+                             ensemble_to_response,
+                             return_periods_to_response,
+                             time_series_to_response)
+from .performance import timed_phase
 
 
 @api_view(['GET'])
@@ -29,13 +36,28 @@ from .model import Watershed
 def get_ecmwf_forecast(request):
     """
     Controller that will retrieve the ECMWF forecast data
-    in WaterML 1.1 or CSV format
+    in WaterML 1.1, CSV, NetCDF or SPT binary format
     """
     return_format = request.GET.get('return_format')
 
     if return_format == 'csv':
         return get_forecast_streamflow_csv(request)
 
+    if return_format in BINARY_RETURN_FORMATS:
+        forecast_statistics, watershed_name, subbasin_name, river_id, units =\
+            get_ecmwf_forecast_statistics(request)
+        return time_series_to_response(
+            forecast_statistics,
+            return_format,
+            'forecasted_streamflow_{0}_{1}_{2}'.format(watershed_name,
+                                                       subbasin_name,
+                                                       river_id),
+            units,
+            attributes={'watershed_name': watershed_name,
+                        'subbasin_name': subbasin_name,
+                        'rivid': river_id,
+                        'source': 'ECMWF GloFAS forecast'})
+
     # return WaterML
     formatted_stat = {
         'high_res': 'High Resolution',
@@ -88,14 +110,75 @@ def get_ecmwf_forecast(request):
         'host': 'https://%s' % request.get_host(),
     }
 
-    xml_response = \
-        render_to_response('streamflow_prediction_tool/waterml.xml',
-                           context)
+    with timed_phase('serialization'):
+        xml_response = \
+            render_to_response('streamflow_prediction_tool/waterml.xml',
+                               context)
     xml_response['Content-Type'] = 'application/xml'
 
     return xml_response
 
 
+@api_view(['GET'])
+@authentication_classes((TokenAuthentication,))
+@exceptions_to_http_status
+def get_ecmwf_ensemble_forecast(request):
+    """
+    Controller that will stream all members of the ECMWF forecast
+    for one or many reaches in CSV, NetCDF or SPT binary format
+    """
+    return_format = request.GET.get('return_format') or 'csv'
+
+    ensemble_ds, watershed_name, subbasin_name, river_ids, units = \
+        get_ecmwf_ensemble(request)
+
+    file_name = 'forecasted_ensemble_{0}_{1}_{2}'.format(watershed_name,
+                                                         subbasin_name,
+                                                         river_ids[0])
+    if len(river_ids) > 1:
+        file_name = 'forecasted_ensemble_{0}_{1}'.format(watershed_name,
+                                                         subbasin_name)
+
+    return ensemble_to_response(
+        ensemble_ds,
+        return_format,
+        file_name,
+        units,
+        attributes={'watershed_name': watershed_name,
+                    'subbasin_name': subbasin_name,
+                    'source': 'ECMWF GloFAS forecast'})
+
+
+@api_view(['GET'])
+@authentication_classes((TokenAuthentication,))
+@exceptions_to_http_status
+def get_ecmwf_forecast_probabilities_api(request):
+    """
+    Controller that will retrieve the ECMWF forecast percentiles and
+    return period exceedance probabilities in CSV, NetCDF or
+    SPT binary format
+    """
+    return_format = request.GET.get('return_format') or 'csv'
+
+    forecast_probabilities, watershed_name, subbasin_name, river_id, units =\
+        get_ecmwf_forecast_probabilities(request)
+
+    return time_series_to_response(
+        forecast_probabilities,
+        return_format,
+        'forecasted_probabilities_{0}_{1}_{2}'.format(watershed_name,
+                                                      subbasin_name,
+                                                      river_id),
+        units,
+        attributes={'watershed_name': watershed_name,
+                    'subbasin_name': subbasin_name,
+                    'rivid': river_id,
+                    'source': 'ECMWF GloFAS forecast'},
+        variable_units={stat_name: 'fraction'
+                        for stat_name in forecast_probabilities
+                        if stat_name.startswith('exceedance_')})
+
+
 @api_view(['GET'])
 @authentication_classes((TokenAuthentication,))
 @exceptions_to_http_status
@@ -110,10 +193,25 @@ def get_historic_data(request):
 
     units = request.GET.get('units')
 
-    river_id, watershed_name, subbasin_name =\
-        validate_historical_data(request.GET)[1:]
-
-    qout_data = get_historic_streamflow_series(request)
+    historical_data_file, river_id, watershed_name, subbasin_name =\
+        validate_historical_data(request.GET)
+
+    qout_data = get_historic_streamflow_series(request,
+                                               historical_data_file,
+                                               river_id)
+
+    if return_format in BINARY_RETURN_FORMATS:
+        return time_series_to_response(
+            {'Qout': qout_data},
+            return_format,
+            'historic_streamflow_{0}_{1}_{2}'.format(watershed_name,
+                                                     subbasin_name,
+                                                     river_id),
+            units,
+            attributes={'watershed_name': watershed_name,
+                        'subbasin_name': subbasin_name,
+                        'rivid': river_id,
+                        'source': 'ECMWF ERA Interim data'})
 
     # return as WaterML 1.1
     startdate = qout_data.index[0].strftime('%Y-%m-%d %H:%M:%S')
@@ -144,9 +242,10 @@ def get_historic_data(request):
         'host': 'https://%s' % request.get_host(),
     }
 
-    xml_response = \
-        render_to_response('streamflow_prediction_tool/waterml.xml',
-                           context)
+    with timed_phase('serialization'):
+        xml_response = \
+            render_to_response('streamflow_prediction_tool/waterml.xml',
+                               context)
     xml_response['Content-Type'] = 'application/xml'
 
     return xml_response
@@ -157,9 +256,31 @@ def get_historic_data(request):
 @exceptions_to_http_status
 def get_return_periods_api(request):
     """
-    Controller that will show the return period data in json format
+    Controller that will show the return period data in json,
+    NetCDF or SPT binary format
     """
-    return JsonResponse(get_return_period_dict(request), safe=False)
+    return_period_file, river_id, watershed_name, subbasin_name = \
+        validate_historical_data(request.GET,
+                                 "return_period*.nc",
+                                 "Return Period")
+    return_period_data = get_return_period_dict(request,
+                                                return_period_file,
+                                                river_id)
+
+    return_format = request.GET.get('return_format')
+    if return_format in BINARY_RETURN_FORMATS:
+        return return_periods_to_response(
+            return_period_data,
+            return_format,
+            'return_periods_{0}_{1}_{2}'.format(watershed_name,
+                                                subbasin_name,
+                                                river_id),
+            request.GET.get('units'),
+            attributes={'watershed_name': watershed_name,
+                        'subbasin_name': subbasin_name,
+                        'rivid': river_id})
+
+    return JsonResponse(return_period_data, safe=False)
 
 
 @api_view(['GET'])
@@ -7,24 +7,32 @@
     Author: Alan D. Snow, 2017
     License: BSD 3-Clause
 """
+from collections import OrderedDict
 import os
 
-import pandas as pd
-import xarray
+import numpy as np
 
 from django.shortcuts import render
 
 from .app import StreamflowPredictionTool as app
-from .controllers_validators import (validate_historical_data,
+from .controllers_validators import (validate_ecmwf_forecast_data,
+                                     validate_historical_data,
+                                     validate_percentiles_info,
                                      validate_rivid_info,
+                                     validate_rivid_list_info,
+                                     validate_time_window_info,
                                      validate_watershed_info)
+from .data_access import (read_forecast_ensemble,
+                          read_historical_series,
+                          read_return_periods)
 from .exception_handling import (NotFoundError, SettingsError,
                                  rivid_exception_handler)
-
-from .functions import (ecmwf_find_most_current_files,
-                        get_ecmwf_valid_forecast_folder_list,
+from .forecast_statistics import compute_ensemble_statistics
+from .functions import (get_ecmwf_valid_forecast_folder_list,
+                        DEFAULT_PERCENTILES,
                         M3_TO_FT3)
 from .model import DataStore, GeoServer, Watershed, WatershedGroup
+from .performance import timed_phase
 
 
 def get_ecmwf_avaialable_dates(request):
@@ -59,127 +67,223 @@ def get_ecmwf_avaialable_dates(request):
     return output_directories
 
 
-def get_ecmwf_forecast_statistics(request):
+def get_ecmwf_ensemble(request):
     """
-    Returns the statistics for the 52 member forecast
+    Returns the full 52 member forecast for one or many river IDs
+    with dimensions (rivid, ensemble, time)
     """
-    path_to_rapid_output = app.get_custom_setting('ecmwf_forecast_folder')
-    if not os.path.exists(path_to_rapid_output):
-        raise SettingsError('Location of ECMWF forecast files faulty. '
-                            'Please check settings.')
+    get_info = request.GET
+    forecast_nc_list, watershed_name, subbasin_name = \
+        validate_ecmwf_forecast_data(get_info)
+    river_ids = validate_rivid_list_info(get_info)
+    units = get_info.get('units')
+
+    with rivid_exception_handler("ECMWF Forecast", river_ids):
+        merged_ds = read_forecast_ensemble(forecast_nc_list, river_ids,
+                                           units)\
+            .transpose('rivid', 'ensemble', 'time')
+
+    return merged_ds, watershed_name, subbasin_name, river_ids, units
+
 
+def get_ecmwf_forecast_reach_ensemble(request):
+    """
+    Returns the merged 52 member forecast (ensemble, time)
+    for the river ID in the request
+    """
     # get/check information from AJAX request
     get_info = request.GET
-    watershed_name, subbasin_name = validate_watershed_info(get_info)
+    forecast_nc_list, watershed_name, subbasin_name = \
+        validate_ecmwf_forecast_data(get_info)
     river_id = validate_rivid_info(get_info)
     units = get_info.get('units')
 
-    forecast_folder = get_info.get('forecast_folder')
-    if not forecast_folder:
-        forecast_folder = 'most_recent'
+    # combine 52 ensembles
+    with rivid_exception_handler("ECMWF Forecast", river_id):
+        merged_ds = read_forecast_ensemble(forecast_nc_list, river_id)
+
+    return merged_ds, watershed_name, subbasin_name, river_id, units
+
+
+def _ensemble_values(merged_ds):
+    """
+    Returns the time index and the (ensemble, time) values of the
+    merged ensemble forecast without copying the values
+    """
+    merged_ds = merged_ds.transpose('ensemble', 'time')
+    return merged_ds.time.to_index(), merged_ds.values
+
+
+def _complete_time_steps(ensemble_values):
+    """
+    Returns the mask of the time steps with values for all members
+    """
+    complete_time_steps = np.ones(ensemble_values.shape[1], dtype=bool)
+    for member_values in ensemble_values:
+        complete_time_steps &= ~np.isnan(member_values)
+    return complete_time_steps
+
+
+@timed_phase('statistics')
+def compute_forecast_statistics(merged_ds, stat_type, units):
+    """
+    Computes the statistics of the merged ensemble forecast
+    as a dictionary of pandas series
+    """
+    import pandas as pd
 
-    stat_type = get_info.get('stat_type')
     if stat_type is None:
         stat_type = ""
 
-    # find/check current output datasets
-    path_to_output_files = \
-        os.path.join(path_to_rapid_output,
-                     "{0}-{1}".format(watershed_name, subbasin_name))
-    forecast_nc_list, start_date = \
-        ecmwf_find_most_current_files(path_to_output_files, forecast_folder)
-    if not forecast_nc_list or not start_date:
-        raise NotFoundError('ECMWF forecast for %s (%s).'
-                            % (watershed_name, subbasin_name))
-    # combine 52 ensembles
-    qout_datasets = []
-    ensemble_index_list = []
-    with rivid_exception_handler("ECMWF Forecast", river_id):
-        for forecast_nc in forecast_nc_list:
-            ensemble_index_list.append(
-                int(os.path.basename(forecast_nc)[:-3].split("_")[-1])
-            )
-            qout_datasets.append(
-                xarray.open_dataset(forecast_nc, autoclose=True)
-                      .sel(rivid=river_id).Qout
-            )
-
-    merged_ds = xarray.concat(qout_datasets,
-                              pd.Index(ensemble_index_list, name='ensemble'))
-
+    time_index, ensemble_values = _ensemble_values(merged_ds)
     return_dict = {}
     if stat_type == 'high_res' or not stat_type:
         # extract the high res ensemble & time
-        try:
-            return_dict['high_res'] = merged_ds.sel(ensemble=52).dropna('time')
-        except IndexError:
-            pass
+        high_res_index = np.flatnonzero(merged_ds.ensemble.values == 52)
+        if high_res_index.size:
+            high_res_values = ensemble_values[high_res_index[0]]
+            high_res_time_steps = ~np.isnan(high_res_values)
+            return_dict['high_res'] = (time_index[high_res_time_steps],
+                                       high_res_values[high_res_time_steps])
 
     if stat_type != 'high_res' or not stat_type:
-        # analyze data to get statistic bands
-        merged_ds = merged_ds.dropna('time')
-
-        if stat_type == 'mean' or 'std' in stat_type or not stat_type:
-            return_dict['mean'] = merged_ds.mean(dim='ensemble')
-            std_ar = merged_ds.std(dim='ensemble')
-            if stat_type == 'std_dev_range_upper' or not stat_type:
-                return_dict['std_dev_range_upper'] = \
-                    return_dict['mean'] + std_ar
-            if stat_type == 'std_dev_range_lower' or not stat_type:
-                return_dict['std_dev_range_lower'] = \
-                    return_dict['mean'] - std_ar
-        if stat_type == "min" or not stat_type:
-            return_dict['min'] = merged_ds.min(dim='ensemble')
-        if stat_type == "max" or not stat_type:
-            return_dict['max'] = merged_ds.max(dim='ensemble')
+        # analyze data to get statistic bands, which are NaN
+        # at the time steps missing from any of the members
+        ensemble_statistics = compute_ensemble_statistics(ensemble_values)
+        complete_time_steps = ~np.isnan(ensemble_statistics['mean'])
+        for statistic_name, statistic_values in \
+                ensemble_statistics.items():
+            if statistic_name == stat_type or not stat_type \
+                    or (statistic_name == 'mean' and 'std' in stat_type):
+                return_dict[statistic_name] = \
+                    (time_index[complete_time_steps],
+                     statistic_values[complete_time_steps])
 
     for key in list(return_dict):
+        statistic_time_index, values = return_dict[key]
         if units == 'english':
             # convert m3/s to ft3/s
-            return_dict[key] *= M3_TO_FT3
+            values = values * M3_TO_FT3
         # convert to pandas series
-        return_dict[key] = return_dict[key].to_dataframe().Qout
+        return_dict[key] = pd.Series(values, index=statistic_time_index,
+                                     name='Qout')
+
+    return return_dict
+
+
+@timed_phase('statistics')
+def compute_forecast_probabilities(merged_ds, units, return_period_data=None,
+                                   percentiles=DEFAULT_PERCENTILES):
+    """
+    Computes the percentiles of the merged ensemble forecast and
+    the fraction of members exceeding each return period
+    at each time step
+
+    Returns
+    -------
+    OrderedDict of pandas series (percentile_<N>, exceedance_<years>)
+    """
+    import pandas as pd
+
+    time_index, ensemble_values = _ensemble_values(merged_ds)
+    complete_time_steps = _complete_time_steps(ensemble_values)
+    time_index = time_index[complete_time_steps]
+    # the boolean index copies the values of the complete time steps
+    ensemble_values = ensemble_values[:, complete_time_steps]
+    if units == 'english':
+        # convert m3/s to ft3/s
+        ensemble_values *= M3_TO_FT3
+
+    return_dict = OrderedDict()
+    percentile_values = np.percentile(ensemble_values, percentiles, axis=0)
+    for percentile, values in zip(percentiles, percentile_values):
+        return_dict['percentile_{0:g}'.format(percentile)] = \
+            pd.Series(values, index=time_index, name='Qout')
+
+    if return_period_data:
+        return_period_names = [(2, 'two'), (10, 'ten'), (20, 'twenty')]
+        thresholds = np.array([float(return_period_data[name])
+                               for _, name in return_period_names])
+        # (return period, ensemble, time) -> (return period, time)
+        exceedance_values = \
+            (ensemble_values[np.newaxis, :, :] >
+             thresholds[:, np.newaxis, np.newaxis]).mean(axis=1)
+        for (years, _), values in zip(return_period_names,
+                                      exceedance_values):
+            return_dict['exceedance_{0}'.format(years)] = \
+                pd.Series(values, index=time_index, name='Qout')
+
+    return return_dict
+
+
+def get_ecmwf_forecast_statistics(request):
+    """
+    Returns the statistics for the 52 member forecast
+    """
+    merged_ds, watershed_name, subbasin_name, river_id, units = \
+        get_ecmwf_forecast_reach_ensemble(request)
+
+    return_dict = compute_forecast_statistics(merged_ds,
+                                              request.GET.get('stat_type'),
+                                              units)
+
+    return return_dict, watershed_name, subbasin_name, river_id, units
+
+
+def get_ecmwf_forecast_probabilities(request):
+    """
+    Returns the percentiles and return period exceedance probabilities
+    for the 52 member forecast (only the percentiles if the watershed
+    has no return periods)
+    """
+    percentiles = validate_percentiles_info(request.GET)
+    merged_ds, watershed_name, subbasin_name, river_id, units = \
+        get_ecmwf_forecast_reach_ensemble(request)
+    try:
+        return_period_data = get_return_period_dict(request)
+    except NotFoundError:
+        return_period_data = None
+
+    return_dict = compute_forecast_probabilities(
+        merged_ds, units, return_period_data, percentiles)
 
     return return_dict, watershed_name, subbasin_name, river_id, units
 
 
-def get_return_period_dict(request):
+def get_return_period_dict(request, return_period_file=None, river_id=None):
     """
-    Returns return period data as dictionary for a river ID in a watershed
+    Returns return period data as dictionary for a river ID in a watershed.
+    The return period file and river ID are validated from the request
+    if not given by the controller.
     """
     units = request.GET.get('units')
-    return_period_file, river_id =\
-        validate_historical_data(request.GET,
-                                 "return_period*.nc",
-                                 "Return Period")[:2]
+    if return_period_file is None:
+        return_period_file, river_id =\
+            validate_historical_data(request.GET,
+                                     "return_period*.nc",
+                                     "Return Period")[:2]
 
     # get information from dataset
     return_period_data = {}
     with rivid_exception_handler('return period', river_id):
-        with xarray.open_dataset(return_period_file) \
-                as return_period_nc:
-            rpd = return_period_nc.sel(rivid=river_id)
-            if units == 'english':
-                rpd['max_flow'] *= M3_TO_FT3
-                rpd['return_period_20'] *= M3_TO_FT3
-                rpd['return_period_10'] *= M3_TO_FT3
-                rpd['return_period_2'] *= M3_TO_FT3
-
-            return_period_data["max"] = str(rpd.max_flow.values)
-            return_period_data["twenty"] = str(rpd.return_period_20.values)
-            return_period_data["ten"] = str(rpd.return_period_10.values)
-            return_period_data["two"] = str(rpd.return_period_2.values)
+        rpd = read_return_periods(return_period_file, river_id, units)
+
+    return_period_data["max"] = str(rpd.max_flow.values)
+    return_period_data["twenty"] = str(rpd.return_period_20.values)
+    return_period_data["ten"] = str(rpd.return_period_10.values)
+    return_period_data["two"] = str(rpd.return_period_2.values)
 
     return return_period_data
 
 
 def get_return_period_ploty_info(request, datetime_start, datetime_end,
-                                 band_alt_max=-9999):
+                                 band_alt_max=-9999, return_period_data=None):
     """
     Get shapes and annotations for plotly plot
     """
     # Return Period Section
-    return_period_data = get_return_period_dict(request)
+    if return_period_data is None:
+        return_period_data = get_return_period_dict(request)
     return_max = float(return_period_data["max"])
     return_20 = float(return_period_data["twenty"])
     return_10 = float(return_period_data["ten"])
@@ -269,28 +373,28 @@ def get_return_period_ploty_info(request, datetime_start, datetime_end,
     return shapes, annotations
 
 
-def get_historic_streamflow_series(request):
+def get_historic_streamflow_series(request, historical_data_file=None,
+                                   river_id=None):
     """
-    Retireve Pandas series object based on request for ERA Interim data
+    Retireve Pandas series object based on request for ERA Interim data.
+    The historical file and river ID are validated from the request
+    if not given by the controller.
     """
     # get information from GET request
-    daily = request.GET.get('daily') if 'daily' in request.GET else ''
     units = request.GET.get('units')
-    historical_data_file, river_id =\
-        validate_historical_data(request.GET)[:2]
+    start_datetime, end_datetime, resolution = \
+        validate_time_window_info(request.GET)
+    if historical_data_file is None:
+        historical_data_file, river_id =\
+            validate_historical_data(request.GET)[:2]
 
-    # write data to csv stream
     with rivid_exception_handler('ERA Interim', river_id):
-        with xarray.open_dataset(historical_data_file) as qout_nc:
-            qout_data = qout_nc.sel(rivid=river_id).Qout\
-                               .to_dataframe().Qout
-            if daily.lower() == 'true':
-                # calculate daily values
-                qout_data = qout_data.resample('D').mean()
-
-            if units == 'english':
-                # convert from m3/s to ft3/s
-                qout_data *= M3_TO_FT3
+        qout_data = read_historical_series(historical_data_file,
+                                           river_id,
+                                           start_datetime,
+                                           end_datetime,
+                                           resolution,
+                                           units)
     return qout_data
 
 
@@ -7,12 +7,19 @@
     Author: Alan D. Snow, 2017
     License: BSD 3-Clause
 """
+import datetime
 from glob import glob
 import os
 
 from .app import StreamflowPredictionTool as app
 from .exception_handling import InvalidData, NotFoundError, SettingsError
-from .functions import format_name
+from .functions import (ecmwf_find_most_current_files, format_name,
+                        DEFAULT_PERCENTILES)
+from .performance import timed_phase
+from .warning_points import get_most_recent_forecast_folder
+
+# return periods of the warning points of a forecast
+WARNING_RETURN_PERIODS = (2, 10, 20)
 
 
 def validate_watershed_info(request_info, clean_name=True):
@@ -59,6 +66,132 @@ def validate_rivid_info(request_info):
     return reach_id
 
 
+def validate_rivid_list_info(request_info):
+    """
+    This function validates the input rivid data for a request
+    with one or many comma separated reach IDs
+
+    Returns
+    -------
+    list of rivids
+    """
+    reach_ids = request_info.get('reach_id')
+    if not reach_ids:
+        raise InvalidData('Missing reach_id parameter ....')
+
+    # make sure reach ids are integers
+    try:
+        reach_ids = [int(reach_id) for reach_id in reach_ids.split(",")]
+    except (TypeError, ValueError):
+        raise InvalidData('Invalid value for reach_id {}.'.format(reach_ids))
+
+    return reach_ids
+
+
+def validate_percentiles_info(request_info, default=DEFAULT_PERCENTILES):
+    """
+    This function validates the comma separated percentiles of a request
+
+    Returns
+    -------
+    list of percentiles
+    """
+    percentiles = request_info.get('percentiles')
+    if not percentiles:
+        return list(default)
+
+    try:
+        percentiles = [float(percentile)
+                       for percentile in percentiles.split(",")]
+    except (TypeError, ValueError):
+        raise InvalidData('Invalid value for percentiles {}.'
+                          .format(percentiles))
+
+    for percentile in percentiles:
+        if not 0 <= percentile <= 100:
+            raise InvalidData('Percentiles must be between 0 and 100.')
+
+    return percentiles
+
+
+def validate_time_window_info(request_info):
+    """
+    This function validates the start_date, end_date (YYYY-MM-DD)
+    and resolution of a request for a time series.
+    The end date is inclusive, so the returned end datetime is
+    the beginning of the following day.
+
+    Returns
+    -------
+    start_datetime, end_datetime, resolution
+    """
+    date_time_window = []
+    for date_parameter in ('start_date', 'end_date'):
+        date_string = request_info.get(date_parameter)
+        if not date_string:
+            date_time_window.append(None)
+            continue
+        try:
+            date_time_window.append(
+                datetime.datetime.strptime(date_string.strip(), "%Y-%m-%d"))
+        except ValueError:
+            raise InvalidData('Invalid value for {0} {1}. '
+                              'Must be YYYY-MM-DD.'
+                              .format(date_parameter, date_string))
+
+    start_datetime, end_datetime = date_time_window
+    if end_datetime is not None:
+        end_datetime += datetime.timedelta(days=1)
+    if start_datetime is not None and end_datetime is not None \
+            and start_datetime >= end_datetime:
+        raise InvalidData('The start_date must be before the end_date.')
+
+    resolution = request_info.get('resolution')
+    if not resolution and \
+            str(request_info.get('daily', '')).lower() == 'true':
+        resolution = 'daily'
+    if resolution and resolution not in ('daily', 'monthly'):
+        raise InvalidData('Invalid value for resolution {}.'
+                          .format(resolution))
+
+    return start_datetime, end_datetime, resolution
+
+
+@timed_phase('validation')
+def validate_ecmwf_forecast_data(request_info):
+    """
+    This function validates the request for ECMWF forecast data
+
+    Returns
+    -------
+    forecast_nc_list, watershed_name, subbasin_name
+    """
+    path_to_rapid_output = app.get_custom_setting('ecmwf_forecast_folder')
+    if not os.path.exists(path_to_rapid_output):
+        raise SettingsError('Location of ECMWF forecast files faulty. '
+                            'Please check settings.')
+
+    # get information from request
+    watershed_name, subbasin_name = validate_watershed_info(request_info)
+
+    forecast_folder = request_info.get('forecast_folder')
+    if not forecast_folder:
+        forecast_folder = 'most_recent'
+
+    # find/check current output datasets
+    path_to_output_files = \
+        os.path.join(path_to_rapid_output,
+                     "{0}-{1}".format(watershed_name, subbasin_name))
+    forecast_nc_list, start_date = \
+        ecmwf_find_most_current_files(path_to_output_files, forecast_folder)
+    if not forecast_nc_list or not start_date:
+        raise NotFoundError('ECMWF forecast for %s (%s).'
+                            % (watershed_name, subbasin_name))
+
+    return forecast_nc_list, watershed_name, subbasin_name
+
+
+@timed_phase('validation')
 def validate_historical_data(request_info, file_search_card="Qout*.nc",
                              dataset_name="ERA Interim"):
     """
@@ -81,8 +214,9 @@ def validate_historical_data(request_info, file_search_card="Qout*.nc",
     path_to_output_files = \
         os.path.join(path_to_era_interim_data,
                      "{0}-{1}".format(watershed_name, subbasin_name))
-    historical_data_files = glob(os.path.join(path_to_output_files,
-                                              file_search_card))
+    with timed_phase('file_discovery'):
+        historical_data_files = glob(os.path.join(path_to_output_files,
+                                                  file_search_card))
     if not historical_data_files:
         raise NotFoundError('{dataset_name} data for {watershed_name} '
                             '({subbasin_name}).'
@@ -91,3 +225,196 @@ def validate_historical_data(request_info, file_search_card="Qout*.nc",
                                     subbasin_name=subbasin_name))
 
     return historical_data_files[0], river_id, watershed_name, subbasin_name
+
+
+@timed_phase('validation')
+def validate_warning_points_info(request_info):
+    """
+    This function validates the request for the warning points
+    of a forecast
+
+    Returns
+    -------
+    warning_points_file
+    """
+    path_to_ecmwf_rapid_output = \
+        app.get_custom_setting('ecmwf_forecast_folder')
+    path_to_era_interim_data = app.get_custom_setting('historical_folder')
+    if not os.path.exists(path_to_ecmwf_rapid_output) \
+            or not os.path.exists(path_to_era_interim_data):
+        raise SettingsError('Location of ECMWF forecast and historical files '
+                            'faulty. Please check settings.')
+
+    # get information from request
+    watershed_name, subbasin_name = validate_watershed_info(request_info)
+    return_period = request_info.get('return_period')
+    forecast_folder = request_info.get('forecast_folder')
+    if not return_period:
+        raise InvalidData('Missing return_period parameter ...')
+
+    try:
+        return_period = int(return_period)
+    except (TypeError, ValueError):
+        raise InvalidData('Invalid return period.')
+
+    if return_period not in WARNING_RETURN_PERIODS:
+        raise InvalidData('Invalid return period.')
+
+    path_to_output_files = \
+        os.path.join(path_to_ecmwf_rapid_output,
+                     "{0}-{1}".format(watershed_name, subbasin_name))
+
+    # attempt to find forecast folder for watershed
+    if not forecast_folder:
+        if not os.path.exists(path_to_output_files):
+            raise NotFoundError('No forecasts found ...')
+
+        with timed_phase('file_discovery'):
+            forecast_folder = \
+                get_most_recent_forecast_folder(path_to_output_files)
+
+    if not forecast_folder:
+        raise NotFoundError('No forecasts found with {0} return period '
+                            'warning points.'.format(return_period))
+
+    # get warning points to load in
+    warning_points_file = \
+        os.path.join(path_to_output_files, forecast_folder,
+                     "return_{0}_points.geojson".format(return_period))
+    if not os.path.exists(warning_points_file):
+        raise NotFoundError('Warning points file.')
+
+    return warning_points_file
+
+
+def validate_bbox_info(request_info):
+    """
+    This function validates the bounding box (min_lon,min_lat,max_lon,
+    max_lat in degrees) and map zoom level of a request
+
+    Returns
+    -------
+    bbox, zoom (None if not in the request)
+    """
+    bbox = request_info.get('bbox')
+    if not bbox:
+        raise InvalidData('Missing bbox parameter ....')
+
+    try:
+        bbox = tuple(float(coordinate) for coordinate in bbox.split(","))
+    except (TypeError, ValueError):
+        raise InvalidData('Invalid value for bbox {}.'.format(bbox))
+
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise InvalidData('The bbox must be min_lon,min_lat,max_lon,max_lat.')
+
+    zoom = request_info.get('zoom')
+    if zoom is not None and zoom != "":
+        try:
+            zoom = int(float(zoom))
+        except (TypeError, ValueError):
+            raise InvalidData('Invalid value for zoom {}.'.format(zoom))
+    else:
+        zoom = None
+
+    return bbox, zoom
+
+
+def validate_tile_info(request_info):
+    """
+    This function validates the watershed ID and XYZ tile (z, x, y)
+    of a drainage line tile request
+
+    Returns
+    -------
+    watershed_id, zoom, tile_x, tile_y
+    """
+    tile_info = []
+    for parameter_name in ('watershed_id', 'z', 'x', 'y'):
+        parameter_value = request_info.get(parameter_name)
+        if not parameter_value:
+            raise InvalidData('Missing {0} parameter ....'
+                              .format(parameter_name))
+        try:
+            tile_info.append(int(parameter_value))
+        except (TypeError, ValueError):
+            raise InvalidData('Invalid value for {0} {1}.'
+                              .format(parameter_name, parameter_value))
+
+    watershed_id, zoom, tile_x, tile_y = tile_info
+    if not 0 <= zoom <= 30 or not 0 <= tile_x < 2 ** zoom \
+            or not 0 <= tile_y < 2 ** zoom:
+        raise InvalidData('Invalid tile {0}/{1}/{2}.'
+                          .format(zoom, tile_x, tile_y))
+    return watershed_id, zoom, tile_x, tile_y
+
+
+def validate_reach_info(request_info):
+    """
+    This function validates the watershed ID and reach ID of a reach
+    lookup request
+
+    Returns
+    -------
+    watershed_id, reach_id
+    """
+    watershed_id = request_info.get('watershed_id')
+    if not watershed_id:
+        raise InvalidData('Missing watershed_id parameter ....')
+    try:
+        watershed_id = int(watershed_id)
+    except (TypeError, ValueError):
+        raise InvalidData('Invalid value for watershed_id {0}.'
+                          .format(watershed_id))
+
+    return watershed_id, validate_rivid_info(request_info)
+
+
+def validate_watershed_list_info(request_info):
+    """
+    This function validates the watershed_name and subbasin_name pairs
+    of a request for several watersheds (repeated parameters)
+
+    Returns
+    -------
+    list of (watershed_name, subbasin_name)
+    """
+    watershed_names = request_info.getlist('watershed_name')
+    subbasin_names = request_info.getlist('subbasin_name')
+    if not watershed_names:
+        raise InvalidData('Missing watershed_name parameter ....')
+    if len(watershed_names) != len(subbasin_names):
+        raise InvalidData('A subbasin_name is required for each '
+                          'watershed_name.')
+
+    return [(watershed_name.strip(), subbasin_name.strip())
+            for watershed_name, subbasin_name
+            in zip(watershed_names, subbasin_names)]
+
+
+def validate_return_periods_info(request_info):
+    """
+    This function validates the comma separated return periods
+    of a request for warning points
+
+    Returns
+    -------
+    list of return periods (all if not in the request)
+    """
+    return_periods = request_info.get('return_period')
+    if not return_periods:
+        return list(WARNING_RETURN_PERIODS)
+
+    try:
+        return_periods = [int(return_period)
+                          for return_period in return_periods.split(",")]
+    except (TypeError, ValueError):
+        raise InvalidData('Invalid value for return_period {}.'
+                          .format(return_periods))
+
+    for return_period in return_periods:
+        if return_period not in WARNING_RETURN_PERIODS:
+            raise InvalidData('Invalid return period {}.'
+                              .format(return_period))
+
+    return return_periods
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""data_access.py
+
+    This module reads the forecast, historical, return period,
+    seasonal average and warning point datasets of a watershed.
+
+    All readers take a river_id that is either one river ID (the rivid
+    dimension is dropped), a list of river IDs (the rivid dimension
+    is kept in the order given) or None for the whole watershed.
+    A river ID that is not in the dataset raises a KeyError.
+
+    License: BSD 3-Clause
+"""
+from copy import deepcopy
+from functools import partial, reduce, wraps
+from hashlib import md5
+from json import load as json_load
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+
+import numpy as np
+
+from .exception_handling import NotFoundError
+from .functions import M3_TO_FT3
+from .historical_aggregates import get_historical_aggregate_file
+from .performance import timed_phase
+
+# number of threads reading ensemble members concurrently
+READ_THREADS = 8
+# first bytes of the classic and 64-bit offset NetCDF formats
+CLASSIC_NETCDF_MAGIC = (b'CDF\x01', b'CDF\x02')
+# variable attributes that need the standard reader to decode
+ENCODING_ATTRIBUTES = ('scale_factor', 'add_offset')
+# variable attributes with values masked as NaN
+FILL_ATTRIBUTES = ('_FillValue', 'missing_value')
+# CF time units supported by the memory-mapped reader
+CF_TIME_UNITS = {'seconds': 's', 'minutes': 'm',
+                 'hours': 'h', 'days': 'D'}
+
+# cache used by the readers (see set_data_cache)
+_DATA_CACHE = {'cache': None}
+# thread pool shared by the requests (see set_read_threads)
+_READ_POOL = {'pool': None, 'num_threads': READ_THREADS}
+_READ_POOL_LOCK = threading.Lock()
+# memory-mapped reads of classic files (see set_mmap_reads)
+_MMAP_READS = {'enabled': True}
+
+
+def set_data_cache(cache):
+    """
+    Sets the cache used by the readers. The cache needs a get(key) and a
+    set(key, value) method (e.g. a Django cache). Cached data is keyed on
+    the file modification time, so updated files are read again.
+    Set to None to disable caching.
+    """
+    _DATA_CACHE['cache'] = cache
+
+
+def set_read_threads(num_threads):
+    """
+    Sets the number of threads shared by the requests to read
+    the files of a dataset concurrently. Set to 1 to read the files
+    one after another.
+    """
+    with _READ_POOL_LOCK:
+        if _READ_POOL['pool'] is not None:
+            # reads already queued on the old pool still finish
+            _READ_POOL['pool'].close()
+        _READ_POOL['pool'] = None
+        _READ_POOL['num_threads'] = max(int(num_threads), 1)
+
+
+def set_mmap_reads(enabled):
+    """
+    Enables or disables memory-mapped reads of the classic
+    (uncompressed) NetCDF Qout files. When disabled or for other
+    formats, the files are read with xarray.
+    """
+    _MMAP_READS['enabled'] = bool(enabled)
+
+
+def _read_map(read_function, data_files):
+    """
+    Applies the read function to each data file using the shared
+    thread pool and returns the results in the order of the files
+    """
+    with _READ_POOL_LOCK:
+        read_pool = _READ_POOL['pool']
+        if read_pool is None and _READ_POOL['num_threads'] > 1:
+            read_pool = _READ_POOL['pool'] = \
+                ThreadPool(_READ_POOL['num_threads'])
+    if read_pool is None or len(data_files) < 2:
+        return [read_function(data_file) for data_file in data_files]
+    return read_pool.map(read_function, data_files)
+
+
+def _cache_key(reader_name, data_files, args):
+    """
+    Generates a cache key for the read of the data files
+    """
+    file_info = [(data_file, os.path.getmtime(data_file))
+                 for data_file in data_files]
+    return 'spt:{0}:{1}'.format(
+        reader_name,
+        md5(repr((file_info, args)).encode('utf-8')).hexdigest())
+
+
+def _cached_read(reader):
+    """
+    Decorator that reads the data through the cache if one is set.
+    The first argument of the reader is a data file or a list of them.
+    """
+    @wraps(reader)
+    def inner(data_files, *args):
+        """
+        Return a copy of the cached data or read and cache it
+        """
+        cache = _DATA_CACHE['cache']
+        if cache is None:
+            return reader(data_files, *args)
+
+        cache_key = _cache_key(
+            reader.__name__,
+            data_files if isinstance(data_files, (list, tuple))
+            else [data_files],
+            tuple(tuple(arg) if isinstance(arg, list) else arg
+                  for arg in args))
+        data = cache.get(cache_key)
+        if data is None:
+            data = reader(data_files, *args)
+            cache.set(cache_key, data)
+        # callers may modify the data in place
+        return deepcopy(data)
+    return inner
+
+
+def _to_units(data, units):
+    """
+    Converts streamflow from m3/s to the requested units
+    """
+    if units == 'english':
+        # convert m3/s to ft3/s
+        data *= M3_TO_FT3
+    return data
+
+
+def _rivid_indexer(rivid_index, river_id):
+    """
+    Returns the positional index of the river ID(s) in the rivid index
+    """
+    if river_id is None:
+        return slice(None)
+    if np.ndim(river_id) == 0:
+        return rivid_index.get_loc(river_id)
+    rivid_positions = rivid_index.get_indexer(river_id)
+    if (rivid_positions < 0).any():
+        raise KeyError(np.asarray(river_id)[rivid_positions < 0].tolist())
+    return rivid_positions
+
+
+def _read_rivids(data_var, rivid_positions, **indexers):
+    """
+    Reads the river reaches from the variable in file order so that
+    multi-reach reads are batched, then restores the requested order
+    """
+    if isinstance(rivid_positions, np.ndarray) and rivid_positions.size > 1:
+        file_order = np.argsort(rivid_positions)
+        data = data_var.isel(rivid=rivid_positions[file_order],
+                             **indexers).load()
+        return data.isel(rivid=np.argsort(file_order))
+    return data_var.isel(rivid=rivid_positions, **indexers).load()
+
+
+def get_time_index_slice(time_values, start_datetime, end_datetime):
+    """
+    Resolves a time window to an index slice against the time values
+    so that only the data inside of the window is read from the file
+    """
+    start_index = 0
+    end_index = time_values.size
+    if start_datetime is not None:
+        start_index = np.searchsorted(time_values,
+                                      np.datetime64(start_datetime),
+                                      side='left')
+    if end_datetime is not None:
+        end_index = np.searchsorted(time_values,
+                                    np.datetime64(end_datetime),
+                                    side='left')
+    if start_index >= end_index:
+        raise NotFoundError('Historical data between {0} and {1}.'
+                            .format(start_datetime, end_datetime))
+    return slice(int(start_index), int(end_index))
+
+
+def get_ensemble_number(forecast_nc):
+    """
+    Returns the ensemble number from the name of an ECMWF forecast file
+    """
+    return int(os.path.basename(forecast_nc)[:-3].split("_")[-1])
+
+
+def _native(values):
+    """
+    Returns a copy of the array in the native byte order
+    """
+    return values.astype(values.dtype.newbyteorder('='))
+
+
+def _is_classic_netcdf(data_file):
+    """
+    Checks if the file is in the classic (uncompressed) NetCDF format
+    """
+    with open(data_file, 'rb') as infile:
+        return infile.read(4) in CLASSIC_NETCDF_MAGIC
+
+
+def _is_plain_qout(qout_nc):
+    """
+    Checks if the Qout variable of the memory-mapped file can be used
+    as stored (floating point values that are not packed)
+    """
+    qout_var = qout_nc.variables.get('Qout')
+    return qout_var is not None \
+        and 'rivid' in qout_nc.variables \
+        and 'time' in qout_nc.variables \
+        and sorted(qout_var.dimensions) == ['rivid', 'time'] \
+        and qout_var.data.dtype.kind == 'f' \
+        and not any(hasattr(qout_var, attribute)
+                    for attribute in ENCODING_ATTRIBUTES)
+
+
+def _mask_fill_values(qout_values, qout_var):
+    """
+    Replaces the fill values of the variable with NaN in place
+    """
+    for attribute in FILL_ATTRIBUTES:
+        fill_value = getattr(qout_var, attribute, None)
+        if fill_value is not None and not np.isnan(fill_value):
+            qout_values[qout_values == fill_value] = np.nan
+    return qout_values
+
+
+def _decode_time(time_var):
+    """
+    Decodes the CF time variable of the memory-mapped file to
+    datetime64 values. Returns None for unsupported units or calendars.
+    """
+    import pandas as pd
+
+    def attribute(name):
+        """Return the attribute of the time variable as text"""
+        value = getattr(time_var, name, None)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    if attribute('calendar') not in (None, 'standard', 'gregorian',
+                                     'proleptic_gregorian'):
+        return None
+    try:
+        time_unit, reference_date = attribute('units').split(' since ')
+        reference_date = pd.Timestamp(reference_date)
+        if reference_date.tzinfo is not None:
+            reference_date = reference_date.tz_convert(None)
+        return (reference_date +
+                pd.to_timedelta(_native(time_var.data),
+                                unit=CF_TIME_UNITS[time_unit.strip()])).values
+    except (AttributeError, KeyError, ValueError):
+        return None
+
+
+def _read_classic_qout(data_file, river_id, start_datetime=None,
+                       end_datetime=None):
+    """
+    Reads the river reaches from a classic NetCDF Qout file by
+    memory-mapping it so that only the requested values are read
+    and copied. Returns None if the file needs the standard reader.
+    """
+    import pandas as pd
+    import xarray
+    from scipy.io import netcdf_file
+
+    if not _MMAP_READS['enabled'] or not _is_classic_netcdf(data_file):
+        return None
+
+    qout_nc = netcdf_file(data_file, mmap=True)
+    try:
+        # the variables are not kept in local names so that the
+        # memory map can be closed if the river ID is not found
+        if not _is_plain_qout(qout_nc):
+            return None
+        time_values = _decode_time(qout_nc.variables['time'])
+        if time_values is None:
+            return None
+        rivid_values = _native(qout_nc.variables['rivid'].data)
+        indexers = {
+            'rivid': _rivid_indexer(pd.Index(rivid_values), river_id),
+            'time': get_time_index_slice(time_values, start_datetime,
+                                         end_datetime),
+        }
+        qout_dims = qout_nc.variables['Qout'].dimensions
+        keep_rivid = not isinstance(indexers['rivid'], (int, np.integer))
+        return xarray.DataArray(
+            _mask_fill_values(
+                _native(qout_nc.variables['Qout'].data[
+                    tuple(indexers[dim] for dim in qout_dims)]),
+                qout_nc.variables['Qout']),
+            dims=[dim for dim in qout_dims if dim == 'time' or keep_rivid],
+            coords={'time': time_values[indexers['time']],
+                    'rivid': rivid_values[indexers['rivid']]},
+            name='Qout')
+    finally:
+        qout_nc.close()
+
+
+def _read_forecast_member(river_id, forecast_nc):
+    """
+    Reads the river reaches of an ensemble member of the forecast
+    """
+    import xarray
+
+    qout_data = _read_classic_qout(forecast_nc, river_id)
+    if qout_data is not None:
+        return qout_data
+
+    with xarray.open_dataset(forecast_nc) as qout_nc:
+        return _read_rivids(qout_nc.Qout,
+                            _rivid_indexer(qout_nc.indexes['rivid'],
+                                           river_id))
+
+
+@_cached_read
+def _read_forecast_ensemble(forecast_nc_list, river_id):
+    """
+    Reads the ensemble members of the forecast concurrently and copies
+    them into one float32 array over the union of the member time steps.
+    Time steps missing from a member are NaN.
+    """
+    import xarray
+
+    forecast_nc_list = sorted(forecast_nc_list, key=get_ensemble_number)
+    member_arrays = _read_map(partial(_read_forecast_member, river_id),
+                              forecast_nc_list)
+
+    time_values = reduce(np.union1d, [member_array.time.values
+                                      for member_array in member_arrays])
+    rivid_dims = [dim for dim in member_arrays[0].dims if dim != 'time']
+    rivid_values = member_arrays[0].rivid.values
+    ensemble_values = np.full(
+        [len(member_arrays), time_values.size] +
+        [member_arrays[0].sizes[dim] for dim in rivid_dims],
+        np.nan, dtype=np.float32)
+    for member_index, member_array in enumerate(member_arrays):
+        ensemble_values[member_index,
+                        np.searchsorted(time_values,
+                                        member_array.time.values)] = \
+            member_array.transpose('time', *rivid_dims).values
+        # release each member once copied
+        member_arrays[member_index] = None
+
+    return xarray.DataArray(
+        ensemble_values,
+        dims=['ensemble', 'time'] + rivid_dims,
+        coords={'ensemble': [get_ensemble_number(forecast_nc)
+                             for forecast_nc in forecast_nc_list],
+                'time': time_values,
+                'rivid': rivid_values},
+        name='Qout')
+
+
+@timed_phase('read')
+def read_forecast_ensemble(forecast_nc_list, river_id=None, units=None):
+    """
+    Reads the ECMWF forecast ensemble members
+
+    Returns
+    -------
+    float32 xarray.DataArray with dimensions (ensemble, time[, rivid])
+    ordered by ensemble number
+    """
+    return _to_units(_read_forecast_ensemble(forecast_nc_list, river_id),
+                     units)
+
+
+@_cached_read
+def _read_historical_series(historical_data_file, river_id, start_datetime,
+                            end_datetime, resolution):
+    """
+    Reads the historical streamflow using the precomputed
+    daily/monthly file if available
+    """
+    import xarray
+
+    aggregate_data_file = \
+        get_historical_aggregate_file(historical_data_file, resolution)
+    if aggregate_data_file:
+        historical_data_file = aggregate_data_file
+
+    qout_data = _read_classic_qout(historical_data_file, river_id,
+                                   start_datetime, end_datetime)
+    if qout_data is None:
+        with xarray.open_dataset(historical_data_file) as qout_nc:
+            qout_data = _read_rivids(
+                qout_nc.Qout,
+                _rivid_indexer(qout_nc.indexes['rivid'], river_id),
+                time=get_time_index_slice(qout_nc.time.values,
+                                          start_datetime, end_datetime)
+            )
+
+    if 'rivid' in qout_data.dims:
+        qout_data = qout_data.transpose('time', 'rivid').to_pandas()
+    else:
+        qout_data = qout_data.to_series()
+
+    if resolution == 'daily' and not aggregate_data_file:
+        # calculate daily values
+        qout_data = qout_data.resample('D').mean()
+    elif resolution == 'monthly' and not aggregate_data_file:
+        # calculate monthly values
+        qout_data = qout_data.resample('MS').mean()
+    return qout_data
+
+
+@timed_phase('read')
+def read_historical_series(historical_data_file, river_id=None,
+                           start_datetime=None, end_datetime=None,
+                           resolution=None, units=None):
+    """
+    Reads the historical streamflow inside of the time window
+    at the resolution ('daily', 'monthly' or None for all time steps)
+
+    Returns
+    -------
+    pandas.Series for one river ID or
+    pandas.DataFrame with a column per river ID indexed by time
+    """
+    return _to_units(_read_historical_series(historical_data_file, river_id,
+                                             start_datetime, end_datetime,
+                                             resolution),
+                     units)
+
+
+@_cached_read
+def _read_rivid_dataset(data_file, river_id, variables):
+    """
+    Reads the variables of a dataset with a rivid dimension
+    """
+    import xarray
+
+    with xarray.open_dataset(data_file) as data_nc:
+        rivid_positions = _rivid_indexer(data_nc.indexes['rivid'],
+                                         river_id)
+        return xarray.Dataset({
+            variable: _read_rivids(data_nc[variable], rivid_positions)
+            for variable in variables
+        })
+
+
+@timed_phase('read')
+def read_return_periods(return_period_file, river_id=None, units=None):
+    """
+    Reads the return period flows
+
+    Returns
+    -------
+    xarray.Dataset with max_flow, return_period_20, return_period_10
+    and return_period_2
+    """
+    return_period_ds = _read_rivid_dataset(return_period_file, river_id,
+                                           ('max_flow', 'return_period_20',
+                                            'return_period_10',
+                                            'return_period_2'))
+    for variable in return_period_ds.data_vars:
+        return_period_ds[variable] = \
+            _to_units(return_period_ds[variable], units)
+    return return_period_ds
+
+
+@timed_phase('read')
+def read_seasonal_averages(seasonal_data_file, river_id=None, units=None):
+    """
+    Reads the daily seasonal average flows
+
+    Returns
+    -------
+    xarray.Dataset with average_flow and std_dev_flow
+    with the day_of_year dimension
+    """
+    seasonal_ds = _read_rivid_dataset(seasonal_data_file, river_id,
+                                      ('average_flow', 'std_dev_flow'))
+    for variable in seasonal_ds.data_vars:
+        seasonal_ds[variable] = _to_units(seasonal_ds[variable], units)
+    return seasonal_ds
+
+
+@timed_phase('read')
+@_cached_read
+def read_warning_points(warning_points_file):
+    """
+    Reads the warning points of a forecast as a GeoJSON dictionary
+    """
+    with open(warning_points_file, 'rb') as infile:
+        return json_load(infile)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""dataset_managers.py
+
+    This module keeps one dataset manager (client) per GeoServer and
+    data store so that the operations of the app reuse it instead of
+    connecting again each time (e.g. creating a GeoServer manager checks
+    the app workspace on GeoServer). A manager is replaced when the
+    credentials of its GeoServer or data store change.
+
+    The GeoServer managers keep a requests session and a catalog cache,
+    which are not shared between threads, so each thread has its own.
+
+    License: BSD 3-Clause
+"""
+from contextlib import contextmanager
+import threading
+
+from .app import StreamflowPredictionTool as app
+
+# (type, database ID, model name) -> (credentials, manager, lock)
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+# GeoServer ID -> number of times its managers were invalidated
+_GEOSERVER_VERSIONS = {}
+# geoserver_managers: GeoServer ID -> (credentials, version, manager)
+_THREAD_MANAGERS = threading.local()
+
+
+def _get_manager(manager_key, credentials, create_manager):
+    """
+    Returns the registered manager with its lock. A new manager is
+    created if there is none or it was created with other credentials.
+    """
+    with _MANAGERS_LOCK:
+        registered_manager = _MANAGERS.get(manager_key)
+    if registered_manager is not None \
+            and registered_manager[0] == credentials:
+        return registered_manager[1:]
+
+    # connect outside of the lock as it can take a while
+    registered_manager = (credentials, create_manager(), threading.Lock())
+    with _MANAGERS_LOCK:
+        _MANAGERS[manager_key] = registered_manager
+    return registered_manager[1:]
+
+
+def _invalidate_managers(manager_types, row_id):
+    """
+    Removes the registered managers of the database row
+    """
+    with _MANAGERS_LOCK:
+        for manager_key in list(_MANAGERS):
+            if manager_key[0] in manager_types and manager_key[1] == row_id:
+                del _MANAGERS[manager_key]
+
+
+def get_geoserver_connection(geoserver):
+    """
+    Returns the ID and credentials of the GeoServer as plain values,
+    so that a thread without the database session can connect to it
+    with connect_geoserver
+    """
+    return geoserver.id, (geoserver.url, geoserver.username,
+                          geoserver.password,
+                          app.get_custom_setting('app_instance_id'))
+
+
+def connect_geoserver(geoserver_connection):
+    """
+    Returns the manager of the GeoServer (get_geoserver_connection)
+    registered for the current thread
+    """
+    from spt_dataset_manager.dataset_manager import \
+        GeoServerDatasetManager
+
+    geoserver_id, credentials = geoserver_connection
+    thread_managers = getattr(_THREAD_MANAGERS, 'geoserver_managers', None)
+    if thread_managers is None:
+        thread_managers = _THREAD_MANAGERS.geoserver_managers = {}
+    with _MANAGERS_LOCK:
+        version = _GEOSERVER_VERSIONS.get(geoserver_id, 0)
+    registered_manager = thread_managers.get(geoserver_id)
+    if registered_manager is not None \
+            and registered_manager[:2] == (credentials, version):
+        return registered_manager[2]
+
+    url, username, password, app_instance_id = credentials
+    geoserver_manager = \
+        GeoServerDatasetManager(engine_url=url,
+                                username=username,
+                                password=password,
+                                app_instance_id=app_instance_id)
+    thread_managers[geoserver_id] = (credentials, version, geoserver_manager)
+    return geoserver_manager
+
+
+def get_geoserver_manager(geoserver):
+    """
+    Returns the manager of the GeoServer registered for the current
+    thread
+    """
+    return connect_geoserver(get_geoserver_connection(geoserver))
+
+
+def _create_data_store_manager(manager_type, credentials):
+    """
+    Creates a manager of the data store
+    """
+    from spt_dataset_manager.dataset_manager import \
+        CKANDatasetManager, ECMWFRAPIDDatasetManager, \
+        RAPIDInputDatasetManager
+
+    api_endpoint, api_key, owner_org, model_name, app_instance_id = \
+        credentials
+    if manager_type == 'ckan':
+        return CKANDatasetManager(api_endpoint, api_key, model_name)
+    elif manager_type == 'ecmwf_rapid':
+        return ECMWFRAPIDDatasetManager(api_endpoint, api_key)
+    elif manager_type == 'rapid_input':
+        return RAPIDInputDatasetManager(api_endpoint, api_key, model_name,
+                                        app_instance_id, owner_org)
+    raise ValueError("Invalid data store manager type: {0}"
+                     .format(manager_type))
+
+
+@contextmanager
+def data_store_manager(data_store, manager_type, model_name="ecmwf"):
+    """
+    Yields the registered manager of the data store::
+
+        with data_store_manager(data_store, 'rapid_input') as data_manager:
+            data_manager.upload_model_resource(...)
+
+    The CKAN managers keep the dataset of the current operation,
+    so a manager is used by one thread at a time.
+
+    Parameters
+    ----------
+    data_store: DataStore
+        The data store to connect to.
+    manager_type: str
+        'ckan', 'ecmwf_rapid' (forecasts) or 'rapid_input'.
+    model_name: str, optional
+        Name of the model of the datasets.
+    """
+    app_instance_id = app.get_custom_setting('app_instance_id') \
+        if manager_type == 'rapid_input' else None
+    credentials = (data_store.api_endpoint, data_store.api_key,
+                   data_store.owner_org, model_name, app_instance_id)
+    data_manager, manager_lock = _get_manager(
+        (manager_type, data_store.id, model_name), credentials,
+        lambda: _create_data_store_manager(manager_type, credentials))
+    with manager_lock:
+        yield data_manager
+
+
+def invalidate_geoserver_managers(geoserver_id):
+    """
+    Removes the registered managers of the GeoServer in all threads
+    (e.g. when it is updated or deleted)
+    """
+    geoserver_id = int(geoserver_id)
+    with _MANAGERS_LOCK:
+        _GEOSERVER_VERSIONS[geoserver_id] = \
+            _GEOSERVER_VERSIONS.get(geoserver_id, 0) + 1
+    thread_managers = getattr(_THREAD_MANAGERS, 'geoserver_managers', {})
+    thread_managers.pop(geoserver_id, None)
+
+
+def invalidate_data_store_managers(data_store_id):
+    """
+    Removes the registered managers of the data store
+    (e.g. when it is updated or deleted)
+    """
+    _invalidate_managers(('ckan', 'ecmwf_rapid', 'rapid_input'),
+                         int(data_store_id))
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""drainage_line_tiles.py
+
+    This module builds simplified GeoJSON tiles of the drainage line
+    of a watershed from its shapefile and reads them for the map, so
+    that GeoServer is not requested on every pan and zoom. The tiles
+    follow the XYZ (web mercator) tiling of the map and are written to
+    the drainage_line_tiles folder of the app workspace when the
+    drainage line shapefile is uploaded if the enable_drainage_line_tiles
+    app setting is on.
+
+    Building the tiles needs pyshp, and pyproj if the shapefile is not
+    in longitude/latitude.
+
+    License: BSD 3-Clause
+"""
+from collections import defaultdict
+import datetime
+from json import dumps as json_dumps
+import math
+import os
+from shutil import rmtree
+from uuid import uuid4
+
+import numpy as np
+
+from .app import StreamflowPredictionTool as app
+from .exception_handling import NotFoundError, SettingsError
+
+# zoom levels of the tiles (higher zoom levels use the
+# TILE_MAX_ZOOM tiles and lower ones show no drainage line)
+TILE_MIN_ZOOM = 6
+TILE_MAX_ZOOM = 10
+TILE_PIXELS = 256
+# lines are simplified to within this many pixels of the zoom level
+SIMPLIFY_PIXELS = 0.5
+# seconds the browser keeps a tile (the URL changes when rebuilt)
+TILE_MAX_AGE = 7 * 24 * 3600
+EMPTY_TILE = b'{"type": "FeatureCollection", "features": []}'
+# web mercator
+EARTH_RADIUS = 6378137.0
+MERCATOR_HALF_SIZE = math.pi * EARTH_RADIUS
+MERCATOR_MAX_LATITUDE = 85.0511287798
+
+
+def get_tiles_directory(watershed_id):
+    """
+    Returns the folder of the drainage line tiles of the watershed
+    """
+    return os.path.join(app.get_app_workspace().path,
+                        'drainage_line_tiles', str(watershed_id))
+
+
+def get_drainage_line_tiles_version(watershed_id):
+    """
+    Returns the version of the drainage line tiles of the watershed
+    (changed when they are rebuilt) or None if there are none
+    """
+    try:
+        return int(os.path.getmtime(get_tiles_directory(watershed_id)))
+    except OSError:
+        return None
+
+
+def remove_drainage_line_tiles(watershed_id):
+    """
+    Removes the drainage line tiles of the watershed
+    """
+    rmtree(get_tiles_directory(watershed_id), ignore_errors=True)
+
+
+def _get_coordinate_transform(shapefile_path):
+    """
+    Returns a function that converts the coordinates
+    of the shapefile to longitude/latitude
+    """
+    projection_file = os.path.splitext(shapefile_path)[0] + '.prj'
+    if not os.path.exists(projection_file):
+        return None
+    with open(projection_file) as infile:
+        projection_wkt = infile.read().strip()
+    if projection_wkt.upper().startswith('GEOGCS'):
+        return None
+
+    try:
+        from pyproj import CRS, Transformer
+    except ImportError:
+        raise SettingsError('pyproj is required to build the drainage line '
+                            'tiles of a projected shapefile.')
+    transformer = Transformer.from_crs(CRS.from_wkt(projection_wkt),
+                                       'EPSG:4326', always_xy=True)
+    return lambda points: np.column_stack(
+        transformer.transform(points[:, 0], points[:, 1]))
+
+
+def _json_value(value):
+    """
+    Converts an attribute value of the shapefile to a JSON value
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace').strip()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def read_drainage_line_shapefile(shapefile_list):
+    """
+    Reads the lines of the drainage line shapefile from its files
+
+    Returns
+    -------
+    list of (parts in longitude/latitude, attributes) of each line
+    """
+    shapefile_path = [shapefile_file for shapefile_file in shapefile_list
+                      if shapefile_file.lower().endswith('.shp')][0]
+    try:
+        import shapefile
+    except ImportError:
+        raise SettingsError('pyshp is required to build the drainage line '
+                            'tiles.')
+
+    coordinate_transform = _get_coordinate_transform(shapefile_path)
+    reader = shapefile.Reader(shapefile_path)
+    field_names = [field[0] for field in reader.fields[1:]]
+    drainage_lines = []
+    for shape_record in reader.iterShapeRecords():
+        shape = shape_record.shape
+        if not shape.points:
+            continue
+        points = np.array(shape.points, dtype=np.float64)[:, :2]
+        if coordinate_transform is not None:
+            points = coordinate_transform(points)
+        part_starts = list(shape.parts) + [len(points)]
+        line_parts = [points[part_start:part_end]
+                      for part_start, part_end
+                      in zip(part_starts[:-1], part_starts[1:])
+                      if part_end - part_start > 1]
+        if line_parts:
+            drainage_lines.append((
+                line_parts,
+                {field_name: _json_value(value)
+                 for field_name, value
+                 in zip(field_names, shape_record.record)}
+            ))
+    return drainage_lines
+
+
+def _to_web_mercator(lonlat_points):
+    """
+    Converts longitude/latitude points to web mercator meters
+    """
+    latitudes = np.radians(np.clip(lonlat_points[:, 1],
+                                   -MERCATOR_MAX_LATITUDE,
+                                   MERCATOR_MAX_LATITUDE))
+    return np.column_stack((
+        np.radians(lonlat_points[:, 0]) * EARTH_RADIUS,
+        np.log(np.tan(np.pi / 4 + latitudes / 2)) * EARTH_RADIUS,
+    ))
+
+
+def _simplify_line(points, tolerance):
+    """
+    Returns the indices of the points of the line kept by the
+    Douglas-Peucker simplification
+    """
+    keep_points = np.zeros(len(points), dtype=bool)
+    keep_points[[0, -1]] = True
+    segments = [(0, len(points) - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        segment_length = np.hypot(segment[0], segment[1])
+        if segment_length > 0:
+            distances = np.abs(segment[0] * offsets[:, 1] -
+                               segment[1] * offsets[:, 0]) / segment_length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = np.argmax(distances)
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep_points[split] = True
+            segments.append((start, split))
+            segments.append((split, end))
+    return np.flatnonzero(keep_points)
+
+
+def get_reach_id_attribute(attributes):
+    """
+    Returns the name of the COMID or HydroID attribute or None
+    """
+    for reach_id_name in ('comid', 'hydroid'):
+        for attribute_name in attributes:
+            if attribute_name.lower() == reach_id_name:
+                return attribute_name
+    return None
+
+
+def _project_drainage_lines(drainage_lines):
+    """
+    Adds the web mercator parts, length and bounds of each line
+
+    Returns
+    -------
+    list of (longitude/latitude parts, web mercator parts, length,
+    bounds, attributes) of each line
+    """
+    projected_lines = []
+    for line_parts, attributes in drainage_lines:
+        mercator_parts = [_to_web_mercator(lonlat_points)
+                          for lonlat_points in line_parts]
+        mercator_points = np.concatenate(mercator_parts)
+        projected_lines.append((
+            line_parts,
+            mercator_parts,
+            sum(np.hypot(*np.diff(part_points, axis=0).T).sum()
+                for part_points in mercator_parts),
+            np.concatenate((mercator_points.min(axis=0),
+                            mercator_points.max(axis=0))),
+            attributes,
+        ))
+    return projected_lines
+
+
+def _zoom_features(projected_lines, zoom):
+    """
+    Simplifies the lines for the zoom level and groups them by tile.
+    Lines shorter than a pixel are left out below TILE_MAX_ZOOM.
+
+    Returns
+    -------
+    dict of (x, y) tile -> list of GeoJSON features (encoded once)
+    """
+    pixel_meters = 2 * MERCATOR_HALF_SIZE / (TILE_PIXELS * 2 ** zoom)
+    tile_meters = 2 * MERCATOR_HALF_SIZE / 2 ** zoom
+    # ~ a tenth of a pixel
+    coordinate_decimals = \
+        int(math.ceil(math.log10(TILE_PIXELS * 2 ** zoom / 360.0))) + 1
+    reach_id_name = get_reach_id_attribute(projected_lines[0][-1]) \
+        if projected_lines else None
+
+    tile_features = defaultdict(list)
+    for line_parts, mercator_parts, line_length, line_bounds, attributes \
+            in projected_lines:
+        if zoom < TILE_MAX_ZOOM and line_length < pixel_meters:
+            continue
+        part_coordinates = [
+            np.round(lonlat_points[_simplify_line(
+                mercator_points, SIMPLIFY_PIXELS * pixel_meters)],
+                coordinate_decimals).tolist()
+            for lonlat_points, mercator_points
+            in zip(line_parts, mercator_parts)
+        ]
+
+        feature = {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': part_coordinates[0],
+            } if len(part_coordinates) == 1 else {
+                'type': 'MultiLineString',
+                'coordinates': part_coordinates,
+            },
+            'properties': attributes,
+        }
+        if reach_id_name is not None:
+            feature['id'] = attributes[reach_id_name]
+        feature = json_dumps(feature, separators=(',', ':'))
+
+        min_x, min_y, max_x, max_y = line_bounds
+        for tile_x in range(
+                int((min_x + MERCATOR_HALF_SIZE) // tile_meters),
+                int((max_x + MERCATOR_HALF_SIZE) // tile_meters) + 1):
+            for tile_y in range(
+                    int((MERCATOR_HALF_SIZE - max_y) // tile_meters),
+                    int((MERCATOR_HALF_SIZE - min_y) // tile_meters) + 1):
+                tile_features[(tile_x, tile_y)].append(feature)
+    return tile_features
+
+
+def build_drainage_line_tiles(watershed_id, drainage_lines):
+    """
+    Builds the drainage line tiles of the watershed from the lines
+    of its drainage line shapefile (read_drainage_line_shapefile).
+    The tiles replace the previous ones once they are all written.
+
+    Returns
+    -------
+    int: number of tiles written
+    """
+    projected_lines = _project_drainage_lines(drainage_lines)
+
+    tiles_directory = get_tiles_directory(watershed_id)
+    build_directory = "{0}-{1}".format(tiles_directory, uuid4().hex)
+    num_tiles = 0
+    try:
+        for zoom in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1):
+            for (tile_x, tile_y), features in \
+                    _zoom_features(projected_lines, zoom).items():
+                tile_directory = os.path.join(build_directory, str(zoom),
+                                              str(tile_x))
+                if not os.path.exists(tile_directory):
+                    os.makedirs(tile_directory)
+                with open(os.path.join(tile_directory,
+                                       "{0}.json".format(tile_y)),
+                          'w') as outfile:
+                    outfile.write('{"type":"FeatureCollection","features":[')
+                    outfile.write(",".join(features))
+                    outfile.write(']}')
+                num_tiles += 1
+        if not os.path.exists(build_directory):
+            os.makedirs(build_directory)
+
+        # replace the previous tiles
+        old_directory = "{0}-{1}".format(tiles_directory, uuid4().hex)
+        if os.path.exists(tiles_directory):
+            os.rename(tiles_directory, old_directory)
+        os.rename(build_directory, tiles_directory)
+        rmtree(old_directory, ignore_errors=True)
+    finally:
+        rmtree(build_directory, ignore_errors=True)
+    return num_tiles
+
+
+def read_drainage_line_tile(watershed_id, zoom, tile_x, tile_y):
+    """
+    Reads a drainage line tile of the watershed. Zoom levels above
+    TILE_MAX_ZOOM read the TILE_MAX_ZOOM tile that contains the tile.
+
+    Returns
+    -------
+    the GeoJSON of the tile and its ETag
+    """
+    tiles_version = get_drainage_line_tiles_version(watershed_id)
+    if tiles_version is None:
+        raise NotFoundError('Drainage line tiles of watershed with ID {0}.'
+                            .format(watershed_id))
+
+    if zoom > TILE_MAX_ZOOM:
+        tile_x >>= zoom - TILE_MAX_ZOOM
+        tile_y >>= zoom - TILE_MAX_ZOOM
+        zoom = TILE_MAX_ZOOM
+    tile_etag = '"{0}-{1}-{2}-{3}-{4}"'.format(watershed_id, tiles_version,
+                                               zoom, tile_x, tile_y)
+    tile_file = os.path.join(get_tiles_directory(watershed_id), str(zoom),
+                             str(tile_x), "{0}.json".format(tile_y))
+    if zoom < TILE_MIN_ZOOM or not os.path.exists(tile_file):
+        return EMPTY_TILE, tile_etag
+    with open(tile_file, 'rb') as infile:
+        return infile.read(), tile_etag
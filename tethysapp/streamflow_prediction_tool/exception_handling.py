@@ -6,24 +6,21 @@
 """
 from contextlib import contextmanager
 from functools import wraps
-import logging
-import os
 
 from django.http import HttpResponseBadRequest, HttpResponseServerError
 
 
 from .app import StreamflowPredictionTool as app
+from .log_handling import setup_logging
+from .performance import time_request
 
-# setup logging
-LOG_FILE = os.path.join(app.get_app_workspace().path, 'spt_error.log')
-LOGGER = logging.getLogger('streamflow_prediction_tool')
-FILE_HANDLER = logging.handlers.RotatingFileHandler(LOG_FILE,
-                                                    maxBytes=5*1024*1024,
-                                                    backupCount=1)
-FILE_HANDLER.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s:"
-                                            "%(name)s:%(message)s"))
-LOGGER.addHandler(FILE_HANDLER)
-LOGGER.propagate = False
+# setup logging (written by a background thread)
+LOGGER = setup_logging(app.get_app_workspace().path)
+
+
+class CleanupError(Exception):
+    """This is an exception for errors removing files of deleted items."""
+    pass
 
 
 class DatabaseError(Exception):
@@ -89,7 +86,8 @@ def exceptions_to_http_status(view_func):
             LOGGER.exception("Internal Server Error.")
             return HttpResponseServerError("Internal Server Error. Please "
                                            "check your input parameters.")
-    return inner
+    # record the latency of the view by phase
+    return time_request(inner)
 
 
 @contextmanager
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""forecast_statistics.py
+
+    This module computes the statistics of an ensemble forecast
+    in one pass over the ensemble members for any number of
+    river reaches at once.
+
+    License: BSD 3-Clause
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# names of the statistics computed by compute_ensemble_statistics
+STATISTIC_NAMES = ('mean', 'std_dev_range_upper', 'std_dev_range_lower',
+                   'min', 'max')
+# number of values per block, which keeps the accumulators in cache
+STATISTICS_BLOCK_SIZE = 32768
+
+
+def _compute_block_statistics(block_values, block_statistics):
+    """
+    Computes the statistics of a block of (ensemble, value) values
+    into the block_statistics arrays
+    """
+    num_members = block_values.shape[0]
+    # accumulate the deviations to the first member to keep precision
+    shift = block_values[0].astype(np.float64)
+    deviation = np.empty_like(shift)
+    deviation_sum = np.zeros_like(shift)
+    deviation_sum_squares = np.zeros_like(shift)
+    min_values = block_statistics['min']
+    max_values = block_statistics['max']
+    min_values[:] = block_values[0]
+    max_values[:] = block_values[0]
+    for member_values in block_values[1:]:
+        np.subtract(member_values, shift, out=deviation)
+        deviation_sum += deviation
+        deviation *= deviation
+        deviation_sum_squares += deviation
+        np.minimum(min_values, member_values, out=min_values)
+        np.maximum(max_values, member_values, out=max_values)
+
+    # mean deviation & standard deviation
+    deviation_sum /= num_members
+    deviation_sum_squares /= num_members
+    deviation_sum_squares -= deviation_sum * deviation_sum
+    np.maximum(deviation_sum_squares, 0, out=deviation_sum_squares)
+    std_values = np.sqrt(deviation_sum_squares, out=deviation_sum_squares)
+    mean_values = np.add(shift, deviation_sum, out=shift)
+
+    block_statistics['mean'][:] = mean_values
+    block_statistics['std_dev_range_upper'][:] = mean_values + std_values
+    # the lower standard deviation range is limited by the minimum
+    block_statistics['std_dev_range_lower'][:] = \
+        np.maximum(mean_values - std_values, min_values)
+
+
+def compute_ensemble_statistics(ensemble_values,
+                                block_size=STATISTICS_BLOCK_SIZE):
+    """
+    Computes the mean, standard deviation range, minimum and maximum
+    of the ensemble members in one pass over the members. Where a member
+    is NaN, all statistics are NaN.
+
+    Parameters
+    ----------
+    ensemble_values: numpy.ndarray
+        Array with the ensemble members on the first axis
+        (e.g. (ensemble, time) or (ensemble, time, rivid)).
+        A C-contiguous array is processed without a copy.
+    block_size: int, optional
+        Number of values processed at a time.
+
+    Returns
+    -------
+    OrderedDict of float32 arrays (STATISTIC_NAMES) without the
+    ensemble axis
+    """
+    num_members = ensemble_values.shape[0]
+    member_values = ensemble_values.reshape(num_members, -1)
+    num_values = member_values.shape[1]
+    statistics = OrderedDict(
+        (statistic_name, np.empty(num_values, dtype=np.float32))
+        for statistic_name in STATISTIC_NAMES)
+
+    for block_start in range(0, num_values, block_size):
+        block_slice = slice(block_start, block_start + block_size)
+        _compute_block_statistics(
+            member_values[:, block_slice],
+            {statistic_name: statistic_values[block_slice]
+             for statistic_name, statistic_values in statistics.items()})
+
+    return OrderedDict(
+        (statistic_name, statistic_values.reshape(ensemble_values.shape[1:]))
+        for statistic_name, statistic_values in statistics.items())
@@ -6,6 +6,7 @@
 """
 import datetime
 from glob import glob
+from hashlib import sha256
 from json import dumps as json_dumps
 import os
 import re
@@ -19,10 +20,13 @@ from django.shortcuts import redirect
 
 # local import
 from .app import StreamflowPredictionTool as app
-from .model import GeoServerLayer, Watershed
+from .exception_handling import NotFoundError
+from .model import Watershed
+from .performance import timed_phase
 
 # GLOBAL
 M3_TO_FT3 = 35.3146667
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
 
 
 def redirect_with_message(request, url, message, severity="INFO"):
@@ -50,6 +54,7 @@ def delete_from_database(session, object_to_delete):
     object_to_delete = None
 
 
+@timed_phase('file_discovery')
 def ecmwf_find_most_current_files(path_to_watershed_files, forecast_folder):
     """""
     Finds the current output from downscaled ECMWF forecasts
@@ -88,6 +93,7 @@ def ecmwf_find_most_current_files(path_to_watershed_files, forecast_folder):
     return None, None
 
 
+@timed_phase('file_discovery')
 def get_ecmwf_valid_forecast_folder_list(main_watershed_forecast_folder,
                                          file_extension):
     """
@@ -156,7 +162,8 @@ def format_watershed_title(watershed, subbasin):
 
 def handle_uploaded_file(f, file_path, file_name):
     """
-    Uploads file to specified path
+    Uploads file to specified path in chunks and
+    returns the SHA-256 checksum of the file
     """
     # remove old file if exists
     try:
@@ -165,139 +172,151 @@ def handle_uploaded_file(f, file_path, file_name):
         pass
     # make directory
     if not os.path.exists(file_path):
-        os.mkdir(file_path)
+        os.makedirs(file_path)
     # upload file
+    file_checksum = sha256()
     with open(os.path.join(file_path, file_name), 'wb+') as destination:
         for chunk in f.chunks():
+            file_checksum.update(chunk)
             destination.write(chunk)
+    return file_checksum.hexdigest()
 
 
 def upload_geoserver_layer(geoserver_manager, resource_name,
-                           shp_file_list, geoserver_layer):
+                           shp_file_list):
     """
-    Upload a geoserver layer and return associated result
+    Upload a geoserver layer and return the GeoServerLayer column values
     """
     layer_name, layer_info = geoserver_manager.upload_shapefile(resource_name,
                                                                 shp_file_list)
     if layer_name and layer_info:
-        geoserver_layer.name = layer_name.strip()
-        geoserver_layer.uploaded = True
         raw_latlon_bbox = layer_info['latlon_bbox'][:4]
-        latlon_bbox = json_dumps([raw_latlon_bbox[0], raw_latlon_bbox[2],
-                                  raw_latlon_bbox[1], raw_latlon_bbox[3]])
-        geoserver_layer.latlon_bbox = latlon_bbox
-        geoserver_layer.projection = layer_info['projection']
-        geoserver_layer.attribute_list = json_dumps(layer_info['attributes'])
-        geoserver_layer.wfs_url = layer_info['wfs']['geojson']
-    else:
-        raise Exception("Problems uploading {}".format(resource_name))
-
-
-def update_geoserver_layer_information(geoserver_manager, geoserver_layer):
+        return {
+            'name': layer_name.strip(),
+            'uploaded': True,
+            'latlon_bbox': json_dumps([raw_latlon_bbox[0],
+                                       raw_latlon_bbox[2],
+                                       raw_latlon_bbox[1],
+                                       raw_latlon_bbox[3]]),
+            'projection': layer_info['projection'],
+            'attribute_list': json_dumps(layer_info['attributes']),
+            'wfs_url': layer_info['wfs']['geojson'],
+        }
+    raise Exception("Problems uploading {}".format(resource_name))
+
+
+def get_geoserver_layer_information(geoserver_manager, layer_name):
     """
-    Update information about geoserver layer
+    Returns the bounding box, projection, attributes and WFS url
+    of the geoserver layer as GeoServerLayer column values. Raises
+    NotFoundError if GeoServer does not return the layer.
     """
     layer_info = \
         geoserver_manager.dataset_engine\
-                         .get_resource(resource_id=geoserver_layer.name)
+                         .get_resource(resource_id=layer_name)
 
     if layer_info['success']:
         raw_latlon_bbox = layer_info['result']['latlon_bbox'][:4]
-        latlon_bbox = json_dumps([raw_latlon_bbox[0], raw_latlon_bbox[2],
-                                  raw_latlon_bbox[1], raw_latlon_bbox[3]])
-        geoserver_layer.latlon_bbox = latlon_bbox
-        geoserver_layer.projection = layer_info['result']['projection']
-        geoserver_layer.attribute_list = \
-            json_dumps(layer_info['result']['attributes'])
-        geoserver_layer.wfs_url = layer_info['result']['wfs']['geojson']
-    else:
-        raise Exception("Problems uploading {0}: {1} ..."
-                        .format(geoserver_layer.name, layer_info['error']))
-
-
-def update_geoserver_layer_group_information(geoserver_manager,
-                                             geoserver_layer):
+        return {
+            'latlon_bbox': json_dumps([raw_latlon_bbox[0],
+                                       raw_latlon_bbox[2],
+                                       raw_latlon_bbox[1],
+                                       raw_latlon_bbox[3]]),
+            'projection': layer_info['result']['projection'],
+            'attribute_list': json_dumps(layer_info['result']['attributes']),
+            'wfs_url': layer_info['result']['wfs']['geojson'],
+        }
+    raise NotFoundError("GeoServer layer {0} ({1})."
+                        .format(layer_name, layer_info['error']))
+
+
+def get_geoserver_layer_group_information(geoserver_manager, layer_name):
     """
-    Update information about geoserver layer
+    Returns the bounding box and projection of the geoserver
+    layer group as GeoServerLayer column values. Raises NotFoundError
+    if GeoServer does not return the layer group.
     """
     layer_info = \
         geoserver_manager.dataset_engine\
-                         .get_layer_group(geoserver_layer.name)
+                         .get_layer_group(layer_name)
 
     if layer_info['success']:
         raw_latlon_bbox = layer_info['result']['bounds'][:4]
         if (abs(float(raw_latlon_bbox[0])-float(raw_latlon_bbox[2])) > 0.001
                 and abs(float(raw_latlon_bbox[1])-float(raw_latlon_bbox[3]))
                 > 0.001):
-            latlon_bbox = json_dumps([raw_latlon_bbox[0], raw_latlon_bbox[2],
-                                      raw_latlon_bbox[1], raw_latlon_bbox[3]])
-            geoserver_layer.latlon_bbox = latlon_bbox
-            geoserver_layer.projection = layer_info['result']['bounds'][-1]
-        else:
-            raise Exception("Layer group ({0}) has invalid bounding box ..."
-                            .format(geoserver_layer.name))
-    else:
-        raise Exception("Problems uploading {0}: {1} ..."
-                        .format(geoserver_layer.name, layer_info['error']))
-
-
-def update_geoserver_layer(geoserver_layer, geoserver_layer_name, shp_file,
-                           geoserver_manager, session, layer_required=False,
-                           is_layer_group=False):
+            return {
+                'latlon_bbox': json_dumps([raw_latlon_bbox[0],
+                                           raw_latlon_bbox[2],
+                                           raw_latlon_bbox[1],
+                                           raw_latlon_bbox[3]]),
+                'projection': layer_info['result']['bounds'][-1],
+            }
+        raise Exception("Layer group ({0}) has invalid bounding box ..."
+                        .format(layer_name))
+    raise NotFoundError("GeoServer layer {0} ({1})."
+                        .format(layer_name, layer_info['error']))
+
+
+def update_geoserver_layer(geoserver_manager, current_layer,
+                           geoserver_layer_name, shp_file,
+                           layer_required=False, is_layer_group=False):
     """
-    This function performs the geoserver layer update based on ajax request
+    This function performs the geoserver layer update based on ajax request.
+    It only uses plain values, so it can run in another thread than the
+    database session of the layer.
+
+    Parameters
+    ----------
+    current_layer: tuple or None
+        (name, uploaded) of the current layer of the watershed.
+
+    Returns
+    -------
+    dict of the GeoServerLayer column values of the layer
+    or None if the watershed has no layer
     """
     geoserver_layer_name = "" if not geoserver_layer_name \
         else geoserver_layer_name.strip()
+    current_name, current_uploaded = current_layer or (None, False)
     # ADD NEW SHAPEFILE TO GEOSERVER
     if shp_file and not is_layer_group:
         # remove old geoserver layer
-        if geoserver_layer and geoserver_layer.uploaded:
-            geoserver_manager\
-                .purge_remove_geoserver_layer(geoserver_layer.name)
-
-        if not geoserver_layer:
-            # create new layer in database
-            geoserver_layer = GeoServerLayer(name="")
-
+        if current_uploaded:
+            geoserver_manager.purge_remove_geoserver_layer(current_name)
         # upload shapefile
-        upload_geoserver_layer(geoserver_manager,
-                               geoserver_layer_name,
-                               shp_file,
-                               geoserver_layer)
+        return upload_geoserver_layer(geoserver_manager,
+                                      geoserver_layer_name,
+                                      shp_file)
 
+    layer_columns = {}
     # CONNECT TO EXISTING LAYER ON GEOSERVER
-    elif geoserver_layer_name:
-        if geoserver_layer:
-            # if the name of the layer changed, and was previously uploaded,
-            # delete from geoserver
-            if geoserver_layer_name != geoserver_layer.name:
-                if geoserver_layer.uploaded and not is_layer_group:
-                    geoserver_manager\
-                        .purge_remove_geoserver_layer(geoserver_layer.name)
-                geoserver_layer.name = geoserver_layer_name
-                geoserver_layer.uploaded = False
-        else:
-            # create new layer in database
-            geoserver_layer = GeoServerLayer(name=geoserver_layer_name)
+    if geoserver_layer_name:
+        # if the name of the layer changed, and was previously uploaded,
+        # delete from geoserver
+        if geoserver_layer_name != current_name:
+            if current_uploaded and not is_layer_group:
+                geoserver_manager.purge_remove_geoserver_layer(current_name)
+            layer_columns = {'name': geoserver_layer_name, 'uploaded': False}
 
     # REMOVE LAYER FROM GEOSERVER AND DATABASE
-    elif not geoserver_layer_name and geoserver_layer and not layer_required:
-        if geoserver_layer.uploaded:
-            geoserver_manager\
-                .purge_remove_geoserver_layer(geoserver_layer.name)
-        delete_from_database(session, geoserver_layer)
-        geoserver_layer = None
+    elif current_layer is not None and not layer_required:
+        if current_uploaded:
+            geoserver_manager.purge_remove_geoserver_layer(current_name)
+        return None
+
+    if current_layer is None and not layer_columns:
+        return None
 
     # UPDATE LAYER INFORMATION
-    if geoserver_layer and not shp_file:
-        if is_layer_group:
-            update_geoserver_layer_group_information(
-                geoserver_manager, geoserver_layer)
-        else:
-            update_geoserver_layer_information(
-                geoserver_manager, geoserver_layer)
-    return geoserver_layer
+    layer_name = layer_columns.get('name', current_name)
+    if is_layer_group:
+        layer_columns.update(get_geoserver_layer_group_information(
+            geoserver_manager, layer_name))
+    else:
+        layer_columns.update(get_geoserver_layer_information(
+            geoserver_manager, layer_name))
+    return layer_columns
 
 
 def user_permission_test(user):
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""geoserver_refresh.py
+
+    This module refreshes the bounding box, projection, attributes
+    and WFS url of the GeoServer layers of all watersheds, which are
+    used by the map, from the GeoServers.
+
+    License: BSD 3-Clause
+"""
+from collections import OrderedDict
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+from .app import StreamflowPredictionTool as app
+from .dataset_managers import connect_geoserver, get_geoserver_connection
+from .exception_handling import NotFoundError
+from .functions import (get_geoserver_layer_group_information,
+                        get_geoserver_layer_information)
+from .jobs import WATERSHED_LAYERS
+from .model import Watershed
+
+# number of GeoServer requests run at once
+REFRESH_THREADS = 8
+
+LAYER_CURRENT = 'current'
+LAYER_STALE = 'stale'
+LAYER_MISSING = 'missing'
+LAYER_UNREACHABLE = 'unreachable'
+LAYER_ERROR = 'error'
+
+
+def _connect_geoserver(geoserver_connection):
+    """
+    Checks that the GeoServer (get_geoserver_connection) is reachable
+    in a thread of the refresh pool
+
+    Returns
+    -------
+    tuple of the GeoServer ID and the error message (empty if reachable)
+    """
+    try:
+        connect_geoserver(geoserver_connection)
+    except Exception as ex:
+        return geoserver_connection[0], str(ex)
+    return geoserver_connection[0], ""
+
+
+def _get_layer_information(geoserver_connections, layer_request):
+    """
+    Gets the metadata of a layer from its GeoServer
+    in a thread of the refresh pool with the GeoServer manager
+    of the thread
+
+    Returns
+    -------
+    tuple of the GeoServerLayer ID, the column values or None,
+    the lookup status (current, missing or error) and the error message
+    """
+    layer_id, geoserver_id, layer_name, is_layer_group = layer_request
+    try:
+        geoserver_manager = \
+            connect_geoserver(geoserver_connections[geoserver_id])
+        if is_layer_group:
+            return layer_id, get_geoserver_layer_group_information(
+                geoserver_manager, layer_name), LAYER_CURRENT, ""
+        return layer_id, get_geoserver_layer_information(
+            geoserver_manager, layer_name), LAYER_CURRENT, ""
+    except NotFoundError as ex:
+        return layer_id, None, LAYER_MISSING, str(ex)
+    except Exception as ex:
+        return layer_id, None, LAYER_ERROR, str(ex)
+
+
+def refresh_geoserver_layers(num_threads=REFRESH_THREADS, dry_run=False,
+                             geoserver_id=None):
+    """
+    Refreshes the metadata of the GeoServer layers of all watersheds.
+    Each GeoServer is checked once and the layers of all GeoServers
+    are requested concurrently. The changes are saved in one transaction.
+
+    Parameters
+    ----------
+    num_threads: int, optional
+        Number of GeoServer requests run at once.
+    dry_run: bool, optional
+        Report the stale layers without saving the changes.
+    geoserver_id: int, optional
+        Only refresh the layers of the watersheds on this GeoServer.
+
+    Returns
+    -------
+    list of dict with the geoserver, watershed, layer, status
+    (current, stale, missing, unreachable or error) and error message
+    of each layer
+    """
+    session_maker = app.get_persistent_store_database('main_db',
+                                                      as_sessionmaker=True)
+    session = session_maker()
+    thread_pool = ThreadPool(max(int(num_threads), 1))
+    try:
+        # group the layers by GeoServer
+        geoservers = OrderedDict()
+        watershed_layers = []
+        watersheds = session.query(Watershed)
+        if geoserver_id is not None:
+            watersheds = \
+                watersheds.filter(Watershed.geoserver_id == geoserver_id)
+        for watershed in watersheds.order_by(Watershed.watershed_name,
+                                             Watershed.subbasin_name):
+            for layer_attribute, layer_title, _, is_layer_group \
+                    in WATERSHED_LAYERS:
+                geoserver_layer = getattr(watershed, layer_attribute)
+                if not geoserver_layer or not geoserver_layer.name:
+                    continue
+                if watershed.geoserver_id not in geoservers:
+                    geoservers[watershed.geoserver_id] = \
+                        get_geoserver_connection(watershed.geoserver)
+                watershed_layers.append((watershed, layer_title,
+                                         geoserver_layer, is_layer_group))
+
+        geoserver_errors = {
+            connected_geoserver_id: geoserver_error
+            for connected_geoserver_id, geoserver_error
+            in thread_pool.imap_unordered(_connect_geoserver,
+                                          list(geoservers.values()))
+            if geoserver_error
+        }
+
+        layer_information = {
+            layer_id: (layer_columns, layer_status, layer_error)
+            for layer_id, layer_columns, layer_status, layer_error
+            in thread_pool.imap_unordered(
+                partial(_get_layer_information, geoservers),
+                [(geoserver_layer.id, watershed.geoserver_id,
+                  geoserver_layer.name, is_layer_group)
+                 for watershed, _, geoserver_layer, is_layer_group
+                 in watershed_layers
+                 if watershed.geoserver_id not in geoserver_errors])
+        }
+
+        layer_report = []
+        for watershed, layer_title, geoserver_layer, _ in watershed_layers:
+            if watershed.geoserver_id in geoserver_errors:
+                layer_status = LAYER_UNREACHABLE
+                layer_error = geoserver_errors[watershed.geoserver_id]
+            else:
+                layer_columns, layer_status, layer_error = \
+                    layer_information[geoserver_layer.id]
+                if layer_columns is not None:
+                    for column_name, column_value in layer_columns.items():
+                        if getattr(geoserver_layer, column_name) \
+                                != column_value:
+                            layer_status = LAYER_STALE
+                            setattr(geoserver_layer, column_name,
+                                    column_value)
+            layer_report.append({
+                'geoserver': watershed.geoserver.name,
+                'watershed': "{0} ({1})".format(watershed.watershed_name,
+                                                watershed.subbasin_name),
+                'layer_type': layer_title,
+                'layer': geoserver_layer.name,
+                'status': layer_status,
+                'error': layer_error,
+            })
+
+        if dry_run:
+            session.rollback()
+        else:
+            session.commit()
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+        session.close()
+    return layer_report
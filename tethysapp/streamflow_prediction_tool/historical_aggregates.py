@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""historical_aggregates.py
+
+    This module generates daily and monthly mean historical
+    streamflow files from the 3-hourly historical Qout file so that
+    aggregated requests do not have to resample the full record.
+
+    License: BSD 3-Clause
+"""
+from glob import glob
+import os
+
+import numpy as np
+
+# aggregated files stored next to the historical Qout file
+AGGREGATE_FILE_NAMES = {
+    'daily': 'historical_daily_mean.nc',
+    'monthly': 'historical_monthly_mean.nc',
+}
+# datetime64 unit used to group the time steps
+AGGREGATE_TIME_UNITS = {
+    'daily': 'datetime64[D]',
+    'monthly': 'datetime64[M]',
+}
+# number of reaches read at once (a block of the full 3-hourly record
+# of 200 reaches is about 160 MB as float64)
+RIVID_CHUNK_SIZE = 200
+
+
+def get_historical_aggregate_file(historical_data_file, resolution):
+    """
+    Returns the path to the aggregated file of the historical Qout file
+    if it exists and is up to date, otherwise None.
+    """
+    if resolution not in AGGREGATE_FILE_NAMES:
+        return None
+    aggregate_file = \
+        os.path.join(os.path.dirname(historical_data_file),
+                     AGGREGATE_FILE_NAMES[resolution])
+    try:
+        if os.path.getmtime(aggregate_file) >= \
+                os.path.getmtime(historical_data_file):
+            return aggregate_file
+    except OSError:
+        pass
+    return None
+
+
+def _time_groups(time_values, resolution):
+    """
+    Returns the group start times and start indices
+    of the sorted time values for the resolution
+    """
+    return np.unique(time_values.astype(AGGREGATE_TIME_UNITS[resolution]),
+                     return_index=True)
+
+
+def _create_aggregate_file(file_path, group_times, rivids, resolution,
+                           qout_attributes):
+    """
+    Creates the aggregated NetCDF file with dimensions (rivid, time)
+    so that the series of a reach is contiguous on disk
+    """
+    from netCDF4 import Dataset
+
+    aggregate_nc = Dataset(file_path, 'w', format='NETCDF4')
+    aggregate_nc.createDimension('rivid', rivids.size)
+    aggregate_nc.createDimension('time', group_times.size)
+
+    rivid_var = aggregate_nc.createVariable('rivid', 'i4', ('rivid',))
+    rivid_var.long_name = 'unique identifier for each river reach'
+    rivid_var[:] = rivids
+
+    time_var = aggregate_nc.createVariable('time', 'i8', ('time',))
+    time_var.long_name = 'time'
+    time_var.standard_name = 'time'
+    time_var.units = 'seconds since 1970-01-01 00:00:00+00:00'
+    time_var[:] = group_times.astype('datetime64[s]').astype(np.int64)
+
+    qout_var = aggregate_nc.createVariable('Qout', 'f4', ('rivid', 'time'),
+                                           fill_value=np.nan)
+    qout_var.long_name = '{} mean of {}'.format(
+        resolution, qout_attributes.get('long_name', 'discharge'))
+    qout_var.units = qout_attributes.get('units', 'm3 s-1')
+    aggregate_nc.resolution = resolution
+    return aggregate_nc
+
+
+def generate_historical_aggregates(historical_data_file,
+                                   resolutions=('daily', 'monthly'),
+                                   rivid_chunk_size=RIVID_CHUNK_SIZE):
+    """
+    Generates the aggregated files for all river reaches of the
+    historical Qout file in one vectorized pass over blocks of reaches.
+    The memory used grows with rivid_chunk_size times the number of
+    time steps.
+
+    Returns
+    -------
+    list of generated files
+    """
+    import xarray
+
+    generated_files = []
+    with xarray.open_dataset(historical_data_file) as qout_nc:
+        time_values = qout_nc.time.values
+        rivids = qout_nc.rivid.values
+        qout_attributes = dict(qout_nc.Qout.attrs)
+
+        groups = {}
+        aggregate_ncs = {}
+        try:
+            for resolution in resolutions:
+                groups[resolution] = _time_groups(time_values, resolution)
+                aggregate_file = os.path.join(
+                    os.path.dirname(historical_data_file),
+                    AGGREGATE_FILE_NAMES[resolution])
+                aggregate_ncs[resolution] = _create_aggregate_file(
+                    "{}.tmp".format(aggregate_file), groups[resolution][0],
+                    rivids, resolution, qout_attributes)
+
+            for rivid_start in range(0, rivids.size, rivid_chunk_size):
+                rivid_slice = slice(rivid_start,
+                                    rivid_start + rivid_chunk_size)
+                # (time, rivid) block of the full record
+                qout_block = qout_nc.Qout.isel(rivid=rivid_slice)\
+                                         .transpose('time', 'rivid').values
+                valid_block = np.isfinite(qout_block)
+                qout_block = np.where(valid_block, qout_block, 0)
+                for resolution, aggregate_nc in aggregate_ncs.items():
+                    group_starts = groups[resolution][1]
+                    qout_sums = np.add.reduceat(qout_block, group_starts,
+                                                axis=0)
+                    valid_counts = np.add.reduceat(valid_block, group_starts,
+                                                   axis=0, dtype=np.int32)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        aggregate_nc.variables['Qout'][rivid_slice, :] = \
+                            (qout_sums / valid_counts).T
+        finally:
+            for aggregate_nc in aggregate_ncs.values():
+                aggregate_nc.close()
+
+    for resolution in aggregate_ncs:
+        aggregate_file = os.path.join(os.path.dirname(historical_data_file),
+                                      AGGREGATE_FILE_NAMES[resolution])
+        if os.path.exists(aggregate_file):
+            os.remove(aggregate_file)
+        os.rename("{}.tmp".format(aggregate_file), aggregate_file)
+        generated_files.append(aggregate_file)
+    return generated_files
+
+
+def generate_all_historical_aggregates(historical_folder, force=False):
+    """
+    Generates missing or outdated aggregated files for every
+    watershed in the historical folder.
+
+    Returns
+    -------
+    list of generated files
+    """
+    generated_files = []
+    for watershed_folder in sorted(os.listdir(historical_folder)):
+        historical_data_files = \
+            glob(os.path.join(historical_folder, watershed_folder,
+                              "Qout*.nc"))
+        if not historical_data_files:
+            continue
+        historical_data_file = historical_data_files[0]
+        resolutions = [
+            resolution for resolution in AGGREGATE_FILE_NAMES
+            if force or not get_historical_aggregate_file(
+                historical_data_file, resolution)
+        ]
+        if resolutions:
+            generated_files += \
+                generate_historical_aggregates(historical_data_file,
+                                               resolutions)
+    return generated_files
@@ -0,0 +1,934 @@
+# -*- coding: utf-8 -*-
+"""jobs.py
+
+    This module runs the long-running admin operations of the app
+    (e.g. uploads to GeoServer and the data store) in the background.
+    The jobs are queued in the Job table, which stores their status
+    and progress so that the browser can poll it.
+
+    The jobs are run by the spt_run_jobs worker processes if the
+    enable_job_worker app setting is on. Otherwise, each job is run
+    in a background thread of the web process that created it.
+
+    License: BSD 3-Clause
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import datetime
+from functools import partial
+from json import dumps as json_dumps, loads as json_loads
+from multiprocessing.pool import ThreadPool
+import os
+from shutil import rmtree
+import threading
+import time
+from timeit import default_timer
+from uuid import uuid4
+
+from django.core.exceptions import PermissionDenied
+from sqlalchemy import and_
+from sqlalchemy.orm import object_session
+
+from .app import StreamflowPredictionTool as app
+from .dataset_managers import (connect_geoserver, data_store_manager,
+                               get_geoserver_connection,
+                               get_geoserver_manager)
+from .drainage_line_tiles import (build_drainage_line_tiles,
+                                  read_drainage_line_shapefile,
+                                  remove_drainage_line_tiles)
+from .exception_handling import (LOGGER, CleanupError, DatabaseError,
+                                 GeoServerError, InvalidData, NotFoundError,
+                                 SettingsError, UploadError)
+from .functions import (delete_from_database, handle_uploaded_file,
+                        update_geoserver_layer)
+from .model import (DataStore, GeoServer, GeoServerLayer, Job, Watershed,
+                    delete_prediction_folder)
+from .reach_index import build_reach_index, remove_reach_index
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCESS = 'success'
+JOB_ERROR = 'error'
+# errors with messages that are shown to the user
+JOB_ERRORS = (CleanupError, DatabaseError, GeoServerError, InvalidData,
+              NotFoundError, PermissionDenied, SettingsError, UploadError)
+# seconds between checks of the queue by an idle worker
+JOB_POLL_SECONDS = 5
+# minutes without progress after which a running job is failed
+# as its worker or web process was stopped
+JOB_STALE_MINUTES = 60
+# seconds after which a pending job is started again by another web
+# process (without workers) as the process that queued it was stopped
+JOB_RESTART_SECONDS = 60
+# number of GeoServer layers of a watershed updated at once
+GEOSERVER_THREADS = 4
+# attempts to remove the files of a deleted watershed and seconds
+# to wait before the second attempt (doubled for each attempt)
+CLEANUP_ATTEMPTS = 3
+CLEANUP_RETRY_SECONDS = 30
+# session info key of the jobs queued by the session until it is committed
+QUEUED_JOBS_KEY = 'spt_queued_job_ids'
+# (watershed attribute, title, shapefile name, is layer group)
+# of the GeoServer layers of a watershed in the order they are updated
+WATERSHED_LAYERS = (
+    ('geoserver_drainage_line_layer', 'Drainage Line', 'drainage_line',
+     False),
+    ('geoserver_boundary_layer', 'Boundary', 'boundary', False),
+    ('geoserver_gage_layer', 'Gage', 'gage', False),
+    ('geoserver_historical_flood_map_layer', 'Historical Flood Map',
+     'historical_flood_map', True),
+    ('geoserver_ahps_station_layer', 'AHPS Station', 'ahps_station', False),
+)
+
+
+def _get_session():
+    """
+    Returns a new session of the app database
+    """
+    session_maker = app.get_persistent_store_database('main_db',
+                                                      as_sessionmaker=True)
+    return session_maker()
+
+
+def get_upload_directory():
+    """
+    Returns a new folder in the app workspace
+    for the files uploaded for a job
+    """
+    return os.path.join(app.get_app_workspace().path,
+                        'uploads', uuid4().hex)
+
+
+def stage_uploaded_files(uploaded_files, upload_directory):
+    """
+    Writes the uploaded files to the upload directory
+    and returns their paths
+    """
+    staged_files = []
+    for uploaded_file in uploaded_files:
+        file_name = os.path.basename(uploaded_file.name)
+        handle_uploaded_file(uploaded_file, upload_directory, file_name)
+        staged_files.append(os.path.join(upload_directory, file_name))
+    return staged_files
+
+
+@contextmanager
+def _open_staged_files(staged_files):
+    """
+    Opens the staged files as Django files
+    like the uploaded files they were written from
+    """
+    from django.core.files import File
+
+    opened_files = [File(open(staged_file, 'rb'),
+                         name=os.path.basename(staged_file))
+                    for staged_file in staged_files or ()]
+    try:
+        yield opened_files
+    finally:
+        for opened_file in opened_files:
+            opened_file.close()
+
+
+def create_job(session, job_type, parameters=None):
+    """
+    Adds a pending job with the parameters of the job function
+    """
+    now = datetime.datetime.utcnow()
+    job = Job(job_type=job_type,
+              status=JOB_PENDING,
+              progress=0,
+              message="Waiting to start ...",
+              parameters=json_dumps(parameters or {}),
+              result=json_dumps({}),
+              created_at=now,
+              updated_at=now)
+    session.add(job)
+    session.commit()
+    return job
+
+
+def update_job(job_id, **job_info):
+    """
+    Updates the status, progress or message of the job
+    """
+    session = _get_session()
+    try:
+        job = session.query(Job).get(job_id)
+        for key, value in job_info.items():
+            setattr(job, key, value)
+        job.updated_at = datetime.datetime.utcnow()
+        session.commit()
+    finally:
+        session.close()
+
+
+def _job_info(job):
+    """
+    Returns the status of the job as a dictionary
+    """
+    return {
+        'job_id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json_loads(job.result or "{}"),
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+
+
+def get_job_info(session, job_id):
+    """
+    Returns the status of the job as a dictionary
+    """
+    job = session.query(Job).get(job_id)
+    if job is None:
+        raise NotFoundError('Job with ID {0}.'.format(job_id))
+    return _job_info(job)
+
+
+def get_job_list(session, status=None, limit=50):
+    """
+    Returns the status of the most recent jobs
+    """
+    job_query = session.query(Job)
+    if status:
+        job_query = job_query.filter(Job.status == status)
+    return [_job_info(job)
+            for job in job_query.order_by(Job.id.desc()).limit(limit)]
+
+
+def claim_job(session, job_id):
+    """
+    Marks the pending job as running. Returns False if the job
+    was already claimed by another worker.
+    """
+    num_claimed = session.query(Job) \
+        .filter(Job.id == job_id) \
+        .filter(Job.status == JOB_PENDING) \
+        .update({Job.status: JOB_RUNNING,
+                 Job.updated_at: datetime.datetime.utcnow()},
+                synchronize_session=False)
+    session.commit()
+    return num_claimed == 1
+
+
+def fail_stale_jobs(session):
+    """
+    Fails the running jobs without progress for JOB_STALE_MINUTES,
+    which were interrupted when their process was stopped
+    """
+    now = datetime.datetime.utcnow()
+    num_failed = session.query(Job) \
+        .filter(Job.status == JOB_RUNNING) \
+        .filter(Job.updated_at <
+                now - datetime.timedelta(minutes=JOB_STALE_MINUTES)) \
+        .update({Job.status: JOB_ERROR,
+                 Job.message: "The job was interrupted. "
+                              "Please submit it again.",
+                 Job.updated_at: now},
+                synchronize_session=False)
+    session.commit()
+    if num_failed:
+        LOGGER.warning("%s interrupted jobs failed.", num_failed)
+
+
+def recover_jobs(session):
+    """
+    Fails the interrupted jobs and, if the jobs run in the web
+    processes, starts the pending jobs left by a stopped process
+    """
+    fail_stale_jobs(session)
+    if app.get_custom_setting('enable_job_worker'):
+        return
+    restart_before = datetime.datetime.utcnow() - \
+        datetime.timedelta(seconds=JOB_RESTART_SECONDS)
+    for job_id, in session.query(Job.id) \
+            .filter(Job.status == JOB_PENDING) \
+            .filter(Job.updated_at < restart_before) \
+            .order_by(Job.id):
+        # a job started twice is only run once (claim_job)
+        start_job(job_id)
+
+
+def run_job(job_id):
+    """
+    Runs the function of the job if it is still pending
+    and records the outcome
+
+    Returns
+    -------
+    bool: True if the job was run
+    """
+    session = _get_session()
+    try:
+        if not claim_job(session, job_id):
+            return False
+        job = session.query(Job).get(job_id)
+        job_type = job.job_type
+        parameters = json_loads(job.parameters)
+    finally:
+        session.close()
+
+    try:
+        job_result = JOB_FUNCTIONS[job_type](job_id, **parameters)
+    except JOB_ERRORS as ex:
+        update_job(job_id, status=JOB_ERROR, message=str(ex))
+    except Exception:
+        LOGGER.exception("Job %s (%s) failed.", job_id, job_type)
+        update_job(job_id, status=JOB_ERROR,
+                   message="Internal Server Error.")
+    else:
+        update_job(job_id, status=JOB_SUCCESS, progress=100,
+                   message=job_result.get('success', ""),
+                   result=json_dumps(job_result))
+    return True
+
+
+def run_job_worker(poll_seconds=JOB_POLL_SECONDS, run_once=False):
+    """
+    Runs the pending jobs in the order they were queued. Any number of
+    workers can share the queue as each job is claimed by one worker.
+
+    Parameters
+    ----------
+    poll_seconds: float, optional
+        Seconds to wait for new jobs when the queue is empty.
+    run_once: bool, optional
+        Return when the queue is empty.
+    """
+    while True:
+        session = _get_session()
+        try:
+            fail_stale_jobs(session)
+            pending_job_ids = [
+                job_id for job_id, in session.query(Job.id)
+                .filter(Job.status == JOB_PENDING)
+                .order_by(Job.id)
+            ]
+        finally:
+            session.close()
+
+        for job_id in pending_job_ids:
+            run_job(job_id)
+
+        if not pending_job_ids:
+            if run_once:
+                return
+            time.sleep(poll_seconds)
+
+
+def start_job(job_id):
+    """
+    Leaves the job in the queue for the spt_run_jobs workers
+    if the enable_job_worker app setting is on.
+    Otherwise, runs the job in a background thread.
+    """
+    if app.get_custom_setting('enable_job_worker'):
+        return
+    job_thread = threading.Thread(target=run_job,
+                                  args=(job_id,),
+                                  name='spt-job-{0}'.format(job_id))
+    job_thread.daemon = True
+    job_thread.start()
+
+
+def start_queued_jobs(session):
+    """
+    Starts the jobs queued by the session (e.g. by deleting a watershed)
+    once they are committed
+    """
+    for job_id in session.info.pop(QUEUED_JOBS_KEY, []):
+        start_job(job_id)
+
+
+def _get_geoserver_manager(geoserver):
+    """
+    Returns the manager of the GeoServer for the current thread
+    """
+    try:
+        return get_geoserver_manager(geoserver)
+    except Exception as ex:
+        raise GeoServerError(str(ex))
+
+
+def _update_layer(geoserver_connection, layer_update):
+    """
+    Runs the GeoServer operations of a watershed layer
+    in a thread of the layer pool with the GeoServer manager
+    of the thread
+
+    Returns
+    -------
+    tuple of the layer attribute, GeoServerLayer column values (None if
+    the layer is removed), error and seconds taken
+    """
+    layer_attribute, layer_title, current_layer, layer_name, \
+        shapefile_list, is_layer_group = layer_update
+    start_time = default_timer()
+    layer_columns = None
+    layer_error = None
+    try:
+        with _open_staged_files(shapefile_list) as shp_file:
+            layer_columns = update_geoserver_layer(
+                connect_geoserver(geoserver_connection),
+                current_layer,
+                layer_name,
+                shp_file if not is_layer_group else None,
+                layer_required=(layer_attribute ==
+                                'geoserver_drainage_line_layer'),
+                is_layer_group=is_layer_group
+            )
+    except Exception as ex:
+        layer_error = UploadError("{0} layer update - {1}"
+                                  .format(layer_title, ex))
+    return (layer_attribute, layer_columns, layer_error,
+            default_timer() - start_time)
+
+
+def _update_watershed_layers(job_id, watershed, layer_names,
+                             shapefile_paths, geoserver, session):
+    """
+    Uploads the staged shapefiles of the watershed to GeoServer
+    and connects the watershed to its GeoServer layers. The layers
+    are updated concurrently, with at most GEOSERVER_THREADS
+    GeoServer operations at once, each thread with its own
+    GeoServer manager.
+
+    Returns
+    -------
+    OrderedDict of the time taken to update each layer in milliseconds
+    """
+    update_job(job_id, progress=5, message="Connecting to GeoServer ...")
+    geoserver_manager = _get_geoserver_manager(geoserver)
+    layer_names = dict(layer_names)
+    # check geoserver input before upload
+    for layer_attribute, layer_title, shapefile_name, _ \
+            in WATERSHED_LAYERS:
+        shapefile_list = shapefile_paths.get(shapefile_name)
+        if not shapefile_list:
+            continue
+        layer_names[layer_attribute] = "%s-%s-%s" % (
+            watershed.watershed_clean_name, watershed.subbasin_clean_name,
+            shapefile_name)
+        # check permissions to upload file
+        geoserver_layer = getattr(watershed, layer_attribute)
+        if geoserver_layer and not geoserver_layer.uploaded and \
+                geoserver_layer.name == geoserver_manager.get_layer_name(
+                    layer_names[layer_attribute]):
+            raise PermissionDenied('You do not have permissions to '
+                                   'overwrite the {0} layer ...'
+                                   .format(layer_title))
+        # check shapefiles
+        with _open_staged_files(shapefile_list) as shp_file:
+            try:
+                geoserver_manager.check_shapefile_input_files(shp_file)
+            except Exception as ex:
+                raise UploadError('{0} - {1}.'.format(layer_title, ex))
+
+    # the threads of the layer pool get plain values and return the
+    # column values as the database session is not thread safe
+    current_layers = {
+        layer_attribute: getattr(watershed, layer_attribute)
+        for layer_attribute, _, _, _ in WATERSHED_LAYERS
+    }
+    layer_updates = [
+        (layer_attribute, layer_title,
+         (current_layers[layer_attribute].name,
+          current_layers[layer_attribute].uploaded)
+         if current_layers[layer_attribute] is not None else None,
+         layer_names.get(layer_attribute),
+         shapefile_paths.get(shapefile_name), is_layer_group)
+        for layer_attribute, layer_title, shapefile_name, is_layer_group
+        in WATERSHED_LAYERS
+    ]
+    update_job(job_id, progress=10, message="Updating GeoServer layers ...")
+    updated_layers = {}
+    layer_pool = ThreadPool(min(GEOSERVER_THREADS, len(layer_updates)))
+    try:
+        for num_updated, layer_info in enumerate(
+                layer_pool.imap_unordered(
+                    partial(_update_layer,
+                            get_geoserver_connection(geoserver)),
+                    layer_updates), 1):
+            updated_layers[layer_info[0]] = layer_info[1:]
+            update_job(job_id,
+                       progress=10 + 70 * num_updated // len(layer_updates),
+                       message="Updated {0} of {1} GeoServer layers ..."
+                               .format(num_updated, len(layer_updates)))
+    finally:
+        layer_pool.close()
+        layer_pool.join()
+
+    layer_timings = OrderedDict()
+    for layer_attribute, _, shapefile_name, _ in WATERSHED_LAYERS:
+        layer_columns, layer_error, layer_seconds = \
+            updated_layers[layer_attribute]
+        if layer_error is not None:
+            raise layer_error
+        geoserver_layer = current_layers[layer_attribute]
+        if layer_columns is None:
+            # remove layer from database
+            if geoserver_layer is not None:
+                delete_from_database(session, geoserver_layer)
+            geoserver_layer = None
+        else:
+            if geoserver_layer is None:
+                # create new layer in database
+                geoserver_layer = GeoServerLayer(name="")
+            for column_name, column_value in layer_columns.items():
+                setattr(geoserver_layer, column_name, column_value)
+        setattr(watershed, layer_attribute, geoserver_layer)
+        layer_timings[shapefile_name] = layer_seconds * 1000
+
+    LOGGER.info("GeoServer layers of job %s updated in %s ms.", job_id,
+                ", ".join("{0}: {1:.0f}".format(shapefile_name, layer_ms)
+                          for shapefile_name, layer_ms
+                          in layer_timings.items()))
+    return layer_timings
+
+
+def _watershed_layer_names(watershed):
+    """
+    Returns the names of the GeoServer layers of the watershed
+    """
+    return {
+        layer_attribute: getattr(watershed, layer_attribute).name
+        if getattr(watershed, layer_attribute) else ""
+        for layer_attribute, _, _, _ in WATERSHED_LAYERS
+    }
+
+
+def _update_drainage_line_files(job_id, watershed_id, shapefile_paths,
+                                drainage_line_changed):
+    """
+    Builds the drainage line tiles and reach index of the watershed from
+    the uploaded drainage line shapefile if enabled, replacing the
+    previous ones once built. Outdated ones are removed if not rebuilt
+    (disabled, failed or drainage line layer changed without a new
+    shapefile). A failed build does not fail the job as the map falls
+    back to GeoServer without them.
+
+    Returns
+    -------
+    dict of the number of tiles/reaches built or the error message
+    """
+    drainage_line_files = shapefile_paths.get('drainage_line')
+    drainage_line_builds = []
+    for setting_name, result_name, build_function, remove_function in (
+            ('enable_drainage_line_tiles', 'drainage_line_tiles',
+             build_drainage_line_tiles, remove_drainage_line_tiles),
+            ('enable_reach_index', 'reach_index',
+             build_reach_index, remove_reach_index)):
+        if drainage_line_files and app.get_custom_setting(setting_name):
+            # the build replaces the files once complete
+            drainage_line_builds.append((result_name, build_function,
+                                         remove_function))
+        elif drainage_line_files or drainage_line_changed:
+            remove_function(watershed_id)
+    if not drainage_line_builds:
+        return {}
+
+    update_job(job_id, progress=95,
+               message="Processing the drainage line shapefile ...")
+    build_error = None
+    try:
+        drainage_lines = read_drainage_line_shapefile(drainage_line_files)
+    except Exception as ex:
+        LOGGER.exception("Reading the drainage line of watershed %s "
+                         "failed.", watershed_id)
+        build_error = "Not built: {0}".format(ex)
+
+    build_results = {}
+    for result_name, build_function, remove_function \
+            in drainage_line_builds:
+        build_results[result_name] = build_error
+        if build_error is None:
+            try:
+                build_results[result_name] = \
+                    build_function(watershed_id, drainage_lines)
+                continue
+            except Exception as ex:
+                LOGGER.exception("Building the %s of watershed %s "
+                                 "failed.", result_name, watershed_id)
+                build_results[result_name] = "Not built: {0}".format(ex)
+        # the previous files are of the previous shapefile
+        remove_function(watershed_id)
+    return build_results
+
+
+def add_watershed(job_id, watershed_info, layer_names,
+                  shapefile_paths=None, upload_directory=None):
+    """
+    Uploads or connects the GeoServer layers of a new watershed
+    and adds the watershed
+    """
+    session = _get_session()
+    try:
+        geoserver = session.query(GeoServer) \
+            .get(watershed_info['geoserver_id'])
+        if geoserver is None:
+            raise DatabaseError("The geoserver does not exist.")
+
+        watershed = Watershed(ecmwf_rapid_input_resource_id="",
+                              **watershed_info)
+        layer_timings = \
+            _update_watershed_layers(job_id, watershed, layer_names,
+                                     shapefile_paths or {},
+                                     geoserver, session)
+
+        update_job(job_id, progress=90, message="Adding watershed ...")
+        session.add(watershed)
+        session.commit()
+
+        job_result = {
+            'success': "Watershed Sucessfully Added!",
+            'watershed_id': watershed.id,
+            'layer_timings_ms': layer_timings,
+        }
+        job_result.update(_watershed_layer_names(watershed))
+        job_result.update(
+            _update_drainage_line_files(job_id, watershed.id,
+                                        shapefile_paths or {}, False))
+    finally:
+        session.close()
+        if upload_directory:
+            rmtree(upload_directory, ignore_errors=True)
+    return job_result
+
+
+def update_watershed(job_id, watershed_id, watershed_info, layer_names,
+                     shapefile_paths=None, upload_directory=None):
+    """
+    Uploads or connects the GeoServer layers of the watershed,
+    removes its outdated files and updates the watershed
+    """
+    session = _get_session()
+    try:
+        watershed = session.query(Watershed).get(watershed_id)
+        if watershed is None:
+            raise DatabaseError("The watershed to update does not exist ...")
+        geoserver = session.query(GeoServer) \
+            .get(watershed_info['geoserver_id'])
+        if geoserver is None:
+            raise DatabaseError("The geoserver does not exist ...")
+
+        # remove old geoserver files if geoserver changed
+        if watershed_info['geoserver_id'] != watershed.geoserver_id:
+            update_job(job_id, progress=5,
+                       message="Removing layers from the old GeoServer ...")
+            watershed.delete_geoserver_files()
+
+        # new layer names are based on the new watershed names
+        watershed.watershed_clean_name = \
+            watershed_info['watershed_clean_name']
+        watershed.subbasin_clean_name = watershed_info['subbasin_clean_name']
+        old_layer_names = _watershed_layer_names(watershed)
+        layer_timings = \
+            _update_watershed_layers(job_id, watershed, layer_names,
+                                     shapefile_paths or {},
+                                     geoserver, session)
+
+        update_job(job_id, progress=80,
+                   message="Removing outdated watershed files ...")
+        # remove old prediction files if watershed/subbasin name changed
+        # and RAPID input files on CKAN if the data store changed
+        ecmwf_names_changed = (
+            watershed_info['ecmwf_data_store_watershed_name'] !=
+            watershed.ecmwf_data_store_watershed_name or
+            watershed_info['ecmwf_data_store_subbasin_name'] !=
+            watershed.ecmwf_data_store_subbasin_name)
+        if ecmwf_names_changed:
+            watershed.delete_prediction_files()
+        if ecmwf_names_changed or \
+                watershed_info['data_store_id'] != watershed.data_store_id:
+            try:
+                watershed.delete_rapid_input_ckan()
+            except Exception as ex:
+                raise InvalidData("Invalid CKAN instance %s. "
+                                  "Cannot delete RAPID input files on CKAN: "
+                                  "%s" % (watershed.data_store.api_endpoint,
+                                          ex))
+
+        # change watershed attributes
+        for watershed_attribute, value in watershed_info.items():
+            setattr(watershed, watershed_attribute, value)
+
+        job_result = {
+            'success': "Watershed sucessfully updated!",
+            'layer_timings_ms': layer_timings,
+        }
+        job_result.update(_watershed_layer_names(watershed))
+        session.commit()
+
+        job_result.update(_update_drainage_line_files(
+            job_id, watershed_id, shapefile_paths or {},
+            job_result['geoserver_drainage_line_layer'] !=
+            old_layer_names['geoserver_drainage_line_layer']))
+    finally:
+        session.close()
+        if upload_directory:
+            rmtree(upload_directory, ignore_errors=True)
+    return job_result
+
+
+def update_geoserver(job_id, geoserver_id):
+    """
+    Refreshes the metadata of the layers of the watersheds on the
+    GeoServer, which was updated with the job
+    """
+    from .geoserver_refresh import LAYER_CURRENT, refresh_geoserver_layers
+
+    update_job(job_id, progress=10,
+               message="Refreshing the GeoServer layers ...")
+    layer_report = refresh_geoserver_layers(geoserver_id=geoserver_id)
+    return {
+        'success': "GeoServer sucessfully updated!",
+        'layers': [layer_info for layer_info in layer_report
+                   if layer_info['status'] != LAYER_CURRENT],
+    }
+
+
+def upload_ecmwf_rapid_input(job_id, watershed_id, local_file_path,
+                             checksum):
+    """
+    Uploads the staged ECMWF-RAPID input zip file of the watershed to CKAN
+    """
+    session = _get_session()
+    try:
+        watershed = session.query(Watershed).get(watershed_id)
+        if watershed is None:
+            raise NotFoundError('Watershed with ID {0}.'.format(watershed_id))
+
+        with data_store_manager(watershed.data_store, 'rapid_input') \
+                as data_manager:
+            # remove RAPID input files on CKAN if exists
+            if watershed.ecmwf_rapid_input_resource_id.strip():
+                update_job(job_id, progress=10,
+                           message="Removing old ECMWF-RAPID input ...")
+                data_manager.dataset_engine.delete_resource(
+                    watershed.ecmwf_rapid_input_resource_id
+                )
+
+            # upload file to CKAN
+            update_job(job_id, progress=20,
+                       message="Uploading ECMWF-RAPID input to CKAN ...")
+            try:
+                resource_info = \
+                    data_manager.upload_model_resource(
+                        local_file_path,
+                        watershed.ecmwf_data_store_watershed_name,
+                        watershed.ecmwf_data_store_subbasin_name
+                    )
+            except Exception:
+                LOGGER.exception("Problem uploading %s to CKAN.",
+                                 local_file_path)
+                raise UploadError('Problem uploading ECMWF-RAPID dataset '
+                                  'to CKAN ...')
+
+        # update watershed
+        watershed.ecmwf_rapid_input_resource_id = \
+            resource_info['result']['id']
+        session.commit()
+    finally:
+        session.close()
+        # delete staged file
+        rmtree(os.path.dirname(local_file_path), ignore_errors=True)
+
+    return {
+        'success': 'ECMWF-RAPID input upload success! (SHA-256: {0})'
+                   .format(checksum),
+        'checksum': checksum,
+    }
+
+
+def queue_watershed_cleanup(connection, watershed):
+    """
+    Adds a job to remove the files of the deleted watershed. The job is
+    added in the transaction of the deletion, so it is removed too if the
+    deletion is rolled back. It is started by start_queued_jobs.
+    """
+    layer_names = []
+    for layer_attribute, _, _, is_layer_group in WATERSHED_LAYERS:
+        geoserver_layer = getattr(watershed, layer_attribute)
+        if not is_layer_group and geoserver_layer \
+                and geoserver_layer.uploaded:
+            layer_names.append(geoserver_layer.name)
+
+    now = datetime.datetime.utcnow()
+    insert_result = connection.execute(
+        Job.__table__.insert().values(
+            job_type='watershed_cleanup',
+            status=JOB_PENDING,
+            progress=0,
+            message="Waiting to start ...",
+            parameters=json_dumps({
+                'geoserver_id': watershed.geoserver_id,
+                'layer_names': layer_names,
+                'data_store_id': watershed.data_store_id,
+                'ecmwf_rapid_input_resource_id':
+                    (watershed.ecmwf_rapid_input_resource_id or "").strip(),
+                'ecmwf_data_store_watershed_name':
+                    watershed.ecmwf_data_store_watershed_name,
+                'ecmwf_data_store_subbasin_name':
+                    watershed.ecmwf_data_store_subbasin_name,
+                'watershed_id': watershed.id,
+            }),
+            result=json_dumps({}),
+            created_at=now,
+            updated_at=now)
+    )
+    object_session(watershed).info.setdefault(QUEUED_JOBS_KEY, []) \
+        .append(insert_result.inserted_primary_key[0])
+
+
+def _purge_geoserver_layer(geoserver_connection, layer_name):
+    """
+    Removes the layer and its files from GeoServer
+    """
+    connect_geoserver(geoserver_connection) \
+        .purge_remove_geoserver_layer(layer_name)
+
+
+def _delete_ckan_resource(data_store, resource_id):
+    """
+    Removes the resource from CKAN
+    """
+    with data_store_manager(data_store, 'ckan') as data_manager:
+        data_manager.dataset_engine.delete_resource(resource_id)
+
+
+def _run_cleanup_task(cleanup_task):
+    """
+    Runs a removal of the cleanup job in a thread of the cleanup pool
+
+    Returns
+    -------
+    tuple of the task index and the error message or None
+    """
+    task_index, _, remove_function = cleanup_task
+    try:
+        remove_function()
+    except Exception as ex:
+        return task_index, str(ex)
+    return task_index, None
+
+
+def cleanup_watershed(job_id, geoserver_id, layer_names, data_store_id,
+                      ecmwf_rapid_input_resource_id,
+                      ecmwf_data_store_watershed_name,
+                      ecmwf_data_store_subbasin_name, watershed_id=None):
+    """
+    Removes the GeoServer layers, RAPID input on CKAN, forecasts,
+    drainage line tiles and reach index of a deleted watershed. The
+    removals are run concurrently and the failed ones are attempted
+    again up to CLEANUP_ATTEMPTS times.
+    """
+    session = _get_session()
+    try:
+        geoserver = session.query(GeoServer).get(geoserver_id)
+        data_store = session.query(DataStore).get(data_store_id)
+        is_ckan_data_store = data_store is not None and \
+            data_store.data_store_type.code_name == 'ckan'
+        # keep the forecasts if another watershed uses them
+        num_watersheds_with_forecast = session.query(Watershed) \
+            .filter(
+            and_(
+                Watershed.ecmwf_data_store_watershed_name ==
+                ecmwf_data_store_watershed_name,
+                Watershed.ecmwf_data_store_subbasin_name ==
+                ecmwf_data_store_subbasin_name
+            )
+        ) \
+            .count()
+    finally:
+        # the GeoServer and data store keep their loaded columns
+        session.close()
+
+    if layer_names and geoserver is None:
+        raise CleanupError("The GeoServer of the layers {0} does not exist."
+                           .format(", ".join(layer_names)))
+
+    cleanup_tasks = []
+    if layer_names:
+        # the threads connect to GeoServer with their own manager
+        geoserver_connection = get_geoserver_connection(geoserver)
+        cleanup_tasks = [
+            ("GeoServer layer {0}".format(layer_name),
+             partial(_purge_geoserver_layer, geoserver_connection,
+                     layer_name))
+            for layer_name in layer_names
+        ]
+    if ecmwf_rapid_input_resource_id and is_ckan_data_store:
+        cleanup_tasks.append(
+            ("RAPID input {0} on CKAN".format(ecmwf_rapid_input_resource_id),
+             partial(_delete_ckan_resource, data_store,
+                     ecmwf_rapid_input_resource_id)))
+    if num_watersheds_with_forecast <= 0:
+        cleanup_tasks.append(
+            ("ECMWF forecasts",
+             partial(delete_prediction_folder,
+                     "{0}-{1}".format(ecmwf_data_store_watershed_name,
+                                      ecmwf_data_store_subbasin_name),
+                     app.get_custom_setting('ecmwf_forecast_folder'))))
+    if watershed_id is not None:
+        cleanup_tasks.append(
+            ("drainage line tiles",
+             partial(remove_drainage_line_tiles, watershed_id)))
+        cleanup_tasks.append(
+            ("reach index", partial(remove_reach_index, watershed_id)))
+    cleanup_tasks = [(task_index,) + cleanup_task
+                     for task_index, cleanup_task in enumerate(cleanup_tasks)]
+
+    num_tasks = len(cleanup_tasks)
+    task_errors = {}
+    cleanup_pool = ThreadPool(max(min(GEOSERVER_THREADS,
+                                      len(cleanup_tasks)), 1))
+    try:
+        for attempt in range(1, CLEANUP_ATTEMPTS + 1):
+            update_job(job_id,
+                       progress=100 * (num_tasks - len(cleanup_tasks)) //
+                       max(num_tasks, 1),
+                       message="Removing watershed files (attempt {0} of "
+                               "{1}) ...".format(attempt, CLEANUP_ATTEMPTS))
+            task_errors = {
+                task_index: task_error
+                for task_index, task_error in cleanup_pool.imap_unordered(
+                    _run_cleanup_task, cleanup_tasks)
+                if task_error is not None
+            }
+            cleanup_tasks = [cleanup_task for cleanup_task in cleanup_tasks
+                             if cleanup_task[0] in task_errors]
+            if not cleanup_tasks or attempt == CLEANUP_ATTEMPTS:
+                break
+            LOGGER.warning("Cleanup job %s: %s failed, attempting again.",
+                           job_id, ", ".join(cleanup_task[1]
+                                             for cleanup_task
+                                             in cleanup_tasks))
+            time.sleep(CLEANUP_RETRY_SECONDS * 2 ** (attempt - 1))
+    finally:
+        cleanup_pool.close()
+        cleanup_pool.join()
+
+    if cleanup_tasks:
+        raise CleanupError("Could not remove {0}.".format(
+            "; ".join("{0} ({1})".format(task_description,
+                                         task_errors[task_index])
+                      for task_index, task_description, _
+                      in cleanup_tasks)))
+    return {
+        'success': "Watershed files sucessfully removed!",
+        'attempts': attempt,
+    }
+
+
+# functions run for each job type
+JOB_FUNCTIONS = {
+    'ecmwf_rapid_input_upload': upload_ecmwf_rapid_input,
+    'geoserver_update': update_geoserver,
+    'watershed_add': add_watershed,
+    'watershed_cleanup': cleanup_watershed,
+    'watershed_update': update_watershed,
+}
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""log_handling.py
+
+    This module sets up the logging pipeline of the app. Records are
+    put on a queue by the request threads and written as JSON lines
+    by a background thread of each process so that logging does not
+    add latency to the requests.
+
+    License: BSD 3-Clause
+"""
+import atexit
+import datetime
+from json import dumps as json_dumps
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import threading
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+from .performance import current_request_id
+
+LOGGER_NAME = 'streamflow_prediction_tool'
+ACCESS_LOGGER_NAME = 'streamflow_prediction_tool.access'
+# maximum number of records waiting to be written
+LOG_QUEUE_SIZE = 10000
+# record attributes added to the JSON records when present
+STRUCTURED_FIELDS = ('request_id', 'endpoint', 'method', 'path',
+                     'status_code', 'watershed_name', 'subbasin_name',
+                     'reach_id', 'total_ms', 'phases_ms')
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats log records as single line JSON objects
+    """
+    def format(self, record):
+        log_record = {
+            'timestamp': datetime.datetime.utcfromtimestamp(record.created)
+                                          .strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field_name in STRUCTURED_FIELDS:
+            field_value = getattr(record, field_name, None)
+            if field_value is not None:
+                log_record[field_name] = field_value
+        if record.exc_text:
+            log_record['exception'] = record.exc_text
+        return json_dumps(log_record, sort_keys=True, default=str)
+
+
+class _RequestContextFilter(logging.Filter):
+    """
+    Adds the ID of the current request to the record
+    """
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = current_request_id()
+        return True
+
+
+class _MaxLevelFilter(logging.Filter):
+    """
+    Keeps the records below a level away from a handler
+    (e.g. the info records from the error log)
+    """
+    def __init__(self, max_level):
+        super(_MaxLevelFilter, self).__init__()
+        self.max_level = max_level
+
+    def filter(self, record):
+        return record.levelno < self.max_level
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts the log records on the queue of the writer thread without
+    blocking. Records are dropped and counted if the queue is full.
+
+    The writer thread is started on the first record of each process:
+    a forked process (e.g. a job worker or a preforked web server
+    worker) does not have the thread of its parent, so a new queue and
+    thread are started when the process ID changes.
+    """
+    def __init__(self, handlers):
+        super(QueueHandler, self).__init__()
+        self.handlers = handlers
+        self.log_queue = None
+        self.writer_pid = None
+        self.dropped_records = 0
+
+    def start_writer(self):
+        """
+        Starts the writer thread of the current process
+        """
+        self.log_queue = Queue(LOG_QUEUE_SIZE)
+        writer_thread = LogWriterThread(self.log_queue, self.handlers)
+        writer_thread.start()
+        atexit.register(writer_thread.stop)
+        self.writer_pid = os.getpid()
+
+    def prepare(self, record):
+        """
+        Formats the message and exception in the request thread
+        so the record can be written from another thread
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        # called with the handler lock held
+        try:
+            if self.writer_pid != os.getpid():
+                self.start_writer()
+            self.log_queue.put_nowait(self.prepare(record))
+        except Full:
+            self.dropped_records += 1
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+
+class LogWriterThread(threading.Thread):
+    """
+    Background thread that writes the queued records to the handlers
+    """
+    _STOP = None
+
+    def __init__(self, log_queue, handlers):
+        super(LogWriterThread, self).__init__(name='spt-log-writer')
+        self.daemon = True
+        self.log_queue = log_queue
+        self.handlers = handlers
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            record = self.log_queue.get()
+            if record is self._STOP:
+                break
+            for handler in self.handlers:
+                # as checked by the loggers for their handlers
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self, timeout=5):
+        """
+        Writes the remaining records and stops the thread
+        (only in the process that started it)
+        """
+        if self.pid != os.getpid():
+            return
+        try:
+            self.log_queue.put(self._STOP, timeout=timeout)
+        except Full:
+            return
+        self.join(timeout)
+        for handler in self.handlers:
+            handler.close()
+
+
+def _rotating_json_handler(log_file, min_level, max_level=None):
+    """
+    Creates a rotating file handler writing JSON records
+    from min_level up to (not including) max_level
+    """
+    file_handler = RotatingFileHandler(log_file,
+                                       maxBytes=5*1024*1024,
+                                       backupCount=1)
+    file_handler.setFormatter(JSONFormatter())
+    file_handler.setLevel(min_level)
+    if max_level is not None:
+        file_handler.addFilter(_MaxLevelFilter(max_level))
+    return file_handler
+
+
+def setup_logging(log_directory):
+    """
+    Sends the warnings and errors of the app loggers through the queue
+    to spt_error.log and the info records (e.g. the access records)
+    to spt_access.log in the log directory
+
+    Returns
+    -------
+    the app logger
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    access_logger = logging.getLogger(ACCESS_LOGGER_NAME)
+    if any(isinstance(handler, QueueHandler)
+           for handler in logger.handlers):
+        return logger
+
+    # the writer thread is started by the first record
+    queue_handler = QueueHandler([
+        _rotating_json_handler(os.path.join(log_directory, 'spt_error.log'),
+                               logging.WARNING),
+        _rotating_json_handler(os.path.join(log_directory, 'spt_access.log'),
+                               logging.INFO, logging.WARNING),
+    ])
+    queue_handler.addFilter(_RequestContextFilter())
+    logger.addHandler(queue_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    access_logger.addHandler(queue_handler)
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+    return logger
@@ -9,18 +9,43 @@ import os
 from shutil import rmtree
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, and_
+from sqlalchemy import (Boolean, Column, DateTime, Integer, String,
+                        ForeignKey, and_)
 from sqlalchemy.event import listens_for
 from sqlalchemy.orm import relationship
 
-from spt_dataset_manager.dataset_manager import (CKANDatasetManager,
-                                                 GeoServerDatasetManager)
-
 from .app import StreamflowPredictionTool as app
+from .dataset_managers import data_store_manager, get_geoserver_manager
 
 Base = declarative_base()
 
 
+def delete_prediction_folder(watershed_folder_name,
+                             local_prediction_files_location):
+    """
+    Removes predicitons from folder and folder if not empty
+    """
+    prediciton_folder = os.path.join(local_prediction_files_location,
+                                     watershed_folder_name)
+    # remove watersheds subbsasins folders/files
+    if watershed_folder_name and \
+            local_prediction_files_location and os.path.exists(
+            prediciton_folder):
+
+        # remove all prediction files from watershed/subbasin
+        try:
+            rmtree(prediciton_folder)
+        except OSError:
+            pass
+
+        # remove watershed folder if no other subbasins exist
+        try:
+            os.rmdir(os.path.join(local_prediction_files_location,
+                                  watershed_folder_name))
+        except OSError:
+            pass
+
+
 class DataStore(Base):
     """
     DataStore SQLAlchemy DB Model
@@ -140,13 +165,8 @@ class Watershed(Base):
         """
         Removes old watershed geoserver files from system
         """
-        # initialize geoserver manager
-        app_instance_id = app.get_custom_setting('app_instance_id')
-        geoserver_manager = \
-            GeoServerDatasetManager(engine_url=self.geoserver.url,
-                                    username=self.geoserver.username,
-                                    password=self.geoserver.password,
-                                    app_instance_id=app_instance_id)
+        # get geoserver manager
+        geoserver_manager = get_geoserver_manager(self.geoserver)
 
         # delete layers which need to be deleted
         if self.geoserver_drainage_line_layer:
@@ -174,31 +194,6 @@ class Watershed(Base):
         Removes prediction files from system
         if no other watershed has them
         """
-        def delete_prediciton_files(watershed_folder_name,
-                                    local_prediction_files_location):
-            """
-            Removes predicitons from folder and folder if not empty
-            """
-            prediciton_folder = os.path.join(local_prediction_files_location,
-                                             watershed_folder_name)
-            # remove watersheds subbsasins folders/files
-            if watershed_folder_name and \
-                    local_prediction_files_location and os.path.exists(
-                    prediciton_folder):
-
-                # remove all prediction files from watershed/subbasin
-                try:
-                    rmtree(prediciton_folder)
-                except OSError:
-                    pass
-
-                # remove watershed folder if no other subbasins exist
-                try:
-                    os.rmdir(os.path.join(local_prediction_files_location,
-                                          watershed_folder_name))
-                except OSError:
-                    pass
-
         # initialize session
         session_maker = app.get_persistent_store_database('main_db',
                                                           as_sessionmaker=True)
@@ -221,7 +216,7 @@ class Watershed(Base):
         if num_ecmwf_watersheds_with_forecast <= 0:
             ecmwf_rapid_prediction_directory = \
                 app.get_custom_setting('ecmwf_forecast_folder')
-            delete_prediciton_files(
+            delete_prediction_folder(
                 "{0}-{1}".format(self.ecmwf_data_store_watershed_name,
                                  self.ecmwf_data_store_subbasin_name),
                 ecmwf_rapid_prediction_directory
@@ -236,31 +231,21 @@ class Watershed(Base):
         if self.data_store.data_store_type.code_name == 'ckan' \
                 and self.ecmwf_rapid_input_resource_id.strip():
             # get dataset managers
-            data_manager = CKANDatasetManager(self.data_store.api_endpoint,
-                                              self.data_store.api_key,
-                                              "ecmwf")
-            data_manager.dataset_engine.delete_resource(
-                self.ecmwf_rapid_input_resource_id)
+            with data_store_manager(self.data_store, 'ckan') \
+                    as data_manager:
+                data_manager.dataset_engine.delete_resource(
+                    self.ecmwf_rapid_input_resource_id)
             self.ecmwf_rapid_input_resource_id = ""
 
-    def delete_all_files(self):
-        """
-        Removes old files from system
-        """
-        # remove old geoserver files
-        self.delete_geoserver_files()
-        # remove old ECMWF prediction files
-        self.delete_prediction_files()
-        # remove RAPID input files on CKAN
-        self.delete_rapid_input_ckan()
-
 
 @listens_for(Watershed, 'after_delete')
-def delete_watershed_files(mapper, connect, target):
+def delete_watershed_files(mapper, connection, target):
     """
-    Removes old watershed geoserver files from system
+    Queues a job to remove the watershed files from GeoServer, CKAN
+    and the forecast folder once the deletion is committed
     """
-    target.delete_all_files()
+    from .jobs import queue_watershed_cleanup
+    queue_watershed_cleanup(connection, target)
 
 
 class WatershedWatershedGroupLink(Base):
@@ -285,3 +270,21 @@ class WatershedGroup(Base):
     name = Column(String)
     watersheds = relationship("Watershed",
                               secondary='watershed_watershed_group_link')
+
+
+class Job(Base):
+    """
+    Job SQLAlchemy DB Model for operations run in the background
+    """
+    __tablename__ = 'job'
+
+    # Columns
+    id = Column(Integer, primary_key=True)
+    job_type = Column(String)
+    status = Column(String)
+    progress = Column(Integer, default=0)
+    message = Column(String, default="")
+    parameters = Column(String, default="{}")
+    result = Column(String, default="{}")
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
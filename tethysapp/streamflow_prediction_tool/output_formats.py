@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""output_formats.py
+
+    This module contains functions that serialize streamflow data
+    into file formats for the REST API.
+
+    License: BSD 3-Clause
+"""
+from csv import writer as csv_writer
+import struct
+
+import numpy as np
+
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .exception_handling import LOGGER, InvalidData
+from .functions import get_units_title
+from .performance import timed_phase, timed_stream
+
+# return_format values that are handled by this module
+BINARY_RETURN_FORMATS = ('binary', 'netcdf')
+
+# SPT binary columnar layout
+# (documented in docs/spt_rest_api/rest_api.rst)
+BINARY_MAGIC = b'SPTB'
+BINARY_VERSION = 1
+BINARY_FLAG_TIME = 1
+
+# NetCDF 3 files can be written in memory without a file path
+NETCDF_FORMAT = 'NETCDF3_64BIT'
+
+
+def iter_binary_chunks(data_frame, include_time=True):
+    """
+    Generates the SPT binary columnar layout of a DataFrame in chunks.
+
+    All values are little-endian. The header is followed by the time
+    column (int64 seconds since 1970-01-01 UTC) and then each data
+    column as float32, one column after another.
+    """
+    import pandas as pd
+
+    flags = BINARY_FLAG_TIME if include_time else 0
+    num_rows, num_columns = data_frame.shape
+    header = [struct.pack('<4sHHII', BINARY_MAGIC, BINARY_VERSION, flags,
+                          num_rows, num_columns)]
+    for column_name in data_frame.columns:
+        encoded_name = str(column_name).encode('utf-8')
+        header.append(struct.pack('<H', len(encoded_name)))
+        header.append(encoded_name)
+    yield b''.join(header)
+
+    if include_time:
+        yield pd.DatetimeIndex(data_frame.index).values \
+            .astype('datetime64[s]').astype('<i8').tobytes()
+
+    for column_name in data_frame.columns:
+        yield np.ascontiguousarray(data_frame[column_name].values,
+                                   dtype='<f4').tobytes()
+
+
+def dataframe_to_binary(data_frame, include_time=True):
+    """
+    Serializes a DataFrame into the SPT binary columnar layout.
+    """
+    return b''.join(iter_binary_chunks(data_frame, include_time))
+
+
+class _EchoBuffer(object):
+    """
+    File-like object that returns the value written to it
+    so the csv writer can be used in a generator.
+    """
+    @staticmethod
+    def write(value):
+        """Return the value instead of storing it"""
+        return value
+
+
+def _units_name(units):
+    """
+    Returns the unit string for streamflow variables
+    """
+    return '{}3/s'.format(get_units_title(units))
+
+
+def _stream_chunks(chunks, file_name):
+    """
+    Generates the chunks of a streamed response body. As the status
+    of the response is already sent, an error ends the stream and is
+    logged (the SPT binary header holds the expected size).
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception:
+        LOGGER.exception("Streaming %s failed.", file_name)
+
+
+def _streaming_response(chunks, content_type, file_name):
+    """
+    Wraps a generated body in a streamed attachment response, which
+    is timed as the serialization phase of the request
+    """
+    response = StreamingHttpResponse(
+        timed_stream(_stream_chunks(chunks, file_name), 'serialization'),
+        content_type=content_type)
+    response['Content-Disposition'] = \
+        'attachment; filename={0}'.format(file_name)
+    return response
+
+
+def _file_response(content, return_format, file_name):
+    """
+    Wraps serialized content in an attachment response
+    """
+    if return_format == 'netcdf':
+        response = HttpResponse(content, content_type='application/x-netcdf')
+        extension = 'nc'
+    else:
+        response = HttpResponse(content,
+                                content_type='application/octet-stream')
+        extension = 'bin'
+    response['Content-Disposition'] = \
+        'attachment; filename={0}.{1}'.format(file_name, extension)
+    return response
+
+
+@timed_phase('serialization')
+def time_series_to_response(time_series, return_format, file_name, units,
+                            attributes=None, variable_units=None):
+    """
+    Converts a dictionary of pandas time series into a file response
+
+    Parameters
+    ----------
+    time_series: dict
+        Dictionary of pandas.Series indexed by datetime.
+    return_format: str
+        'csv' or one of BINARY_RETURN_FORMATS.
+    file_name: str
+        The name of the attachment without extension.
+    units: str
+        The units of the request ('english' or metric).
+    attributes: dict, optional
+        Global attributes to add to the NetCDF file.
+    variable_units: dict, optional
+        Units of the series that are not streamflow.
+    """
+    import pandas as pd
+    import xarray
+
+    if return_format != 'csv' \
+            and return_format not in BINARY_RETURN_FORMATS:
+        raise InvalidData('Invalid return_format {} ...'
+                          .format(return_format))
+
+    variable_units = variable_units or {}
+    data_frame = pd.DataFrame(time_series, columns=list(time_series))
+    data_frame.index.name = 'time'
+
+    if return_format == 'csv':
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename={0}.csv'.format(file_name)
+        writer = csv_writer(response)
+        writer.writerow(['datetime'] +
+                        ['{0} ({1})'.format(column,
+                                            variable_units.get(
+                                                column, _units_name(units)))
+                         for column in data_frame.columns])
+        for row_data in data_frame.itertuples():
+            writer.writerow(row_data)
+        return response
+
+    if return_format == 'binary':
+        return _file_response(dataframe_to_binary(data_frame),
+                              return_format, file_name)
+
+    dataset = xarray.Dataset.from_dataframe(data_frame.astype(np.float32))
+    for variable in dataset.data_vars:
+        dataset[variable].attrs['units'] = \
+            variable_units.get(variable, _units_name(units))
+    dataset.attrs.update(attributes or {})
+    return _file_response(dataset.to_netcdf(format=NETCDF_FORMAT),
+                          return_format, file_name)
+
+
+@timed_phase('serialization')
+def return_periods_to_response(return_period_data, return_format, file_name,
+                               units, attributes=None):
+    """
+    Converts the return period dictionary into a binary response
+
+    Parameters
+    ----------
+    return_period_data: dict
+        Dictionary from get_return_period_dict.
+    return_format: str
+        One of BINARY_RETURN_FORMATS.
+    file_name: str
+        The name of the attachment without extension.
+    units: str
+        The units of the request ('english' or metric).
+    attributes: dict, optional
+        Global attributes to add to the NetCDF file.
+    """
+    import pandas as pd
+    import xarray
+
+    if return_format not in BINARY_RETURN_FORMATS:
+        raise InvalidData('Invalid return_format {} ...'
+                          .format(return_format))
+
+    data_frame = pd.DataFrame({key: [float(value)] for key, value
+                               in return_period_data.items()},
+                              columns=sorted(return_period_data))
+
+    if return_format == 'binary':
+        return _file_response(dataframe_to_binary(data_frame,
+                                                  include_time=False),
+                              return_format, file_name)
+
+    dataset = xarray.Dataset(
+        {key: ((), np.float32(data_frame[key].values[0]),
+               {'units': _units_name(units)})
+         for key in data_frame.columns}
+    )
+    dataset.attrs.update(attributes or {})
+    return _file_response(dataset.to_netcdf(format=NETCDF_FORMAT),
+                          return_format, file_name)
+
+
+def ensemble_to_dataframe(ensemble_ds):
+    """
+    Flattens an ensemble (rivid, ensemble, time) array into a DataFrame
+    with one {rivid}_ensemble_{ensemble} column per member
+    """
+    import pandas as pd
+
+    ensemble_values = ensemble_ds.values
+    columns = {}
+    column_names = []
+    for rivid_index, river_id in enumerate(ensemble_ds.rivid.values):
+        for ensemble_index, ensemble in \
+                enumerate(ensemble_ds.ensemble.values):
+            column_name = '{0}_ensemble_{1}'.format(river_id, ensemble)
+            column_names.append(column_name)
+            columns[column_name] = \
+                ensemble_values[rivid_index, ensemble_index]
+    return pd.DataFrame(columns,
+                        index=pd.to_datetime(ensemble_ds.time.values),
+                        columns=column_names)
+
+
+@timed_phase('serialization')
+def ensemble_to_response(ensemble_ds, return_format, file_name, units,
+                         attributes=None):
+    """
+    Converts a (rivid, ensemble, time) forecast into a streamed response
+
+    Parameters
+    ----------
+    ensemble_ds: xarray.DataArray
+        The ensemble forecast with dimensions (rivid, ensemble, time).
+    return_format: str
+        'csv' or one of BINARY_RETURN_FORMATS.
+    file_name: str
+        The name of the attachment without extension.
+    units: str
+        The units of the request ('english' or metric).
+    attributes: dict, optional
+        Global attributes to add to the NetCDF file.
+    """
+    if return_format == 'netcdf':
+        dataset = ensemble_ds.astype(np.float32).to_dataset(name='Qout')
+        dataset['Qout'].attrs['units'] = _units_name(units)
+        dataset.attrs.update(attributes or {})
+        return _file_response(dataset.to_netcdf(format=NETCDF_FORMAT),
+                          return_format, file_name)
+
+    if return_format == 'binary':
+        return _streaming_response(
+            iter_binary_chunks(ensemble_to_dataframe(ensemble_ds)),
+            'application/octet-stream',
+            '{0}.bin'.format(file_name))
+
+    if return_format != 'csv':
+        raise InvalidData('Invalid return_format {} ...'
+                          .format(return_format))
+
+    import pandas as pd
+
+    # read the values before the response is returned
+    ensemble_values = ensemble_ds.values
+    time_values = pd.to_datetime(ensemble_ds.time.values)
+
+    def iter_csv_rows():
+        """
+        Generates one row per river ID and time step
+        """
+        yield ['rivid', 'datetime'] + \
+            ['ensemble_{0} ({1})'.format(ensemble, _units_name(units))
+             for ensemble in ensemble_ds.ensemble.values]
+        for rivid_index, river_id in enumerate(ensemble_ds.rivid.values):
+            rivid_values = ensemble_values[rivid_index].T
+            for time_index, time_value in enumerate(time_values):
+                yield [river_id, time_value] + \
+                    rivid_values[time_index].tolist()
+
+    writer = csv_writer(_EchoBuffer())
+    return _streaming_response(
+        (writer.writerow(row) for row in iter_csv_rows()),
+        'text/csv',
+        '{0}.csv'.format(file_name))
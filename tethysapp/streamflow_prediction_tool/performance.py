@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""performance.py
+
+    This module records the latency of the app requests
+    broken down into phases (validation, file discovery,
+    NetCDF read, statistics and serialization) and profiles
+    slow requests.
+
+    License: BSD 3-Clause
+"""
+from collections import deque, OrderedDict
+import cProfile
+import datetime
+from functools import wraps
+from glob import glob
+from json import dump as json_dump
+import logging
+import os
+import random
+import threading
+from timeit import default_timer
+from uuid import uuid4
+
+import numpy as np
+
+from .app import StreamflowPredictionTool as app
+
+# number of recent request latencies kept per endpoint for percentiles
+LATENCY_SAMPLE_SIZE = 1000
+# seconds between checks of the performance app settings
+SETTINGS_CHECK_SECONDS = 60
+# number of request profiles kept in the app workspace
+MAX_PROFILE_FILES = 50
+
+LOGGER = logging.getLogger('streamflow_prediction_tool')
+ACCESS_LOGGER = logging.getLogger('streamflow_prediction_tool.access')
+
+_LOCAL = threading.local()
+_METRICS_LOCK = threading.Lock()
+_ENDPOINT_METRICS = {}
+_SETTINGS_CACHE = {}
+
+
+class _TimedPhase(object):
+    """
+    Context manager & decorator that adds the time spent in a block
+    to a phase of the current request. Time spent in nested phases
+    is only counted in the nested phase.
+    """
+    def __init__(self, phase_name):
+        self.phase_name = phase_name
+
+    def __enter__(self):
+        phase_frames = getattr(_LOCAL, 'phase_frames', None)
+        if phase_frames is not None:
+            phase_frames.append([self.phase_name, default_timer(), 0.0])
+        return self
+
+    def __exit__(self, *exc_info):
+        phase_frames = getattr(_LOCAL, 'phase_frames', None)
+        if phase_frames and len(phase_frames) > 1:
+            phase_name, start_time, nested_seconds = phase_frames.pop()
+            elapsed_seconds = default_timer() - start_time
+            phase_frames[-1][2] += elapsed_seconds
+            _LOCAL.phase_timings[phase_name] = \
+                _LOCAL.phase_timings.get(phase_name, 0.0) + \
+                elapsed_seconds - nested_seconds
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            """
+            Time the function in the phase
+            """
+            with _TimedPhase(self.phase_name):
+                return func(*args, **kwargs)
+        return inner
+
+
+def current_request_id():
+    """
+    Returns the ID of the request handled by this thread or None
+    """
+    return getattr(_LOCAL, 'request_id', None)
+
+
+def _get_request_id(request):
+    """
+    Returns the X-Request-ID header of the request
+    (e.g. from a proxy) or a new unique ID
+    """
+    request_id = getattr(request, 'META', {}).get('HTTP_X_REQUEST_ID')
+    if request_id:
+        return request_id[:64]
+    return uuid4().hex
+
+
+def timed_phase(phase_name):
+    """
+    Times a block or function as a phase of the current request::
+
+        with timed_phase('read'):
+            ...
+
+        @timed_phase('statistics')
+        def compute():
+            ...
+
+    Outside of a timed request, this does nothing.
+    """
+    return _TimedPhase(phase_name)
+
+
+def _record_request(endpoint, total_seconds, phase_timings, status_code):
+    """
+    Adds the request timings to the metrics of the endpoint
+    """
+    with _METRICS_LOCK:
+        metrics = _ENDPOINT_METRICS.get(endpoint)
+        if metrics is None:
+            metrics = _ENDPOINT_METRICS[endpoint] = {
+                'count': 0,
+                'errors': 0,
+                'total_seconds': 0.0,
+                'max_seconds': 0.0,
+                'phase_seconds': {},
+                'latencies': deque(maxlen=LATENCY_SAMPLE_SIZE),
+            }
+        metrics['count'] += 1
+        if status_code >= 400:
+            metrics['errors'] += 1
+        metrics['total_seconds'] += total_seconds
+        metrics['max_seconds'] = max(metrics['max_seconds'], total_seconds)
+        metrics['latencies'].append(total_seconds)
+        for phase_name, phase_seconds in phase_timings.items():
+            metrics['phase_seconds'][phase_name] = \
+                metrics['phase_seconds'].get(phase_name, 0.0) + phase_seconds
+
+
+def _record_stream(endpoint, phase_name, stream_seconds):
+    """
+    Adds the time spent generating a streamed response body
+    to the metrics of the endpoint
+    """
+    with _METRICS_LOCK:
+        metrics = _ENDPOINT_METRICS.get(endpoint)
+        if metrics is None:
+            return
+        metrics['total_seconds'] += stream_seconds
+        metrics['phase_seconds'][phase_name] = \
+            metrics['phase_seconds'].get(phase_name, 0.0) + stream_seconds
+
+
+def timed_stream(chunks, phase_name):
+    """
+    Times the generation of a streamed response body as a phase of the
+    current request. As the body is generated after the view returns,
+    the time is added to the metrics of the endpoint once the stream
+    ends (not to the Server-Timing header or the latency percentiles).
+    Only the time spent generating the chunks is counted, not the time
+    spent sending them.
+
+    Outside of a timed request, the chunks are returned as is.
+    """
+    phase_frames = getattr(_LOCAL, 'phase_frames', None)
+    if phase_frames is None:
+        return chunks
+    endpoint = phase_frames[0][0]
+
+    def iter_timed_chunks():
+        """
+        Generates the chunks and records the time once done
+        """
+        stream_seconds = 0.0
+        chunk_iterator = iter(chunks)
+        try:
+            while True:
+                start_time = default_timer()
+                try:
+                    chunk = next(chunk_iterator)
+                except StopIteration:
+                    return
+                finally:
+                    stream_seconds += default_timer() - start_time
+                yield chunk
+        finally:
+            _record_stream(endpoint, phase_name, stream_seconds)
+    return iter_timed_chunks()
+
+
+def _get_cached_setting(setting_name):
+    """
+    Returns the app setting, which is cached
+    to avoid a database query per request
+    """
+    now = default_timer()
+    cached_setting = _SETTINGS_CACHE.get(setting_name)
+    if cached_setting is None \
+            or now - cached_setting[0] > SETTINGS_CHECK_SECONDS:
+        cached_setting = (now, app.get_custom_setting(setting_name))
+        _SETTINGS_CACHE[setting_name] = cached_setting
+    return cached_setting[1]
+
+
+def server_timing_enabled():
+    """
+    Checks the enable_server_timing app setting
+    """
+    return bool(_get_cached_setting('enable_server_timing'))
+
+
+def _start_profiler():
+    """
+    Starts profiling the request if the profile_threshold_seconds
+    or profile_sample_rate app settings are set and the request
+    is sampled. Returns None if the request is not profiled.
+    """
+    profile_threshold = _get_cached_setting('profile_threshold_seconds')
+    profile_sample_rate = _get_cached_setting('profile_sample_rate')
+    if profile_threshold is None and profile_sample_rate is None:
+        return None
+    if profile_sample_rate is not None \
+            and random.random() >= profile_sample_rate:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _request_parameters(request):
+    """
+    Returns the parameters of the request to store with the profile.
+    Only the names of POST parameters are kept as they can contain
+    credentials.
+    """
+    return {
+        'method': getattr(request, 'method', None),
+        'path': getattr(request, 'path', None),
+        'GET': dict(getattr(request, 'GET', {}).items()),
+        'POST': sorted(getattr(request, 'POST', {}).keys()),
+        'user': str(getattr(request, 'user', None)),
+    }
+
+
+def _rotate_profiles(profile_directory):
+    """
+    Removes the oldest profiles beyond MAX_PROFILE_FILES
+    """
+    profile_files = sorted(glob(os.path.join(profile_directory, '*.prof')))
+    for profile_file in profile_files[:-MAX_PROFILE_FILES]:
+        for old_file in (profile_file,
+                         "{}.json".format(os.path.splitext(profile_file)[0])):
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
+
+
+def _save_profile(profiler, endpoint, request, total_seconds,
+                  phase_timings, status_code):
+    """
+    Writes the request profile and the parameters that triggered it
+    to the profiles folder of the app workspace
+    """
+    profile_directory = os.path.join(app.get_app_workspace().path,
+                                     'profiles')
+    try:
+        if not os.path.exists(profile_directory):
+            os.makedirs(profile_directory)
+        profile_base = os.path.join(
+            profile_directory,
+            '{0}_{1}_{2:d}ms'.format(
+                datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+                endpoint,
+                int(total_seconds * 1000)))
+        profiler.dump_stats("{}.prof".format(profile_base))
+        with open("{}.json".format(profile_base), 'w') as outfile:
+            json_dump({
+                'endpoint': endpoint,
+                'request_id': current_request_id(),
+                'status_code': status_code,
+                'total_ms': total_seconds * 1000,
+                'phases_ms': {phase_name: phase_seconds * 1000
+                              for phase_name, phase_seconds
+                              in phase_timings.items()},
+                'request': _request_parameters(request),
+            }, outfile, indent=2, sort_keys=True)
+        _rotate_profiles(profile_directory)
+    except (IOError, OSError):
+        LOGGER.exception("Unable to save the profile of %s.", endpoint)
+
+
+def _log_access(endpoint, request, total_seconds, phase_timings,
+                status_code):
+    """
+    Logs the request with its timings to the access log
+    """
+    request_info = getattr(request, 'GET', {})
+    ACCESS_LOGGER.info(
+        "%s %s %s %.1fms", getattr(request, 'method', None), endpoint,
+        status_code, total_seconds * 1000,
+        extra={
+            'endpoint': endpoint,
+            'method': getattr(request, 'method', None),
+            'path': getattr(request, 'path', None),
+            'status_code': status_code,
+            'watershed_name': request_info.get('watershed_name'),
+            'subbasin_name': request_info.get('subbasin_name'),
+            'reach_id': request_info.get('reach_id'),
+            'total_ms': round(total_seconds * 1000, 3),
+            'phases_ms': {phase_name: round(phase_seconds * 1000, 3)
+                          for phase_name, phase_seconds
+                          in phase_timings.items()},
+        })
+
+
+def server_timing_header(total_seconds, phase_timings):
+    """
+    Formats the request timings as a Server-Timing header value
+    """
+    return ', '.join(
+        ['{0};dur={1:.1f}'.format(phase_name, phase_seconds * 1000)
+         for phase_name, phase_seconds in phase_timings.items()] +
+        ['total;dur={0:.1f}'.format(total_seconds * 1000)]
+    )
+
+
+def time_request(view_func):
+    """
+    This decorator records the latency of the view by phase.
+    Views called from within a timed view are timed as part of it.
+
+    Content generated by streaming responses after the view
+    returns is not included unless timed with timed_stream.
+
+    If profiling is enabled, the sampled requests that take at least
+    profile_threshold_seconds are profiled into the app workspace.
+    If the enable_access_log setting is on, every request is logged
+    with its ID and timings to spt_access.log.
+    """
+    @wraps(view_func)
+    def inner(*args, **kwargs):
+        """
+        Time the view and add the Server-Timing header if enabled
+        """
+        if getattr(_LOCAL, 'phase_frames', None) is not None:
+            return view_func(*args, **kwargs)
+
+        _LOCAL.request_id = _get_request_id(args[0])
+        _LOCAL.phase_frames = [[view_func.__name__, default_timer(), 0.0]]
+        _LOCAL.phase_timings = OrderedDict()
+        profiler = None
+        response = None
+        try:
+            profiler = _start_profiler()
+            response = view_func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            endpoint, start_time, nested_seconds = _LOCAL.phase_frames[0]
+            total_seconds = default_timer() - start_time
+            phase_timings = _LOCAL.phase_timings
+            phase_timings['other'] = max(total_seconds - nested_seconds, 0)
+            _LOCAL.phase_frames = None
+            _LOCAL.phase_timings = None
+            status_code = getattr(response, 'status_code', 500)
+            _record_request(endpoint, total_seconds, phase_timings,
+                            status_code)
+
+        try:
+            if profiler is not None and total_seconds >= \
+                    (_get_cached_setting('profile_threshold_seconds') or 0):
+                _save_profile(profiler, endpoint, args[0], total_seconds,
+                              phase_timings, status_code)
+            if _get_cached_setting('enable_access_log'):
+                _log_access(endpoint, args[0], total_seconds, phase_timings,
+                            status_code)
+            if response is not None:
+                response['X-Request-ID'] = _LOCAL.request_id
+        finally:
+            _LOCAL.request_id = None
+
+        if server_timing_enabled():
+            response['Server-Timing'] = \
+                server_timing_header(total_seconds, phase_timings)
+        return response
+    return inner
+
+
+def get_performance_metrics():
+    """
+    Returns the recorded metrics of each endpoint in milliseconds
+    """
+    with _METRICS_LOCK:
+        endpoint_metrics = [
+            (endpoint, dict(metrics,
+                            latencies=list(metrics['latencies']),
+                            phase_seconds=dict(metrics['phase_seconds'])))
+            for endpoint, metrics in _ENDPOINT_METRICS.items()
+        ]
+
+    performance_metrics = OrderedDict()
+    for endpoint, metrics in sorted(endpoint_metrics):
+        performance_metrics[endpoint] = {
+            'count': metrics['count'],
+            'errors': metrics['errors'],
+            'mean_ms': metrics['total_seconds'] * 1000 / metrics['count'],
+            'max_ms': metrics['max_seconds'] * 1000,
+            'p50_ms': float(np.percentile(metrics['latencies'], 50)) * 1000,
+            'p95_ms': float(np.percentile(metrics['latencies'], 95)) * 1000,
+            'phases_mean_ms': {
+                phase_name: phase_seconds * 1000 / metrics['count']
+                for phase_name, phase_seconds
+                in metrics['phase_seconds'].items()
+            },
+        }
+    return performance_metrics
+
+
+def reset_performance_metrics():
+    """
+    Clears the recorded metrics
+    """
+    with _METRICS_LOCK:
+        _ENDPOINT_METRICS.clear()
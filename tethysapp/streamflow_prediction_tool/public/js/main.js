@@ -279,12 +279,15 @@ function ajax_update_database(ajax_url, ajax_data, div_id) {
     if (ajax_url.substr(-1) !== "/") {
         ajax_url = ajax_url.concat("/");
     }
-    //update database
+    //update database & wait for the background job if one was queued
     var xhr = jQuery.ajax({
         type: "POST",
         url: ajax_url,
         dataType: "json",
         data: ajax_data
+    })
+    .then(function(data, status, xhr) {
+        return wait_for_job_response(data, status, xhr, div_id);
     });
     xhr.done(function(data) {
         if("success" in data) {
@@ -337,7 +340,7 @@ function ajax_update_database_multiple_files(ajax_url, ajax_data, custom_message
     if (ajax_url.substr(-1) !== "/") {
         ajax_url = ajax_url.concat("/");
     }
-    //update database
+    //update database & wait for the background job if one was queued
     var xhr = jQuery.ajax({
         url: ajax_url,
         type: "POST",
@@ -345,6 +348,9 @@ function ajax_update_database_multiple_files(ajax_url, ajax_data, custom_message
         dataType: "json",
         processData: false, // Don't process the files
         contentType: false, // Set content type to false as jQuery will tell the server it's a query string request
+    })
+    .then(function(data, status, xhr) {
+        return wait_for_job_response(data, status, xhr, div_id);
     });
     xhr.done(function(data){
         if("success" in data) {
@@ -360,6 +366,77 @@ function ajax_update_database_multiple_files(ajax_url, ajax_data, custom_message
     return xhr;
 }
 
+//wait for a background job to finish
+//returns a promise resolved with the job status when the job succeeds,
+//which is notified with the job status while the job runs
+function wait_for_job(job_status_url, job_id) {
+    //backslash at end of url is required
+    if (job_status_url.substr(-1) !== "/") {
+        job_status_url = job_status_url.concat("/");
+    }
+    var job_finished = jQuery.Deferred();
+    var check_job_status = function() {
+        jQuery.ajax({
+            url: job_status_url,
+            type: "GET",
+            data: {job_id: job_id},
+            dataType: "json"
+        })
+        .done(function(data) {
+            if (data['status'] == "success") {
+                job_finished.resolve(data);
+            } else if (data['status'] == "error") {
+                //rejected like a failed AJAX request
+                job_finished.reject({responseText: data['message']},
+                                    "error", data['message']);
+            } else {
+                job_finished.notify(data);
+                setTimeout(check_job_status, 2000);
+            }
+        })
+        .fail(function(xhr, status, error) {
+            job_finished.reject(xhr, status, error);
+        });
+    };
+    check_job_status();
+    return job_finished.promise();
+}
+
+//resolve the response of an AJAX request that queued a background job
+//with the result of the job when it finishes
+function wait_for_job_response(data, status, xhr, div_id) {
+    if (data == null || !("job_id" in data)) {
+        return jQuery.Deferred().resolve(data, status, xhr).promise();
+    }
+    return wait_for_job("job_status", data['job_id'])
+        .progress(function(job_data) {
+            if (job_data['message']) {
+                addInfoMessage(job_data['message'] + " (" + job_data['progress'] + "%)", div_id);
+            }
+        })
+        .then(function(job_data) {
+            return jQuery.Deferred().resolve(job_data['result'], status, xhr).promise();
+        });
+}
+
+//poll the status of a background job until it finishes
+//returns a promise resolved with the job status when the job succeeds
+function poll_job_status(job_status_url, job_id, custom_message, div_id) {
+    return wait_for_job(job_status_url, job_id)
+        .progress(function(data) {
+            if (data['message']) {
+                addInfoMessage(data['message'] + " (" + data['progress'] + "%)", div_id);
+            }
+        })
+        .done(function(data) {
+            addSuccessMessage(custom_message, div_id);
+        })
+        .fail(function(xhr, status, error) {
+            addWarningMessage("Submission failed");
+            appendErrorMessage(xhr.responseText, div_id);
+        });
+}
+
 //FUNCTION: AJAX upload of ECMWF RAPID Input
 function upload_AJAX_ECMWF_RAPID_input(watershed_id, data_store_id) {
     var xhr_ecmwf_rapid = null;
@@ -372,13 +449,26 @@ function upload_AJAX_ECMWF_RAPID_input(watershed_id, data_store_id) {
             var data = new FormData();
             data.append("watershed_id", watershed_id);
             data.append("ecmwf_rapid_input_file",ecmwf_rapid_input_file);
-            xhr_ecmwf_rapid = ajax_update_database_multiple_files("upload_ecmwf_rapid",
-                                                                  data,
-                                                                  "ECMWF RAPID Input Upload Success!",
-                                                                  "message_ecmwf_rapid_input");
-            //clear input
-            xhr_ecmwf_rapid.done(function() {
+            //the file is uploaded to the data store by a background job
+            xhr_ecmwf_rapid = jQuery.ajax({
+                url: "upload_ecmwf_rapid/",
+                type: "POST",
+                data: data,
+                dataType: "json",
+                processData: false, // Don't process the files
+                contentType: false // Set content type to false as jQuery will tell the server it's a query string request
+            })
+            .then(function(data) {
+                //clear input
                 $('#ecmwf-rapid-files-upload-input').val('');
+                return poll_job_status("job_status", data['job_id'],
+                                       "ECMWF RAPID Input Upload Success!",
+                                       "message_ecmwf_rapid_input");
+            }, function(xhr, status, error) {
+                addWarningMessage("Submission failed");
+                appendErrorMessage(xhr.responseText, "message_ecmwf_rapid_input");
+                //keep the upload failed for the callers
+                return jQuery.Deferred().reject(xhr, status, error).promise();
             });
         }
     }
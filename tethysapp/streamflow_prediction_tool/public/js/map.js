@@ -45,6 +45,8 @@ var ERFP_MAP = (function() {
         m_short_term_chart_data_ajax_load_failed,
         m_short_term_select_data_ajax_handle,
         m_ecmwf_forecast_folder,
+        m_warning_points_forecast_folder,
+        m_warning_points_xhr,
         m_units,
         m_return_20_features_source,
         m_return_10_features_source,
@@ -60,13 +62,15 @@ var ERFP_MAP = (function() {
         getCI, convertTimeSeriesEnglishToMetric, isNotLoadingPastRequest,
         zoomToAll, zoomToLayer, zoomToFeature, toTitleCase, datePadString,
         getBaseLayer, getTileLayer, clearAllMessages, clearInfoMessages,
-        getDrainageLineLayer, getWarningPointsLayerGroup,
+        getDrainageLineLayer, getDrainageLineLimit, getWarningPointsLayerGroup,
         dateToUTCString, clearChartSelect2, getChartData, displayHydrograph,
         loadHydrographFromFeature, resetChartSelectMessage,
         addECMWFSeriesToCharts, addSeriesToCharts, createEmptyForecastChart,
         isThereDataToLoad, checkCleanString, dateToUTCDateTimeString,
         getValidSeries, convertValueMetricToEnglish, unbindInputs,
         loadWarningPoints, updateWarningPoints, determineGeoServerLayerOrGroup,
+        reloadWarningPoints, getWarningPointsBbox, getWarningPointsLayerGroups,
+        addWarningPoints,
         updateWarningSlider, isValidRiverSelected, loadFlowDurationChart,
         loadDailySeasonalStreamflowChart, loadMonthlySeasonalStreamflowChart,
         loadHistoricallStreamflowChart, updateDownloadForecastURL;
@@ -275,7 +279,40 @@ var ERFP_MAP = (function() {
             m_drainage_line_layers.forEach(function(drainage_line_layer, j) {
                 if(drainage_line_layer.get('watershed_name') == watershed_name &&
                     drainage_line_layer.get('subbasin_name') == subbasin_name) {
-                    if (drainage_line_layer.get('layer_type') == "geoserver") {
+                    if (drainage_line_layer.get('layer_type') == "geoserver" &&
+                        drainage_line_layer.get('reach_index')) {
+                        //look up the reach in the reach index of the app
+                        m_searching_for_reach = true;
+                        jQuery.ajax({
+                            url: 'get-reach-info',
+                            data: {
+                                watershed_id: drainage_line_layer.get('watershed_id'),
+                                reach_id: reach_id
+                            },
+                            dataType: 'json',
+                        })
+                        .done(function(response) {
+                            var feature = new ol.Feature(response.properties);
+                            feature.setGeometry(new ol.geom.Point(ol.proj.transform(response.point,
+                                                                                    'EPSG:4326',
+                                                                                    m_map_projection)));
+                            m_map.getView().fit(ol.proj.transformExtent(response.bbox,
+                                                                        'EPSG:4326',
+                                                                        m_map_projection),
+                                                m_map.getSize());
+                            m_select_interaction.getFeatures().clear();
+                            m_select_interaction.getFeatures().push(feature);
+                        })
+                        .fail(function() {
+                            $("#reach-id-help-message").text('Reach ID ' + reach_id + ' not found');
+                            $("#reach-id-help-message").parent().addClass('alert-danger');
+                        })
+                        .always(function() {
+                            m_searching_for_reach = false;
+                            search_id_button.html(search_id_button_html);
+                        });
+                        return;
+                    } else if (drainage_line_layer.get('layer_type') == "geoserver") {
                         m_searching_for_reach = true;
                         var reach_id_attr_name = getCI(drainage_line_layer, 'reach_id_attr_name');
                         if (reach_id_attr_name != null) {
@@ -381,6 +418,43 @@ var ERFP_MAP = (function() {
         return null;
     };
 
+    //FUNCTION: gets the Natur_Flow or RiverOrder value above which
+    //          the drainage lines are shown at the zoom level
+    getDrainageLineLimit = function(geoserver_method, map_zoom) {
+        if (geoserver_method == "natur_flow_query") {
+            if (map_zoom >= 12) {
+                return 0;
+            } else if (map_zoom >= 11) {
+                return 20;
+            } else if (map_zoom >= 10) {
+                return 100;
+            } else if (map_zoom >= 9) {
+                return 1000;
+            } else if (map_zoom >= 8) {
+                return 3000;
+            } else if (map_zoom >= 7) {
+                return 4000;
+            }
+            return 5000;
+        } else if (geoserver_method == "river_order_query") {
+            if (map_zoom >= 12) {
+                return 0;
+            } else if (map_zoom >= 11) {
+                return 2;
+            } else if (map_zoom >= 10) {
+                return 8;
+            } else if (map_zoom >= 9) {
+                return 64;
+            } else if (map_zoom >= 8) {
+                return 128;
+            } else if (map_zoom >= 7) {
+                return 300;
+            }
+            return 1000;
+        }
+        return null;
+    };
+
     //FUNCTION: gets Drainage Line layer from attributes
     getDrainageLineLayer = function(watershed_layers_info) {
         var drainage_line_layer_id = 'layer-' + watershed_layers_info.id + '-drainage_line';
@@ -403,26 +477,73 @@ var ERFP_MAP = (function() {
             } 
             var drainage_line;
             //check layer capabilites
-            if(watershed_layers_info.drainage_line.geoserver_method == "natur_flow_query") {
-                var load_features_xhr = null;
+            if(typeof watershed_layers_info.drainage_line.tiles_version != 'undefined') {
+                //simplified tiles of the drainage line built by the app
+                var tile_grid = ol.tilegrid.createXYZ({
+                    maxZoom: 19
+                });
+                var tile_strategy = ol.loadingstrategy.tile(tile_grid);
+                //higher zoom levels use the tiles of the highest tile zoom level
+                var tiles_max_resolution = tile_grid.getResolution(watershed_layers_info.drainage_line.tiles_max_zoom);
+                var geoserver_method = watershed_layers_info.drainage_line.geoserver_method;
+                var query_attribute = watershed_layers_info.drainage_line.geoserver_query_attribute;
+                var drainage_line_style = [
+                    new ol.style.Style({
+                        stroke: new ol.style.Stroke({
+                            color: 'rgba(255,255,255,0.01)',
+                            width: 30
+                        })
+                    }),
+                    new ol.style.Style({
+                        stroke: new ol.style.Stroke({
+                            color: '#50B0E9',
+                            width: 2
+                        })
+                    })
+                ];
                 var drainage_line_vector_source = new ol.source.Vector({
                     format: new ol.format.GeoJSON(),
                     url: function(extent, resolution, projection) {
-                        var stream_flow_limit = 5000;
-                        var map_zoom = m_map.getView().getZoom();
-                        if (map_zoom >= 12) {
-                            stream_flow_limit = 0;
-                        } else if (map_zoom >= 11) {
-                            stream_flow_limit = 20;
-                        } else if (map_zoom >= 10) {
-                            stream_flow_limit = 100;
-                        } else if (map_zoom >= 9) {
-                            stream_flow_limit = 1000;
-                        } else if (map_zoom >= 8) {
-                            stream_flow_limit = 3000;
-                        } else if (map_zoom >= 7) {
-                            stream_flow_limit = 4000;
+                        var projection_extent = projection.getExtent();
+                        var tile_size = ol.extent.getWidth(extent);
+                        return 'get-drainage-line-tile?watershed_id=' + watershed_layers_info.id +
+                               '&z=' + Math.round(Math.log(ol.extent.getWidth(projection_extent) / tile_size) / Math.LN2) +
+                               '&x=' + Math.round((extent[0] - projection_extent[0]) / tile_size) +
+                               '&y=' + Math.round((projection_extent[3] - extent[3]) / tile_size) +
+                               '&v=' + watershed_layers_info.drainage_line.tiles_version;
+                    },
+                    strategy: function(extent, resolution) {
+                        //the lines are simplified for the zoom level of their tile
+                        resolution = Math.max(resolution, tiles_max_resolution);
+                        var tile_zoom = tile_grid.getZForResolution(resolution);
+                        if(tile_zoom != this.tile_zoom && typeof this.tile_zoom != 'undefined') {
+                            this.clear();
                         }
+                        this.tile_zoom = tile_zoom;
+                        return tile_strategy(extent, resolution);
+                    },
+                    projection: m_map_projection
+                });
+                drainage_line = new ol.layer.Vector({
+                    source: drainage_line_vector_source,
+                    maxResolution: 2500,
+                    style: function(feature, resolution) {
+                        //same lines as the GeoServer queries
+                        var limit = getDrainageLineLimit(geoserver_method, m_map.getView().getZoom());
+                        if (limit != null && !(feature.get(query_attribute) > limit)) {
+                            return null;
+                        }
+                        return drainage_line_style;
+                    }
+                });
+            }
+            else if(watershed_layers_info.drainage_line.geoserver_method == "natur_flow_query") {
+                var load_features_xhr = null;
+                var drainage_line_vector_source = new ol.source.Vector({
+                    format: new ol.format.GeoJSON(),
+                    url: function(extent, resolution, projection) {
+                        var stream_flow_limit = getDrainageLineLimit("natur_flow_query",
+                                                                     m_map.getView().getZoom());
                         //cancel load featues if still active
                         if(load_features_xhr != null) {
                             load_features_xhr.abort();
@@ -485,21 +606,8 @@ var ERFP_MAP = (function() {
                 var drainage_line_vector_source = new ol.source.Vector({
                     format: new ol.format.GeoJSON(),
                     url: function(extent, resolution, projection) {
-                        var river_order_limit = 1000;
-                        var map_zoom = m_map.getView().getZoom();
-                        if (map_zoom >= 12) {
-                            river_order_limit = 0;
-                        } else if (map_zoom >= 11) {
-                            river_order_limit = 2;
-                        } else if (map_zoom >= 10) {
-                            river_order_limit = 8;
-                        } else if (map_zoom >= 9) {
-                            river_order_limit = 64;
-                        } else if (map_zoom >= 8) {
-                            river_order_limit = 128;
-                        } else if (map_zoom >= 7) {
-                            river_order_limit = 300;
-                        }
+                        var river_order_limit = getDrainageLineLimit("river_order_query",
+                                                                     m_map.getView().getZoom());
                         //cancel load featues if still active
                         if(load_features_xhr != null) {
                             load_features_xhr.abort();
@@ -609,6 +717,8 @@ var ERFP_MAP = (function() {
                                                                 m_map_projection));
             drainage_line.set('layer_id', drainage_line_layer_id);
             drainage_line.set('layer_type', 'geoserver');
+            drainage_line.set('watershed_id', watershed_layers_info.id);
+            drainage_line.set('reach_index', watershed_layers_info.drainage_line.reach_index);
 
             return drainage_line;
         }
@@ -629,7 +739,11 @@ var ERFP_MAP = (function() {
                     var features = feature.get("features");
                     var size = -1
                     if (typeof features != 'undefined') {
-                        var size = features.length;
+                        //points clustered by the server have a point count
+                        size = 0;
+                        for (var k=0; k<features.length; k++) {
+                            size += features[k].get('point_count') || 1;
+                        }
                     } 
                     var style;
                     if (size > 3) {
@@ -655,7 +769,7 @@ var ERFP_MAP = (function() {
                         style = [];
                     } else {
                         style = [];
-                        for (var i=0; i<size; i++) {
+                        for (var i=0; i<features.length; i++) {
                             style.push(new ol.style.Style({
                                 image: symbols[features[i].getProperties().size]
                               }));
@@ -1209,59 +1323,170 @@ var ERFP_MAP = (function() {
         }
     };
 
-    //FUNCTION: LOAD WARNING POINTS
-    loadWarningPoints = function(watershed_layer_group, group_id, datetime_string) {
-        $(group_id).parent().addClass('hidden');
+    //FUNCTION: Gets the map extent as a bbox in degrees for the warning points
+    getWarningPointsBbox = function() {
+        var map_size = m_map.getSize();
+        if (typeof map_size == 'undefined') {
+            return [-180, -90, 180, 90];
+        }
+        var map_extent = ol.proj.transformExtent(m_map.getView().calculateExtent(map_size),
+                                                 m_map_projection,
+                                                 'EPSG:4326');
+        var min_lon = -180;
+        var max_lon = 180;
+        if (map_extent[2] - map_extent[0] < 360) {
+            //shift the extent of a wrapped world back to -180 to 180
+            var lon_shift = Math.floor((map_extent[0] + 180) / 360) * 360;
+            min_lon = map_extent[0] - lon_shift;
+            max_lon = map_extent[2] - lon_shift;
+            if (max_lon > 180) {
+                //extent crosses the antimeridian
+                min_lon = -180;
+                max_lon = 180;
+            }
+        }
+        return [min_lon, Math.max(map_extent[1], -90),
+                max_lon, Math.min(map_extent[3], 90)];
+    };
+
+    //FUNCTION: Gets the warning points layer group of each watershed and the id of its input
+    getWarningPointsLayerGroups = function() {
+        var warning_layer_groups = [];
+        m_map.getLayers().forEach(function(watershed_layer, i){
+            if (watershed_layer.get('layer_type') == "warning_points" &&
+                watershed_layer instanceof ol.layer.Group) {
+                var group_id = '#'+watershed_layer.get('group_id');
+                var added = false;
+                watershed_layer.getLayers().forEach(function(sublayer, j) {
+                    if (sublayer instanceof ol.layer.Group) {
+                        warning_layer_groups.push({layer_group: sublayer, group_id: group_id});
+                    }
+                    else if (!added) {
+                        warning_layer_groups.push({layer_group: watershed_layer, group_id: group_id});
+                        added = true;
+                    }
+                });
+            }
+        });
+        return warning_layer_groups;
+    };
 
-        //get warning points for map
+    //FUNCTION: Adds the warning points of a watershed to its layers by peak date
+    addWarningPoints = function(watershed_layer_group, group_id, datetime_string, warning_points, is_reload) {
+        var feature_array = [];
+        if (typeof warning_points != 'undefined') {
+            feature_array = (new ol.format.GeoJSON()).readFeatures(warning_points, {featureProjection: 'EPSG:3857'});
+        }
+        //remove the points of the previous extent
+        watershed_layer_group.getLayers().forEach(function(sublayer, j) {
+            sublayer.getSource().getSource().clear();
+        });
+        if (feature_array.length > 0) {
+            $(group_id).parent().removeClass('hidden');
+            var feature_dict = {};
+            watershed_layer_group.getLayers().forEach(function(sublayer, j) {
+                var peak_date = stringToUTCDate(datetime_string);
+                peak_date.setUTCDate(peak_date.getUTCDate()+j);
+                sublayer.set('peak_date', peak_date);
+                sublayer.set('peak_date_str', dateToUTCString(peak_date));
+                feature_dict[dateToUTCString(peak_date)] = [];
+            });
+
+            for (var i = 0; i < feature_array.length; ++i) {
+                feature_dict[feature_array[i].getProperties().peak_date].push(feature_array[i]);
+            }
+
+            watershed_layer_group.getLayers().forEach(function(sublayer, j) {
+                sublayer.getSource().getSource().addFeatures(feature_dict[sublayer.get('peak_date_str')]);
+                if (!is_reload) {
+                    sublayer.setVisible(true);
+                }
+            });
+            watershed_layer_group.set("daily_warnings", true);
+        }
+    };
+
+    //FUNCTION: LOAD WARNING POINTS of all watersheds in one request
+    loadWarningPoints = function(datetime_string, is_reload) {
+        var warning_layer_groups = getWarningPointsLayerGroups();
+        //cancel the previous request if still loading
+        if (m_warning_points_xhr != null) {
+            m_warning_points_xhr.abort();
+        }
+
+        var watershed_names = [];
+        var subbasin_names = [];
+        var watershed_keys = {};
+        warning_layer_groups.forEach(function(warning_layer_group) {
+            var layer_group = warning_layer_group.layer_group;
+            if (!is_reload) {
+                $(warning_layer_group.group_id).parent().addClass('hidden');
+            }
+            var watershed_name = $.trim(layer_group.get('ecmwf_watershed_name'));
+            var subbasin_name = $.trim(layer_group.get('ecmwf_subbasin_name'));
+            if (!((watershed_name + '/' + subbasin_name) in watershed_keys)) {
+                watershed_keys[watershed_name + '/' + subbasin_name] = true;
+                watershed_names.push(watershed_name);
+                subbasin_names.push(subbasin_name);
+            }
+        });
+        if (watershed_names.length == 0) {
+            return jQuery.when();
+        }
+
+        //get warning points in the map extent (clustered when zoomed out)
         var xhr = jQuery.ajax({
             type: "GET",
-            url: 'get-warning-points',
+            url: 'get-warning-points-group',
             dataType: "json",
+            traditional: true,
             data: {
-                watershed_name: watershed_layer_group.get('ecmwf_watershed_name'),
-                subbasin_name: watershed_layer_group.get('ecmwf_subbasin_name'),
-                return_period: watershed_layer_group.get('return_period'),
+                watershed_name: watershed_names,
+                subbasin_name: subbasin_names,
+                return_period: "2,10,20",
                 forecast_folder: datetime_string || "",
+                bbox: getWarningPointsBbox().join(","),
+                zoom: Math.round(m_map.getView().getZoom()),
             },
         })
-        var xhr2 = xhr.done(function (data) {
-            var feature_array = (new ol.format.GeoJSON()).readFeatures(data, {featureProjection: 'EPSG:3857'});
-            if (feature_array.length > 0) {
-                $(group_id).parent().removeClass('hidden');
-                var first_layer = null;
-                var feature_dict = {};
-                watershed_layer_group.getLayers().forEach(function(sublayer, j) {
-                    var peak_date = stringToUTCDate(datetime_string);
-                    peak_date.setUTCDate(peak_date.getUTCDate()+j);
-                    sublayer.set('peak_date', peak_date);
-                    sublayer.set('peak_date_str', dateToUTCString(peak_date));
-                    feature_dict[dateToUTCString(peak_date)] = [];
-                    if (first_layer == null) {
-                        first_layer = sublayer;
-                    }
-                });
-
-                for (var i = 0; i < feature_array.length; ++i) {
-                    feature_dict[feature_array[i].getProperties().peak_date].push(feature_array[i]);
-                }
-
-                watershed_layer_group.getLayers().forEach(function(sublayer, j) {
-                    sublayer.getSource().getSource().addFeatures(feature_dict[sublayer.get('peak_date_str')]);
-                    sublayer.setVisible(true);
-                });
-                watershed_layer_group.set("daily_warnings", true);
-                m_map.render();
-            }
+        m_warning_points_xhr = xhr;
+        xhr.done(function (data) {
+            var warning_points_dict = {};
+            data.warning_points.forEach(function(warning_points) {
+                warning_points_dict[warning_points.watershed_name + '/' +
+                                    warning_points.subbasin_name + '/' +
+                                    warning_points.return_period] = warning_points;
+            });
+            warning_layer_groups.forEach(function(warning_layer_group) {
+                var layer_group = warning_layer_group.layer_group;
+                addWarningPoints(layer_group,
+                                 warning_layer_group.group_id,
+                                 datetime_string,
+                                 warning_points_dict[$.trim(layer_group.get('ecmwf_watershed_name')) + '/' +
+                                                     $.trim(layer_group.get('ecmwf_subbasin_name')) + '/' +
+                                                     layer_group.get('return_period')],
+                                 is_reload);
+            });
         })
         xhr.always(function() {
+            if (m_warning_points_xhr === xhr) {
+                m_warning_points_xhr = null;
+            }
             m_map.render();
         });
-        return xhr2;
+        return xhr;
+    };
+
+    //FUNCTION: reloads the warning points in the map extent
+    reloadWarningPoints = function() {
+        if (m_warning_points_forecast_folder) {
+            loadWarningPoints(m_warning_points_forecast_folder, true);
+        }
     };
 
     //FUNCTION: updates the warning points for all layers
     updateWarningPoints = function(datetime_string) {
+        m_warning_points_forecast_folder = datetime_string;
         $('#message_warning_points').removeClass('hidden');
         $('#warning_input_area').addClass('hidden');
         //STEP 1: REMOVE ALL OLD WARNINGS
@@ -1287,25 +1512,7 @@ var ERFP_MAP = (function() {
         });
 
         //STEP 2: LOAD NEW WARNINGS
-        var warning_xhr_list = [];
-        m_map.getLayers().forEach(function(watershed_layer, i){
-            if (watershed_layer.get('layer_type') == "warning_points") {
-                if (watershed_layer instanceof ol.layer.Group) {
-                    var group_id = '#'+watershed_layer.get('group_id');
-                    var loaded = false;
-                    watershed_layer.getLayers().forEach(function(sublayer, j) {
-                        if (sublayer instanceof ol.layer.Group) {
-                            warning_xhr_list.push(loadWarningPoints(sublayer, group_id, datetime_string));
-                        }
-                        else if (!loaded) {
-                            warning_xhr_list.push(loadWarningPoints(watershed_layer, group_id, datetime_string));
-                            loaded = true;
-                        }
-                    });
-                }
-            }
-        });
-        jQuery.when.apply(jQuery, warning_xhr_list).always(function() {
+        loadWarningPoints(datetime_string, false).always(function() {
             updateWarningSlider(datetime_string);
             $('#message_warning_points').addClass('hidden');
             $('#warning_input_area').removeClass('hidden');
@@ -2020,7 +2227,6 @@ var ERFP_MAP = (function() {
             }),
         });
 
-        var warning_xhr_list = []
         //wait for layers to load and then zoom to them
         all_watershed_layers.forEach(function(watershed_layer){
             var group_id = '#'+watershed_layer.get('group_id');
@@ -2033,12 +2239,10 @@ var ERFP_MAP = (function() {
                             if (!loaded) {
                                 bindInputs(group_id, watershed_layer);
                             }
-                            warning_xhr_list.push(loadWarningPoints(sublayer, group_id, warning_point_forecast_folder));
                         }
                         else if (!loaded) {
                             loaded = true;
                             bindInputs(group_id, watershed_layer);
-                            warning_xhr_list.push(loadWarningPoints(watershed_layer, group_id, warning_point_forecast_folder));
                         }
                     });
                 } else {
@@ -2064,11 +2268,17 @@ var ERFP_MAP = (function() {
             } 
         });
 
-        //update slider
-        jQuery.when.apply(jQuery, warning_xhr_list).always(function() {
+        //load the warning points of all watersheds and update slider
+        loadWarningPoints(warning_point_forecast_folder, false).always(function() {
             updateWarningSlider(warning_point_forecast_folder);
         });
 
+        //load the warning points of the new map extent
+        m_warning_points_forecast_folder = warning_point_forecast_folder;
+        m_map.on('moveend', function() {
+            reloadWarningPoints();
+        });
+
         //bind flood maps
         m_predicted_flood_maps.forEach(function(layer_group, j) {
             layer_group.getLayers().forEach(function(layer, j) {
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""reach_index.py
+
+    This module builds an index of the reaches of a watershed from the
+    attributes of its drainage line shapefile when it is uploaded, so
+    that a reach is looked up by its ID (COMID/HydroID) without a
+    GeoServer query. For each reach, the index keeps the bounding box
+    and a point of its line and the attributes used by the map (e.g.
+    watershed, subbasin, usgs_id, nws_id, hydroserve, RiverOrder). The
+    indexes are written to the reach_index folder of the app workspace
+    if the enable_reach_index app setting is on and kept in memory
+    once read.
+
+    License: BSD 3-Clause
+"""
+from collections import OrderedDict
+from json import dump as json_dump, load as json_load
+import os
+import threading
+from uuid import uuid4
+
+import numpy as np
+
+from .app import StreamflowPredictionTool as app
+from .drainage_line_tiles import get_reach_id_attribute
+from .exception_handling import NotFoundError
+
+# attributes of the reaches kept in the index (case insensitive)
+INDEX_ATTRIBUTES = ('watershed', 'subbasin', 'watershed_name',
+                    'subbasin_name', 'usgs_id', 'nws_id', 'hydroserve',
+                    'riverorder', 'natur_flow')
+# number of reach indexes kept in memory
+INDEX_CACHE_SIZE = 16
+
+# reach index file -> (modification time, index)
+_INDEXES = OrderedDict()
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_reach_index_file(watershed_id):
+    """
+    Returns the reach index file of the watershed
+    """
+    return os.path.join(app.get_app_workspace().path, 'reach_index',
+                        "{0}.json".format(watershed_id))
+
+
+def has_reach_index(watershed_id):
+    """
+    Returns True if the watershed has a reach index
+    """
+    return os.path.exists(get_reach_index_file(watershed_id))
+
+
+def remove_reach_index(watershed_id):
+    """
+    Removes the reach index of the watershed
+    """
+    try:
+        os.remove(get_reach_index_file(watershed_id))
+    except OSError:
+        pass
+
+
+def build_reach_index(watershed_id, drainage_lines):
+    """
+    Builds the reach index of the watershed from the lines of its
+    drainage line shapefile (read_drainage_line_shapefile). The
+    reaches are sorted by ID for the lookups.
+
+    Returns
+    -------
+    int: number of reaches in the index
+    """
+    if not drainage_lines:
+        raise NotFoundError('Reaches in the drainage line shapefile.')
+    reach_id_name = get_reach_id_attribute(drainage_lines[0][1])
+    if reach_id_name is None:
+        raise NotFoundError('COMID or HydroID attribute in the drainage '
+                            'line shapefile.')
+    attribute_names = [attribute_name
+                       for attribute_name in drainage_lines[0][1]
+                       if attribute_name.lower() in INDEX_ATTRIBUTES]
+
+    reach_ids = np.array([int(attributes[reach_id_name])
+                          for _, attributes in drainage_lines],
+                         dtype=np.int64)
+    reach_order = np.argsort(reach_ids, kind='mergesort')
+    bboxes = []
+    points = []
+    for reach_index in reach_order:
+        line_points = np.concatenate(drainage_lines[reach_index][0])
+        bboxes.append(np.concatenate((line_points.min(axis=0),
+                                      line_points.max(axis=0))).tolist())
+        points.append(line_points[len(line_points) // 2].tolist())
+
+    reach_index_file = get_reach_index_file(watershed_id)
+    if not os.path.exists(os.path.dirname(reach_index_file)):
+        os.makedirs(os.path.dirname(reach_index_file))
+    # replace the previous index once written
+    build_file = "{0}-{1}".format(reach_index_file, uuid4().hex)
+    try:
+        with open(build_file, 'w') as outfile:
+            json_dump({
+                'reach_id_attribute': reach_id_name,
+                'reach_ids': reach_ids[reach_order].tolist(),
+                'bboxes': bboxes,
+                'points': points,
+                'attributes': {
+                    attribute_name: [
+                        drainage_lines[reach_index][1][attribute_name]
+                        for reach_index in reach_order
+                    ]
+                    for attribute_name in attribute_names
+                },
+            }, outfile, separators=(',', ':'))
+        os.rename(build_file, reach_index_file)
+    finally:
+        if os.path.exists(build_file):
+            os.remove(build_file)
+    return len(reach_order)
+
+
+def get_reach_index(watershed_id):
+    """
+    Returns the reach index of the watershed. The index is read once
+    and read again when it is rebuilt.
+    """
+    reach_index_file = get_reach_index_file(watershed_id)
+    try:
+        file_mtime = os.path.getmtime(reach_index_file)
+    except OSError:
+        raise NotFoundError('Reach index of watershed with ID {0}.'
+                            .format(watershed_id))
+    with _INDEXES_LOCK:
+        index_info = _INDEXES.pop(reach_index_file, None)
+        if index_info is not None and index_info[0] == file_mtime:
+            _INDEXES[reach_index_file] = index_info
+            return index_info[1]
+
+    # read outside of the lock as it can take a while
+    with open(reach_index_file) as infile:
+        index = json_load(infile)
+    index['reach_ids'] = np.array(index['reach_ids'], dtype=np.int64)
+    with _INDEXES_LOCK:
+        _INDEXES[reach_index_file] = (file_mtime, index)
+        while len(_INDEXES) > INDEX_CACHE_SIZE:
+            _INDEXES.popitem(last=False)
+    return index
+
+
+def query_reach(watershed_id, reach_id):
+    """
+    Looks up a reach of the watershed in its reach index
+
+    Returns
+    -------
+    dict with the reach_id, the bbox (min_lon, min_lat, max_lon,
+    max_lat) and a point (lon, lat) of the reach line and its
+    properties (the attributes of the shapefile)
+    """
+    index = get_reach_index(watershed_id)
+    reach_position = np.searchsorted(index['reach_ids'], reach_id)
+    if reach_position >= index['reach_ids'].size or \
+            index['reach_ids'][reach_position] != reach_id:
+        raise NotFoundError('Reach with ID {0}.'.format(reach_id))
+
+    reach_properties = {
+        attribute_name: attribute_values[reach_position]
+        for attribute_name, attribute_values in index['attributes'].items()
+    }
+    reach_properties[index['reach_id_attribute']] = int(reach_id)
+    return {
+        'reach_id': int(reach_id),
+        'bbox': index['bboxes'][reach_position],
+        'point': index['points'][reach_position],
+        'properties': reach_properties,
+    }
@@ -9,12 +9,12 @@ from shutil import rmtree
 
 from django.core.management.base import BaseCommand
 
-from spt_dataset_manager.dataset_manager import ECMWFRAPIDDatasetManager
-
 from tethys_apps.tethysapp.streamflow_prediction_tool.model \
         import Watershed
 from tethys_apps.tethysapp.streamflow_prediction_tool.app \
     import StreamflowPredictionTool as app
+from tethys_apps.tethysapp.streamflow_prediction_tool.dataset_managers \
+    import data_store_manager
 
 
 def _download_single_watershed_ecmwf_data(watershed,
@@ -30,15 +30,14 @@ def _download_single_watershed_ecmwf_data(watershed,
         # get data engine
         data_store = watershed.data_store
         if data_store.data_store_type.code_name == 'ckan':
-            # get dataset managers
-            data_manager = ECMWFRAPIDDatasetManager(data_store.api_endpoint,
-                                                    data_store.api_key)
-            # load current datasets
-            data_manager.download_recent_resource(
-                watershed.ecmwf_data_store_watershed_name,
-                watershed.ecmwf_data_store_subbasin_name,
-                ecmwf_rapid_prediction_directory
-            )
+            # load current datasets with the data store manager
+            with data_store_manager(data_store, 'ecmwf_rapid') \
+                    as data_manager:
+                data_manager.download_recent_resource(
+                    watershed.ecmwf_data_store_watershed_name,
+                    watershed.ecmwf_data_store_subbasin_name,
+                    ecmwf_rapid_prediction_directory
+                )
 
         path_to_predicitons = \
             os.path.join(ecmwf_rapid_prediction_directory,
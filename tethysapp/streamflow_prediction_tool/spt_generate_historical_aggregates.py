@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""spt_generate_historical_aggregates.py
+
+    License: BSD 3-Clause
+"""
+import os
+
+from django.core.management.base import BaseCommand
+
+from tethys_apps.tethysapp.streamflow_prediction_tool.app \
+    import StreamflowPredictionTool as app
+from tethys_apps.tethysapp.streamflow_prediction_tool.historical_aggregates \
+    import generate_all_historical_aggregates
+
+
+class Command(BaseCommand):
+    """Command to generate the daily and monthly historical files"""
+    help = 'Generates daily and monthly mean historical streamflow files ' \
+           'for all watersheds.'
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate files that are up to date.')
+
+    def handle(self, *args, **options):
+        """Method run when command called."""
+        historical_folder = app.get_custom_setting('historical_folder')
+        if historical_folder and os.path.exists(historical_folder):
+            for generated_file in \
+                    generate_all_historical_aggregates(historical_folder,
+                                                       options['force']):
+                print("Generated {}".format(generated_file))
+        else:
+            print("Historical location invalid. Please set to continue.")
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""spt_refresh_geoserver_layers.py
+
+    License: BSD 3-Clause
+"""
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from tethys_apps.tethysapp.streamflow_prediction_tool.geoserver_refresh \
+    import (LAYER_CURRENT, LAYER_ERROR, LAYER_MISSING, LAYER_STALE,
+            LAYER_UNREACHABLE, REFRESH_THREADS, refresh_geoserver_layers)
+
+
+class Command(BaseCommand):
+    """Command to refresh the GeoServer layer metadata of all watersheds"""
+    help = 'Refreshes the bounding box, projection, attributes and WFS url ' \
+           'of the GeoServer layers of all watersheds.'
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument('--threads', type=int, default=REFRESH_THREADS,
+                            help='Number of GeoServer requests run at once.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the stale layers without '
+                                 'updating the database.')
+
+    def handle(self, *args, **options):
+        """Method run when command called."""
+        layer_report = refresh_geoserver_layers(options['threads'],
+                                                options['dry_run'])
+        for layer_info in layer_report:
+            if layer_info['status'] == LAYER_CURRENT:
+                continue
+            print("{status:<12}{geoserver} | {watershed} | {layer_type} | "
+                  "{layer} {error}".format(**layer_info))
+
+        status_counts = Counter(layer_info['status']
+                                for layer_info in layer_report)
+        print("{0} layers: {1} current, {2} {3}, {4} missing, "
+              "{5} unreachable, {6} failed.".format(
+                  len(layer_report),
+                  status_counts[LAYER_CURRENT],
+                  status_counts[LAYER_STALE],
+                  'stale (not updated)' if options['dry_run']
+                  else 'stale (updated)',
+                  status_counts[LAYER_MISSING],
+                  status_counts[LAYER_UNREACHABLE],
+                  status_counts[LAYER_ERROR]))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""spt_run_jobs.py
+
+    License: BSD 3-Clause
+"""
+from multiprocessing import Process
+
+from django.core.management.base import BaseCommand
+
+from tethys_apps.tethysapp.streamflow_prediction_tool.jobs \
+    import JOB_POLL_SECONDS, run_job_worker
+
+
+class Command(BaseCommand):
+    """Command to run the background jobs queued by the app"""
+    help = 'Runs the background jobs of the Streamflow Prediction Tool ' \
+           '(e.g. GeoServer and data store uploads) queued in the database.'
+
+    def add_arguments(self, parser):
+        """Add command arguments."""
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes.')
+        parser.add_argument('--poll-seconds', type=float,
+                            default=JOB_POLL_SECONDS,
+                            help='Seconds between checks for new jobs.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when there are no pending jobs.')
+
+    def handle(self, *args, **options):
+        """Method run when command called."""
+        worker_kwargs = {
+            'poll_seconds': options['poll_seconds'],
+            'run_once': options['once'],
+        }
+        if options['workers'] <= 1:
+            run_job_worker(**worker_kwargs)
+            return
+
+        # the workers claim jobs from the queue in the database
+        workers = [Process(target=run_job_worker,
+                           kwargs=worker_kwargs,
+                           name='spt-job-worker-{0}'.format(worker_index))
+                   for worker_index in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""test_forecast_statistics.py
+
+    Tests of the statistics and probabilities of the ensemble forecast.
+
+    License: BSD 3-Clause
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray
+
+from ..controllers_functions import (compute_forecast_probabilities,
+                                     compute_forecast_statistics)
+from ..forecast_statistics import compute_ensemble_statistics
+from ..functions import M3_TO_FT3
+
+RETURN_PERIOD_DATA = {'max': '30.0', 'twenty': '20.0', 'ten': '10.0',
+                      'two': '2.0'}
+
+
+def _merged_forecast(ensemble_values):
+    """
+    Returns a merged (ensemble, time) forecast of one reach
+    """
+    ensemble_values = np.asarray(ensemble_values, dtype=np.float32)
+    num_members, num_time_steps = ensemble_values.shape
+    time_values = pd.date_range('2017-01-01 00:00', '2017-01-01 12:00',
+                                periods=num_time_steps).values
+    return xarray.DataArray(
+        ensemble_values,
+        dims=['ensemble', 'time'],
+        coords={'ensemble': np.arange(1, num_members + 1),
+                'time': time_values},
+        name='Qout')
+
+
+class TestEnsembleStatistics(unittest.TestCase):
+    """
+    Tests of the one pass ensemble statistics
+    """
+    def test_matches_numpy(self):
+        """The statistics match numpy over several blocks"""
+        ensemble_values = np.random.RandomState(0) \
+            .gamma(2.0, 50.0, (52, 7, 3)).astype(np.float32)
+
+        statistics = compute_ensemble_statistics(ensemble_values,
+                                                 block_size=4)
+
+        mean_values = ensemble_values.astype(np.float64).mean(axis=0)
+        std_values = ensemble_values.astype(np.float64).std(axis=0)
+        min_values = ensemble_values.min(axis=0)
+        self.assertEqual(statistics['mean'].shape, (7, 3))
+        np.testing.assert_allclose(statistics['mean'], mean_values,
+                                   rtol=1e-5)
+        np.testing.assert_allclose(statistics['std_dev_range_upper'],
+                                   mean_values + std_values, rtol=1e-5)
+        np.testing.assert_allclose(
+            statistics['std_dev_range_lower'],
+            np.maximum(mean_values - std_values, min_values), rtol=1e-5)
+        np.testing.assert_array_equal(statistics['min'], min_values)
+        np.testing.assert_array_equal(statistics['max'],
+                                      ensemble_values.max(axis=0))
+
+    def test_missing_member(self):
+        """A missing member makes all statistics NaN"""
+        ensemble_values = np.ones((3, 4), dtype=np.float32)
+        ensemble_values[1, 2] = np.nan
+
+        statistics = compute_ensemble_statistics(ensemble_values)
+
+        for statistic_values in statistics.values():
+            np.testing.assert_array_equal(np.isnan(statistic_values),
+                                          [False, False, True, False])
+
+
+class TestForecastStatistics(unittest.TestCase):
+    """
+    Tests of the statistic series of the merged forecast
+    """
+    def test_high_res(self):
+        """The high resolution member keeps its own time steps"""
+        ensemble_values = np.ones((52, 3), dtype=np.float32)
+        ensemble_values[51] = [5.0, 6.0, np.nan]
+
+        return_dict = compute_forecast_statistics(
+            _merged_forecast(ensemble_values), 'high_res', 'metric')
+
+        self.assertEqual(list(return_dict), ['high_res'])
+        np.testing.assert_array_equal(return_dict['high_res'].values,
+                                      [5.0, 6.0])
+
+    def test_english_units(self):
+        """The statistics are converted to ft3/s"""
+        return_dict = compute_forecast_statistics(
+            _merged_forecast([[1.0, 2.0], [3.0, 4.0]]), 'mean', 'english')
+
+        np.testing.assert_allclose(return_dict['mean'].values,
+                                   np.array([2.0, 3.0]) * M3_TO_FT3,
+                                   rtol=1e-6)
+
+
+class TestForecastProbabilities(unittest.TestCase):
+    """
+    Tests of the percentiles and return period exceedance
+    """
+    def test_percentiles_and_exceedance(self):
+        """The percentiles and exceedance fractions of each time step"""
+        # members 1, 2, ..., 10 at the first step & ten times that after
+        ensemble_values = np.outer(np.arange(1, 11), [1.0, 10.0])
+
+        return_dict = compute_forecast_probabilities(
+            _merged_forecast(ensemble_values), 'metric',
+            return_period_data=RETURN_PERIOD_DATA, percentiles=(10, 50))
+
+        self.assertEqual(list(return_dict),
+                         ['percentile_10', 'percentile_50',
+                          'exceedance_2', 'exceedance_10', 'exceedance_20'])
+        np.testing.assert_allclose(return_dict['percentile_10'].values,
+                                   np.percentile(ensemble_values, 10,
+                                                 axis=0))
+        np.testing.assert_allclose(return_dict['percentile_50'].values,
+                                   [5.5, 55.0])
+        np.testing.assert_allclose(return_dict['exceedance_2'].values,
+                                   [0.8, 1.0])
+        # a member equal to the return period does not exceed it
+        np.testing.assert_allclose(return_dict['exceedance_10'].values,
+                                   [0.0, 0.9])
+        np.testing.assert_allclose(return_dict['exceedance_20'].values,
+                                   [0.0, 0.8])
+
+    def test_incomplete_time_steps(self):
+        """The time steps missing from any member are dropped"""
+        merged_ds = _merged_forecast([[1.0, 2.0, 3.0],
+                                      [1.0, np.nan, 3.0]])
+
+        return_dict = compute_forecast_probabilities(
+            merged_ds, 'metric', percentiles=(50,))
+
+        percentile_series = return_dict['percentile_50']
+        self.assertEqual(list(percentile_series.index),
+                         [merged_ds.time.to_index()[0],
+                          merged_ds.time.to_index()[2]])
+        np.testing.assert_array_equal(percentile_series.values, [1.0, 3.0])
+
+    def test_english_units(self):
+        """The members are converted before the thresholds are applied"""
+        merged_ds = _merged_forecast([[1.0], [3.0]])
+
+        return_dict = compute_forecast_probabilities(
+            merged_ds, 'english', return_period_data=RETURN_PERIOD_DATA,
+            percentiles=(50,))
+
+        np.testing.assert_allclose(return_dict['percentile_50'].values,
+                                   [2.0 * M3_TO_FT3], rtol=1e-6)
+        np.testing.assert_array_equal(return_dict['exceedance_20'].values,
+                                      [1.0])
+        # the merged forecast is not modified
+        np.testing.assert_array_equal(merged_ds.values, [[1.0], [3.0]])
+
+    def test_without_return_periods(self):
+        """Only the percentiles are returned without return periods"""
+        return_dict = compute_forecast_probabilities(
+            _merged_forecast([[1.0, 2.0], [3.0, 4.0]]), 'metric')
+
+        self.assertEqual(list(return_dict),
+                         ['percentile_10', 'percentile_25', 'percentile_50',
+                          'percentile_75', 'percentile_90'])
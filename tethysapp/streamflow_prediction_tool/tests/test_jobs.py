@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""test_jobs.py
+
+    Tests of the status transitions of the background jobs.
+
+    License: BSD 3-Clause
+"""
+import datetime
+from json import loads as json_loads
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import jobs
+from ..exception_handling import InvalidData
+from ..jobs import (JOB_ERROR, JOB_PENDING, JOB_RUNNING, JOB_SUCCESS,
+                    claim_job, create_job, fail_stale_jobs, recover_jobs,
+                    run_job)
+from ..model import Job
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class JobTestCase(unittest.TestCase):
+    """
+    Runs the jobs with a SQLite job table and without starting threads
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        engine = create_engine(
+            'sqlite:///{0}'.format(os.path.join(self.temp_dir, 'spt.db')))
+        Job.__table__.create(engine)
+        self.session_maker = sessionmaker(bind=engine)
+        self.session = self.session_maker()
+        self.job_worker_enabled = False
+
+        patches = [
+            mock.patch.object(jobs, '_get_session', self.session_maker),
+            mock.patch.object(jobs.app, 'get_custom_setting',
+                              self._get_custom_setting),
+            mock.patch.object(jobs, 'start_job'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.start_job = jobs.start_job
+
+    def tearDown(self):
+        self.session.close()
+        rmtree(self.temp_dir)
+
+    def _get_custom_setting(self, name):
+        """
+        Returns the app settings of the test
+        """
+        return {'enable_job_worker': self.job_worker_enabled}[name]
+
+    def _create_job(self, job_type='test_job', parameters=None,
+                    status=JOB_PENDING, age=None):
+        """
+        Adds a job last updated age ago
+        """
+        job = create_job(self.session, job_type, parameters)
+        job.status = status
+        if age is not None:
+            job.updated_at = datetime.datetime.utcnow() - age
+        self.session.commit()
+        return job.id
+
+    def _get_job(self, job_id):
+        """
+        Returns the job as stored in the database
+        """
+        session = self.session_maker()
+        try:
+            job = session.query(Job).get(job_id)
+            session.expunge(job)
+            return job
+        finally:
+            session.close()
+
+
+class TestJobQueue(JobTestCase):
+    """
+    Tests of the claiming and recovery of the queued jobs
+    """
+    def test_create_job(self):
+        """A new job is pending with its parameters"""
+        job_id = self._create_job(parameters={'watershed_id': 3})
+
+        job = self._get_job(job_id)
+        self.assertEqual(job.status, JOB_PENDING)
+        self.assertEqual(job.progress, 0)
+        self.assertEqual(json_loads(job.parameters), {'watershed_id': 3})
+
+    def test_claim_job_once(self):
+        """A pending job is claimed by one worker only"""
+        job_id = self._create_job()
+
+        other_session = self.session_maker()
+        try:
+            self.assertTrue(claim_job(self.session, job_id))
+            self.assertFalse(claim_job(other_session, job_id))
+        finally:
+            other_session.close()
+        self.assertEqual(self._get_job(job_id).status, JOB_RUNNING)
+
+    def test_fail_stale_jobs(self):
+        """Only the running jobs without recent progress are failed"""
+        stale_age = datetime.timedelta(minutes=jobs.JOB_STALE_MINUTES + 1)
+        stale_job_id = self._create_job(status=JOB_RUNNING, age=stale_age)
+        running_job_id = self._create_job(status=JOB_RUNNING)
+        pending_job_id = self._create_job(age=stale_age)
+
+        fail_stale_jobs(self.session)
+
+        stale_job = self._get_job(stale_job_id)
+        self.assertEqual(stale_job.status, JOB_ERROR)
+        self.assertEqual(stale_job.message,
+                         "The job was interrupted. Please submit it again.")
+        self.assertEqual(self._get_job(running_job_id).status, JOB_RUNNING)
+        self.assertEqual(self._get_job(pending_job_id).status, JOB_PENDING)
+
+    def test_recover_pending_jobs(self):
+        """The pending jobs left by a stopped process are started"""
+        restart_age = \
+            datetime.timedelta(seconds=jobs.JOB_RESTART_SECONDS + 1)
+        old_job_ids = [self._create_job(age=restart_age),
+                       self._create_job(age=restart_age)]
+        self._create_job()
+        self._create_job(status=JOB_SUCCESS, age=restart_age)
+
+        recover_jobs(self.session)
+
+        self.assertEqual([call_args[0][0] for call_args
+                          in self.start_job.call_args_list], old_job_ids)
+
+    def test_recover_with_job_worker(self):
+        """The pending jobs are left to the workers"""
+        self.job_worker_enabled = True
+        self._create_job(
+            age=datetime.timedelta(seconds=jobs.JOB_RESTART_SECONDS + 1))
+
+        recover_jobs(self.session)
+
+        self.start_job.assert_not_called()
+
+
+class TestRunJob(JobTestCase):
+    """
+    Tests of the outcome of a job
+    """
+    def _run_job(self, job_function, parameters=None):
+        """
+        Runs a job of the job function
+        """
+        job_id = self._create_job(parameters=parameters)
+        with mock.patch.dict(jobs.JOB_FUNCTIONS,
+                             {'test_job': job_function}):
+            job_run = run_job(job_id)
+        return job_run, self._get_job(job_id)
+
+    def test_success(self):
+        """The result of the job function is stored"""
+        def job_function(job_id, watershed_id):
+            jobs.update_job(job_id, progress=50)
+            return {'success': "Watershed {0} updated.".format(watershed_id),
+                    'watershed_id': watershed_id}
+
+        job_run, job = self._run_job(job_function, {'watershed_id': 3})
+
+        self.assertTrue(job_run)
+        self.assertEqual(job.status, JOB_SUCCESS)
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.message, "Watershed 3 updated.")
+        self.assertEqual(json_loads(job.result)['watershed_id'], 3)
+
+    def test_user_error(self):
+        """The message of an expected error is shown to the user"""
+        def job_function(job_id):
+            raise InvalidData("Missing drainage line shapefile.")
+
+        job_run, job = self._run_job(job_function)
+
+        self.assertTrue(job_run)
+        self.assertEqual(job.status, JOB_ERROR)
+        self.assertEqual(job.message, "Missing drainage line shapefile.")
+
+    def test_internal_error(self):
+        """The message of an unexpected error is not shown to the user"""
+        def job_function(job_id):
+            raise KeyError('password')
+
+        with mock.patch.object(jobs.LOGGER, 'exception') as log_exception:
+            job_run, job = self._run_job(job_function)
+
+        self.assertTrue(job_run)
+        self.assertEqual(job.status, JOB_ERROR)
+        self.assertEqual(job.message, "Internal Server Error.")
+        self.assertTrue(log_exception.called)
+
+    def test_claimed_job(self):
+        """A job claimed by another worker is not run again"""
+        job_function = mock.Mock()
+        job_id = self._create_job(status=JOB_RUNNING)
+
+        with mock.patch.dict(jobs.JOB_FUNCTIONS,
+                             {'test_job': job_function}):
+            self.assertFalse(run_job(job_id))
+
+        job_function.assert_not_called()
+        self.assertEqual(self._get_job(job_id).status, JOB_RUNNING)
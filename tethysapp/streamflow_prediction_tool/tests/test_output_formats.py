@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""test_output_formats.py
+
+    Tests of the NetCDF, SPT binary and CSV formats of the REST API.
+
+    License: BSD 3-Clause
+"""
+from io import BytesIO
+import struct
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray
+
+from ..exception_handling import InvalidData
+from ..output_formats import (BINARY_FLAG_TIME, BINARY_MAGIC,
+                              BINARY_VERSION, dataframe_to_binary,
+                              ensemble_to_dataframe, ensemble_to_response,
+                              return_periods_to_response,
+                              time_series_to_response)
+
+
+def read_binary(content):
+    """
+    Reads the SPT binary columnar layout as documented in the REST API
+
+    Returns
+    -------
+    version, flags, column names, time values or None and
+    (column, row) values
+    """
+    magic, version, flags, num_rows, num_columns = \
+        struct.unpack_from('<4sHHII', content)
+    assert magic == BINARY_MAGIC
+    offset = struct.calcsize('<4sHHII')
+    column_names = []
+    for _ in range(num_columns):
+        name_length, = struct.unpack_from('<H', content, offset)
+        column_names.append(
+            content[offset + 2:offset + 2 + name_length].decode('utf-8'))
+        offset += 2 + name_length
+    time_values = None
+    if flags & BINARY_FLAG_TIME:
+        time_values = np.frombuffer(content, '<i8', num_rows, offset) \
+            .astype('datetime64[s]')
+        offset += 8 * num_rows
+    values = np.frombuffer(content, '<f4', num_rows * num_columns, offset) \
+        .reshape(num_columns, num_rows)
+    assert offset + values.nbytes == len(content)
+    return version, flags, column_names, time_values, values
+
+
+def _ensemble_forecast():
+    """
+    Returns a (rivid, ensemble, time) forecast of two reaches
+    """
+    time_values = pd.date_range('2017-01-01 00:00', '2017-01-01 18:00',
+                                periods=4).values
+    return xarray.DataArray(
+        np.arange(2 * 3 * 4, dtype=np.float32).reshape(2, 3, 4),
+        dims=['rivid', 'ensemble', 'time'],
+        coords={'rivid': [5, 7], 'ensemble': [1, 2, 52],
+                'time': time_values},
+        name='Qout')
+
+
+class TestBinaryFormat(unittest.TestCase):
+    """
+    Tests of the SPT binary columnar layout
+    """
+    def test_dataframe_round_trip(self):
+        """The columns and times are read back as written"""
+        data_frame = pd.DataFrame(
+            {'mean': [1.5, np.nan, 3.25], u'débit': [0.0, -1.0, 1e6]},
+            index=pd.date_range('2017-01-01 00:00', '2017-01-01 06:00',
+                                periods=3),
+            columns=['mean', u'débit'])
+
+        version, flags, column_names, time_values, values = \
+            read_binary(dataframe_to_binary(data_frame))
+
+        self.assertEqual(version, BINARY_VERSION)
+        self.assertEqual(flags, BINARY_FLAG_TIME)
+        self.assertEqual(column_names, ['mean', u'débit'])
+        np.testing.assert_array_equal(
+            time_values, data_frame.index.values.astype('datetime64[s]'))
+        np.testing.assert_array_equal(
+            values, data_frame.values.T.astype(np.float32))
+
+    def test_dataframe_without_time(self):
+        """The time column is left out without the time flag"""
+        data_frame = pd.DataFrame({'max': [2.0]})
+
+        _, flags, column_names, time_values, values = \
+            read_binary(dataframe_to_binary(data_frame, include_time=False))
+
+        self.assertEqual(flags, 0)
+        self.assertEqual(column_names, ['max'])
+        self.assertIsNone(time_values)
+        np.testing.assert_array_equal(values, [[2.0]])
+
+    def test_time_series_response(self):
+        """The time series of a binary response are read back"""
+        time_index = pd.date_range('2017-01-01', '2017-01-05', periods=5)
+        time_series = {
+            'Qout': pd.Series(np.linspace(0, 1, 5), index=time_index),
+        }
+
+        response = time_series_to_response(time_series, 'binary',
+                                           'historic', 'metric')
+
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=historic.bin')
+        _, _, column_names, time_values, values = \
+            read_binary(response.content)
+        self.assertEqual(column_names, ['Qout'])
+        np.testing.assert_array_equal(
+            time_values, time_index.values.astype('datetime64[s]'))
+        np.testing.assert_allclose(values[0], np.linspace(0, 1, 5))
+
+    def test_return_periods_response(self):
+        """The return periods are one row without time"""
+        response = return_periods_to_response(
+            {'max': '10.5', 'twenty': '8', 'ten': '6', 'two': '3'},
+            'binary', 'return_periods', 'metric')
+
+        _, flags, column_names, time_values, values = \
+            read_binary(response.content)
+        self.assertEqual(flags, 0)
+        self.assertIsNone(time_values)
+        self.assertEqual(column_names, ['max', 'ten', 'twenty', 'two'])
+        np.testing.assert_array_equal(values[:, 0], [10.5, 6, 8, 3])
+
+    def test_ensemble_response(self):
+        """The streamed ensemble has one column per reach and member"""
+        ensemble_ds = _ensemble_forecast()
+
+        response = ensemble_to_response(ensemble_ds, 'binary', 'ensemble',
+                                        'metric')
+
+        _, _, column_names, time_values, values = \
+            read_binary(b''.join(response.streaming_content))
+        self.assertEqual(column_names[:3], ['5_ensemble_1', '5_ensemble_2',
+                                            '5_ensemble_52'])
+        self.assertEqual(column_names[3:], ['7_ensemble_1', '7_ensemble_2',
+                                            '7_ensemble_52'])
+        np.testing.assert_array_equal(
+            time_values, ensemble_ds.time.values.astype('datetime64[s]'))
+        np.testing.assert_array_equal(values,
+                                      ensemble_ds.values.reshape(6, 4))
+
+
+class TestNetCDFFormat(unittest.TestCase):
+    """
+    Tests of the NetCDF responses
+    """
+    def test_time_series_response(self):
+        """The series, units and attributes are read back"""
+        time_index = pd.date_range('2017-01-01', '2017-01-03', periods=3)
+        time_series = {
+            'mean': pd.Series([1.0, 2.0, 3.0], index=time_index),
+            'exceedance_2': pd.Series([0.0, 0.5, 1.0], index=time_index),
+        }
+
+        response = time_series_to_response(
+            time_series, 'netcdf', 'forecast', 'english',
+            attributes={'rivid': 5},
+            variable_units={'exceedance_2': 'fraction'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-netcdf')
+        with xarray.open_dataset(BytesIO(response.content)) as qout_ds:
+            np.testing.assert_array_equal(qout_ds.time.values,
+                                          time_index.values)
+            np.testing.assert_array_equal(qout_ds['mean'].values,
+                                          [1.0, 2.0, 3.0])
+            self.assertEqual(qout_ds['mean'].attrs['units'], 'ft3/s')
+            self.assertEqual(qout_ds['exceedance_2'].attrs['units'],
+                             'fraction')
+            self.assertEqual(qout_ds.attrs['rivid'], 5)
+
+    def test_ensemble_response(self):
+        """The ensemble keeps its dimensions"""
+        ensemble_ds = _ensemble_forecast()
+
+        response = ensemble_to_response(ensemble_ds, 'netcdf', 'ensemble',
+                                        'metric', attributes={'rivid': 5})
+
+        with xarray.open_dataset(BytesIO(response.content)) as qout_ds:
+            self.assertEqual(qout_ds.Qout.dims, ('rivid', 'ensemble', 'time'))
+            np.testing.assert_array_equal(qout_ds.Qout.values,
+                                          ensemble_ds.values)
+            np.testing.assert_array_equal(qout_ds.ensemble.values,
+                                          [1, 2, 52])
+
+
+class TestCSVFormat(unittest.TestCase):
+    """
+    Tests of the CSV responses
+    """
+    def test_ensemble_response(self):
+        """The streamed CSV has one row per reach and time step"""
+        ensemble_ds = _ensemble_forecast()
+
+        response = ensemble_to_response(ensemble_ds, 'csv', 'ensemble',
+                                        'metric')
+
+        rows = b''.join(response.streaming_content).decode('utf-8') \
+            .splitlines()
+        self.assertEqual(rows[0], 'rivid,datetime,ensemble_1 (m3/s),'
+                                  'ensemble_2 (m3/s),ensemble_52 (m3/s)')
+        self.assertEqual(len(rows), 1 + 2 * 4)
+        self.assertEqual(rows[1], '5,2017-01-01 00:00:00,0.0,4.0,8.0')
+        self.assertEqual(rows[-1], '7,2017-01-01 18:00:00,15.0,19.0,23.0')
+
+    def test_invalid_return_format(self):
+        """An unknown return format is an input error"""
+        with self.assertRaises(InvalidData):
+            ensemble_to_response(_ensemble_forecast(), 'xml', 'ensemble',
+                                 'metric')
+
+
+class TestEnsembleDataFrame(unittest.TestCase):
+    """
+    Tests of the flattening of the ensemble forecast
+    """
+    def test_columns(self):
+        """The members are columns named by reach and member"""
+        ensemble_ds = _ensemble_forecast()
+
+        data_frame = ensemble_to_dataframe(ensemble_ds)
+
+        self.assertEqual(list(data_frame.columns)[-1], '7_ensemble_52')
+        np.testing.assert_array_equal(data_frame['7_ensemble_2'].values,
+                                      ensemble_ds.values[1, 1])
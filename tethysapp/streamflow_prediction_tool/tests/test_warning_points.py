@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""test_warning_points.py
+
+    Tests of the bounding box queries and clustering of warning points.
+
+    License: BSD 3-Clause
+"""
+import json
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from ..warning_points import (CLUSTER_MAX_ZOOM, query_warning_points,
+                              query_watersheds_warning_points)
+
+
+def _warning_point(lon, lat, size=1, peak_date="2017-01-02"):
+    """
+    Returns a warning point GeoJSON feature
+    """
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+        'properties': {'peak_date': peak_date, 'size': size},
+    }
+
+
+def _feature_coordinates(warning_points):
+    """
+    Returns the coordinates of the features of a GeoJSON dictionary
+    """
+    return [feature['geometry']['coordinates']
+            for feature in warning_points['features']]
+
+
+class TestQueryWarningPoints(unittest.TestCase):
+    """
+    Tests of the warning points of one file
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.warning_points_file = \
+            os.path.join(self.temp_dir, "return_10_points.geojson")
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def _write_warning_points(self, features, file_mtime=None):
+        """
+        Writes the warning points file
+        """
+        with open(self.warning_points_file, 'w') as outfile:
+            json.dump({'type': 'FeatureCollection', 'features': features},
+                      outfile)
+        if file_mtime is not None:
+            os.utime(self.warning_points_file, (file_mtime, file_mtime))
+
+    def test_bbox(self):
+        """Only the points in the bounding box are returned in order"""
+        self._write_warning_points([
+            _warning_point(-105.5, 39.5),
+            _warning_point(-90.0, 30.0),
+            _warning_point(-104.0, 40.0),
+            _warning_point(10.0, 45.0),
+            _warning_point(-104.0, 42.5),
+        ])
+
+        warning_points = query_warning_points(self.warning_points_file,
+                                              bbox=(-106, 39, -103, 41))
+
+        self.assertEqual(warning_points['type'], 'FeatureCollection')
+        self.assertEqual(_feature_coordinates(warning_points),
+                         [[-105.5, 39.5], [-104.0, 40.0]])
+
+    def test_all_points(self):
+        """All points are returned without a bounding box or zoom"""
+        features = [_warning_point(-105.5, 39.5), _warning_point(10.0, 45.0)]
+        self._write_warning_points(features)
+
+        warning_points = query_warning_points(self.warning_points_file)
+
+        self.assertEqual(warning_points['features'], features)
+
+    def test_empty_file(self):
+        """A file without warning points returns no features"""
+        self._write_warning_points([])
+
+        warning_points = query_warning_points(self.warning_points_file,
+                                              bbox=(-180, -90, 180, 90),
+                                              zoom=3)
+
+        self.assertEqual(warning_points['features'], [])
+
+    def test_clusters(self):
+        """Nearby points with the same peak date are clustered"""
+        self._write_warning_points([
+            _warning_point(-105.0, 40.0, size=2),
+            _warning_point(-105.1, 40.1, size=5),
+            _warning_point(-105.05, 40.05, size=3,
+                           peak_date="2017-01-03"),
+            _warning_point(20.0, -10.0, size=4),
+        ])
+
+        warning_points = query_warning_points(self.warning_points_file,
+                                              bbox=(-180, -90, 180, 90),
+                                              zoom=3)
+
+        features = warning_points['features']
+        self.assertEqual(len(features), 3)
+        cluster_properties = features[0]['properties']
+        self.assertEqual(cluster_properties['point_count'], 2)
+        self.assertEqual(cluster_properties['size'], 5)
+        self.assertEqual(cluster_properties['peak_date'], "2017-01-02")
+        lon, lat = features[0]['geometry']['coordinates']
+        self.assertAlmostEqual(lon, -105.05)
+        self.assertAlmostEqual(lat, 40.05)
+        # points alone in their cluster are kept as they are
+        self.assertEqual(features[1], _warning_point(-105.05, 40.05, size=3,
+                                                     peak_date="2017-01-03"))
+        self.assertEqual(features[2], _warning_point(20.0, -10.0, size=4))
+
+    def test_no_clusters_zoomed_in(self):
+        """The points are not clustered above CLUSTER_MAX_ZOOM"""
+        features = [_warning_point(-105.0, 40.0),
+                    _warning_point(-105.1, 40.1)]
+        self._write_warning_points(features)
+
+        warning_points = query_warning_points(self.warning_points_file,
+                                              bbox=(-106, 39, -104, 41),
+                                              zoom=CLUSTER_MAX_ZOOM + 1)
+
+        self.assertEqual(warning_points['features'], features)
+
+    def test_modified_file(self):
+        """The index is rebuilt when the file is modified"""
+        self._write_warning_points([_warning_point(-105.0, 40.0)],
+                                   file_mtime=1000000000)
+        query_warning_points(self.warning_points_file)
+        self._write_warning_points([_warning_point(10.0, 45.0)],
+                                   file_mtime=1000000060)
+
+        warning_points = query_warning_points(self.warning_points_file)
+
+        self.assertEqual(_feature_coordinates(warning_points),
+                         [[10.0, 45.0]])
+
+
+class TestQueryWatershedsWarningPoints(unittest.TestCase):
+    """
+    Tests of the warning points of several watersheds
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def _write_warning_points(self, watershed_folder, forecast_folder,
+                              return_period, features):
+        """
+        Writes the warning points file of a watershed forecast
+        """
+        forecast_directory = os.path.join(self.temp_dir, watershed_folder,
+                                          forecast_folder)
+        if not os.path.isdir(forecast_directory):
+            os.makedirs(forecast_directory)
+        with open(os.path.join(forecast_directory,
+                               "return_{0}_points.geojson"
+                               .format(return_period)), 'w') as outfile:
+            json.dump({'type': 'FeatureCollection', 'features': features},
+                      outfile)
+
+    def test_most_recent_forecast(self):
+        """The most recent forecast of each watershed is used"""
+        self._write_warning_points("nepal-central", "20170101.0", 2,
+                                   [_warning_point(85.0, 28.0)])
+        self._write_warning_points("nepal-central", "20170102.0", 2,
+                                   [_warning_point(85.5, 28.5)])
+        self._write_warning_points("peru-amazon", "20170101.12", 10,
+                                   [_warning_point(-75.0, -10.0)])
+
+        watersheds_warning_points = query_watersheds_warning_points(
+            self.temp_dir,
+            [("Nepal", "Central"), ("Peru", "Amazon"), ("Chile", "Maule")],
+            [2, 10])
+
+        self.assertEqual(
+            [(warning_points['watershed_name'],
+              warning_points['return_period'],
+              warning_points['forecast_folder'],
+              _feature_coordinates(warning_points))
+             for warning_points in watersheds_warning_points],
+            [("Nepal", 2, "20170102.0", [[85.5, 28.5]]),
+             ("Peru", 10, "20170101.12", [[-75.0, -10.0]])])
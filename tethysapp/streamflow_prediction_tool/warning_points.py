@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""warning_points.py
+
+    This module returns the warning points of a forecast in a bounding
+    box of the map. The points of each warning points file are indexed
+    once in a grid of INDEX_CELL_DEGREES cells, so a request only
+    checks the points of the cells in the bounding box. At low zoom
+    levels, the points are clustered on the server so that the map
+    does not load thousands of points it cannot show. The most recent
+    forecast folder of each watershed is also kept, so the warning
+    points of many watersheds can be returned in one request.
+
+    License: BSD 3-Clause
+"""
+from collections import OrderedDict
+import os
+import threading
+
+import numpy as np
+
+from .data_access import read_warning_points
+from .functions import format_name
+
+# size of the cells of the warning point index in degrees
+INDEX_CELL_DEGREES = 1.0
+# number of warning point files with an index kept in memory
+INDEX_CACHE_SIZE = 32
+# highest zoom level with clustered warning points
+CLUSTER_MAX_ZOOM = 9
+# size of the clusters in pixels of the map (256 pixel tiles)
+CLUSTER_PIXELS = 40
+
+# warning points file -> (modification time, index)
+_INDEXES = OrderedDict()
+# watershed forecast directory -> (modification time, most recent folder)
+_FORECAST_FOLDERS = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def _group_cells(cell_columns, cell_rows, group_codes=None):
+    """
+    Groups the points by cell (and group code, e.g. the peak date)
+
+    Returns
+    -------
+    the group of each point and the number of points in each group
+    """
+    cell_columns = cell_columns - cell_columns.min()
+    cell_rows = cell_rows - cell_rows.min()
+    cell_keys = cell_columns * (cell_rows.max() + 1) + cell_rows
+    if group_codes is not None:
+        cell_keys += group_codes * (cell_keys.max() + 1)
+    _, point_groups, group_counts = np.unique(cell_keys,
+                                              return_inverse=True,
+                                              return_counts=True)
+    return point_groups.ravel(), group_counts
+
+
+def _build_index(warning_points):
+    """
+    Indexes the warning points of a GeoJSON dictionary by grid cell
+    """
+    features = [feature for feature in warning_points.get('features', [])
+                if feature.get('geometry')]
+    coordinates = np.array(
+        [feature['geometry']['coordinates'][:2] for feature in features],
+        dtype=np.float64).reshape(-1, 2)
+    peak_dates, date_codes = np.unique(
+        [feature['properties'].get('peak_date', "")
+         for feature in features], return_inverse=True)
+    index = {
+        'features': features,
+        'coordinates': coordinates,
+        'peak_dates': peak_dates,
+        'date_codes': date_codes.ravel(),
+        'sizes': np.array([feature['properties'].get('size', 0)
+                           for feature in features], dtype=np.int64),
+        'cells': {},
+    }
+    if not features:
+        return index
+
+    cells = np.floor(coordinates / INDEX_CELL_DEGREES).astype(np.int64)
+    point_cells = _group_cells(cells[:, 0], cells[:, 1])[0]
+    cell_order = np.argsort(point_cells, kind='mergesort')
+    cell_starts = np.flatnonzero(np.diff(point_cells[cell_order])) + 1
+    for cell_points in np.split(cell_order, cell_starts):
+        index['cells'][tuple(cells[cell_points[0]].tolist())] = cell_points
+    return index
+
+
+def get_warning_point_index(warning_points_file):
+    """
+    Returns the index of the warning points file. The index is built
+    once and rebuilt when the file is modified.
+    """
+    file_mtime = os.path.getmtime(warning_points_file)
+    with _INDEXES_LOCK:
+        index_info = _INDEXES.pop(warning_points_file, None)
+        if index_info is not None and index_info[0] == file_mtime:
+            _INDEXES[warning_points_file] = index_info
+            return index_info[1]
+
+    # build outside of the lock as it can take a while
+    index = _build_index(read_warning_points(warning_points_file))
+    with _INDEXES_LOCK:
+        _INDEXES[warning_points_file] = (file_mtime, index)
+        while len(_INDEXES) > INDEX_CACHE_SIZE:
+            _INDEXES.popitem(last=False)
+    return index
+
+
+def get_most_recent_forecast_folder(path_to_output_files):
+    """
+    Returns the most recent forecast folder in the forecast directory
+    of a watershed or None. The folders are listed again when one is
+    added or removed (the directory is modified).
+    """
+    directory_mtime = os.path.getmtime(path_to_output_files)
+    with _INDEXES_LOCK:
+        folder_info = _FORECAST_FOLDERS.get(path_to_output_files)
+    if folder_info is not None and folder_info[0] == directory_mtime:
+        return folder_info[1]
+
+    directory_list = \
+        sorted([d for d in os.listdir(path_to_output_files)
+                if os.path.isdir(os.path.join(path_to_output_files, d))],
+               reverse=True)
+    forecast_folder = directory_list[0] if directory_list else None
+    with _INDEXES_LOCK:
+        _FORECAST_FOLDERS[path_to_output_files] = \
+            (directory_mtime, forecast_folder)
+    return forecast_folder
+
+
+def _bbox_point_indices(index, bbox):
+    """
+    Returns the indices of the points in the bounding box
+    in the order of the file
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    min_column, min_row = np.floor(
+        np.array([min_lon, min_lat]) / INDEX_CELL_DEGREES).astype(int)
+    max_column, max_row = np.floor(
+        np.array([max_lon, max_lat]) / INDEX_CELL_DEGREES).astype(int)
+    num_bbox_cells = (max_column - min_column + 1) * \
+        (max_row - min_row + 1)
+    # check the indexed cells if there are fewer than in the bounding box
+    if num_bbox_cells > len(index['cells']):
+        cell_points = [
+            cell_points
+            for (cell_column, cell_row), cell_points in index['cells'].items()
+            if min_column <= cell_column <= max_column and
+            min_row <= cell_row <= max_row
+        ]
+    else:
+        cell_points = [
+            index['cells'][(cell_column, cell_row)]
+            for cell_column in range(min_column, max_column + 1)
+            for cell_row in range(min_row, max_row + 1)
+            if (cell_column, cell_row) in index['cells']
+        ]
+    if not cell_points:
+        return np.array([], dtype=np.int64)
+
+    point_indices = np.sort(np.concatenate(cell_points))
+    lons, lats = index['coordinates'][point_indices].T
+    return point_indices[(lons >= min_lon) & (lons <= max_lon) &
+                         (lats >= min_lat) & (lats <= max_lat)]
+
+
+def _cluster_features(index, point_indices, zoom):
+    """
+    Clusters the points with the same peak date within CLUSTER_PIXELS
+    cells at the zoom level. A cluster is a point at the mean location
+    of its points with the number of points (point_count) and the
+    largest size of its points. Points alone in their cell are kept.
+    """
+    cluster_degrees = CLUSTER_PIXELS * 360.0 / (256 * 2 ** zoom)
+    coordinates = index['coordinates'][point_indices]
+    date_codes = index['date_codes'][point_indices]
+    cells = np.floor(coordinates / cluster_degrees).astype(np.int64)
+    point_clusters, cluster_counts = \
+        _group_cells(cells[:, 0], cells[:, 1], date_codes)
+
+    num_clusters = cluster_counts.size
+    cluster_lons = np.bincount(point_clusters, weights=coordinates[:, 0],
+                               minlength=num_clusters) / cluster_counts
+    cluster_lats = np.bincount(point_clusters, weights=coordinates[:, 1],
+                               minlength=num_clusters) / cluster_counts
+    cluster_sizes = np.zeros(num_clusters, dtype=np.int64)
+    np.maximum.at(cluster_sizes, point_clusters,
+                  index['sizes'][point_indices])
+    # first point of each cluster (assigned last, so it is kept)
+    cluster_points = np.empty(num_clusters, dtype=np.int64)
+    cluster_points[point_clusters[::-1]] = point_indices[::-1]
+
+    features = []
+    for cluster_index in np.argsort(cluster_points, kind='mergesort'):
+        point_index = cluster_points[cluster_index]
+        if cluster_counts[cluster_index] == 1:
+            features.append(index['features'][point_index])
+            continue
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [float(cluster_lons[cluster_index]),
+                                float(cluster_lats[cluster_index])],
+            },
+            'properties': {
+                'peak_date':
+                    index['peak_dates'][index['date_codes'][point_index]],
+                'size': int(cluster_sizes[cluster_index]),
+                'point_count': int(cluster_counts[cluster_index]),
+            },
+        })
+    return features
+
+
+def query_warning_points(warning_points_file, bbox=None, zoom=None):
+    """
+    Returns the warning points in the bounding box as a GeoJSON
+    dictionary. Up to CLUSTER_MAX_ZOOM, the points are clustered.
+
+    Parameters
+    ----------
+    warning_points_file: str
+        Path to the GeoJSON warning points file.
+    bbox: tuple, optional
+        (min_lon, min_lat, max_lon, max_lat) in degrees.
+        All points are returned if None.
+    zoom: int, optional
+        Zoom level of the map. The points are not clustered if None.
+    """
+    index = get_warning_point_index(warning_points_file)
+    if bbox is None:
+        point_indices = np.arange(len(index['features']))
+    else:
+        point_indices = _bbox_point_indices(index, bbox)
+    if zoom is not None and zoom <= CLUSTER_MAX_ZOOM \
+            and point_indices.size:
+        features = _cluster_features(index, point_indices, zoom)
+    else:
+        features = [index['features'][point_index]
+                    for point_index in point_indices]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def query_watersheds_warning_points(path_to_ecmwf_rapid_output, watersheds,
+                                    return_periods, forecast_folder=None,
+                                    bbox=None, zoom=None):
+    """
+    Returns the warning points of several watersheds for each return
+    period. Watersheds without forecasts or warning points are skipped.
+
+    Parameters
+    ----------
+    path_to_ecmwf_rapid_output: str
+        Path to the ECMWF forecast folder of the app.
+    watersheds: list
+        (watershed_name, subbasin_name) of the ECMWF forecasts.
+    return_periods: list
+        Return periods of the warning points (2, 10 and/or 20).
+    forecast_folder: str, optional
+        Forecast date folder. The most recent one of each watershed
+        is used if None.
+    bbox: tuple, optional
+        (min_lon, min_lat, max_lon, max_lat) in degrees.
+    zoom: int, optional
+        Zoom level of the map.
+
+    Returns
+    -------
+    list of GeoJSON dictionaries with the watershed_name, subbasin_name,
+    return_period and forecast_folder of each warning points file
+    """
+    watersheds_warning_points = []
+    for watershed_name, subbasin_name in OrderedDict.fromkeys(watersheds):
+        path_to_output_files = \
+            os.path.join(path_to_ecmwf_rapid_output,
+                         "{0}-{1}".format(format_name(watershed_name),
+                                          format_name(subbasin_name)))
+        watershed_forecast_folder = forecast_folder
+        if not watershed_forecast_folder \
+                and os.path.isdir(path_to_output_files):
+            watershed_forecast_folder = \
+                get_most_recent_forecast_folder(path_to_output_files)
+        if not watershed_forecast_folder:
+            continue
+
+        for return_period in return_periods:
+            warning_points_file = \
+                os.path.join(path_to_output_files, watershed_forecast_folder,
+                             "return_{0}_points.geojson"
+                             .format(return_period))
+            if not os.path.exists(warning_points_file):
+                continue
+            warning_points = \
+                query_warning_points(warning_points_file, bbox, zoom)
+            warning_points.update({
+                'watershed_name': watershed_name,
+                'subbasin_name': subbasin_name,
+                'return_period': return_period,
+                'forecast_folder': watershed_forecast_folder,
+            })
+            watersheds_warning_points.append(warning_points)
+    return watersheds_warning_points